@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'app'
+]
+
+import re
+import json
+import time
+from urllib.parse import parse_qsl
+import concha
+import transport
+import tracing
+import metrics
+from syntax_tree import SyntaxTree
+from trick import append_trick, syntactic_trick_errors
+from kernel import async_linker
+
+TRICK_PATH = re.compile(r'^/v1/tricks/(\d+)$')
+
+
+class HTTPError(Exception):
+    """Exception raised to reply an error response.
+
+    Attributes:
+        code -- HTTP status code
+        message -- explanation of the error
+        status -- error status name
+    """
+
+    def __init__(self, code, message='', status='BAD_REQUEST'):
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+async def app(scope, receive, send):
+    """ASGI application exposing the same tricks and documents resources than the Flask one."""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await transport.async_reset()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] == 'http':
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        query = dict(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+        start = time.perf_counter()
+        concha.refresh()
+        try:
+            code, result = await route(scope['method'], scope['path'], body, query)
+        except HTTPError as error:
+            code, result = error.code, {"error": {"code": error.code, "message": error.message, "status": error.status}}
+        label = route_label(scope['path'], code)
+        metrics.requests_total.inc(label, scope['method'], code)
+        metrics.request_seconds.observe(time.perf_counter() - start, label)
+        if isinstance(result, concha.Listing):
+            await send_listing(send, scope, query, result)
+            return
+        if isinstance(result, bytes):  # Already encoded JSON Lines.
+            payload, content_type = result, b'application/x-ndjson'
+        elif isinstance(result, str):  # Metrics text.
+            payload, content_type = result.encode('utf-8'), metrics.CONTENT_TYPE.encode()
+        else:
+            payload, content_type = json.dumps(result).encode('utf-8'), b'application/json'
+        await send({
+            'type': 'http.response.start',
+            'status': code,
+            'headers': [(b'content-type', content_type), (b'content-length', str(len(payload)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+
+async def send_listing(send, scope, query, result):
+    """Stream a Listing chunk by chunk, as JSON Lines if asked (format=jsonl or Accept)."""
+    accept = dict(scope.get('headers', [])).get(b'accept', b'').decode('latin-1')
+    json_lines = query.get('format') == 'jsonl' or 'application/x-ndjson' in accept
+    headers = [(b'content-type', b'application/x-ndjson' if json_lines else b'application/json')]
+    if result.next_token is not None:
+        headers.append((b'x-next-page-token', result.next_token.encode()))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    for chunk in concha.listing_chunks(result.items, json_lines):
+        await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def route_label(path, code):
+    """Return the route of a path as the Flask URL rules name it, so metrics don't have a label per id."""
+    if TRICK_PATH.match(path):
+        return '/v1/tricks/<int:id_>'
+    return 'unknown' if code == 404 else path
+
+
+def listing(listing_factory, query):
+    try:
+        return listing_factory(query)
+    except ValueError as exception:
+        raise HTTPError(400, str(exception), 'INVALID_ARGUMENT')
+
+
+async def route(method, path, body, query=None):
+    """Dispatch a request returning its status code and JSON result, or a Listing to be streamed."""
+    match = TRICK_PATH.match(path)
+    if path == '/v1/tricks':
+        if method == 'GET':
+            return 200, listing(concha.tricks_listing, query or {})
+        return tricks_methods(method, None, body)
+    elif match:
+        return tricks_methods(method, int(match.group(1)), body)
+    elif path == '/v1/tricks:batchCreate':
+        if method != 'POST':
+            raise HTTPError(405, 'Method not allowed', 'METHOD_NOT_ALLOWED')
+        result, status = concha.create_tricks(*concha.read_json_lines(body.splitlines()))
+        return status, result
+    elif path == '/v1/tricks:export':
+        if method != 'GET':
+            raise HTTPError(405, 'Method not allowed', 'METHOD_NOT_ALLOWED')
+        return 200, ''.join(concha.export_tricks()).encode('utf-8')
+    elif path == '/v1/documents':
+        if method == 'GET':
+            return 200, listing(concha.documents_listing, query or {})
+        return await documents_methods(method, body, query or {})
+    elif path == '/metrics':
+        if method != 'GET':
+            raise HTTPError(405, 'Method not allowed', 'METHOD_NOT_ALLOWED')
+        return 200, metrics.exposition()
+    elif path == '/v1/documents:analyzeSyntax':
+        if method != 'POST':
+            raise HTTPError(405, 'Method not allowed', 'METHOD_NOT_ALLOWED')
+        return 200, await SyntaxTree.new_from_text_async(json_body(body, 'text')['text'])
+    else:
+        raise HTTPError(404, 'Resource not found', 'NOT_FOUND')
+
+
+def json_body(body, required=None):
+    """Decode a JSON request body, checking it isn't empty and has the required key if any."""
+    try:
+        result = json.loads(body.decode('utf-8'))
+    except ValueError:
+        result = None
+    if not result or (required is not None and required not in result):
+        raise HTTPError(400, 'A JSON body is required' if required is None else 'A "{}" is required'.format(required))
+    return result
+
+
+def tricks_methods(method, id_, body):
+    """Handles restful methods for tricks resources.
+
+    Changes look concha.tricks up inside changing_tricks(), as it may refresh or thaw the domain.
+    """
+    if id_ is None:
+        if method == 'POST':
+            trick = json_body(body)
+            err = syntactic_trick_errors(trick)
+            if err:
+                raise HTTPError(400, str(err), 'SYNTAX_ERROR')
+            with concha.changing_tricks():
+                id_ = append_trick(trick, concha.tricks)
+                concha.persist('append', id_, trick)
+            return 201, {"id": id_, "message": "trick {} created Ok".format(id_)}
+    else:
+        if id_ not in concha.tricks:
+            raise HTTPError(404, 'Trick not found', 'NOT_FOUND')
+        if method == 'DELETE':
+            with concha.changing_tricks():
+                del concha.tricks[id_]
+                concha.persist('delete', id_)
+            return 200, {"message": "trick {} deleted Ok".format(id_)}
+        elif method == 'PUT':
+            trick = json_body(body)
+            err = syntactic_trick_errors(trick)
+            if err:
+                raise HTTPError(400, str(err), 'SYNTAX_ERROR')
+            with concha.changing_tricks():
+                concha.tricks[id_] = trick
+                concha.persist('set', id_, trick)
+            return 200, {"message": "trick {} modified Ok".format(id_)}
+        elif method == 'GET':
+            return 200, concha.tricks[id_]
+    raise HTTPError(405, 'Method not allowed', 'METHOD_NOT_ALLOWED')
+
+
+async def documents_methods(method, body, query):
+    """Handle restful methods for documents resources."""
+    if method == 'POST':
+        text = json_body(body, 'text')['text']
+        id_ = concha.record_document(text)
+        trace = concha.trace_requested(query)
+        metrics.documents_in_flight.inc()
+        try:
+            if trace or tracing.trace_dir is not None:
+                with tracing.traced('document', id=id_) as trace_:
+                    tree = await SyntaxTree.new_from_text_async(text)
+                    artifact = await async_linker(tree, concha.tricks)
+                if tracing.trace_dir is not None:
+                    tracing.save(trace_, id_)
+            else:
+                trace_ = None
+                tree = await SyntaxTree.new_from_text_async(text)
+                artifact = await async_linker(tree, concha.tricks)
+        finally:
+            metrics.documents_in_flight.dec()
+        result, status = concha.document_result(id_, tree, artifact, trace_ if trace else None)
+        return 201 if status == 200 else status, result
+    raise HTTPError(405, 'Method not allowed', 'METHOD_NOT_ALLOWED')
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Memory held by parsed documents, dict based SyntaxTrees against CompactTrees.
+
+The document history is either synthetic or a JSON dump of GET /v1/documents parsed with the service at --locator.
+Run it from concha/concha as: python -m benchmarks.compact_benchmark [--history documents.json]
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import gc
+import json
+import random
+import argparse
+import tracemalloc
+from syntax_tree import SyntaxTree
+from compact_tree import CompactTree
+
+VOCABULARY = ['mi', 'mamá', 'me', 'mima', 'repite', 'hola', 'la', 'casa', 'es', 'muy', 'grande', 'el', 'perro']
+LABELS = ['nsubj', 'obj', 'iobj', 'det', 'amod', 'advmod', 'obl']
+TAGS = ['noun', 'verb', 'det', 'adj', 'adv', 'pron']
+
+
+def synthetic_gcnl(rnd, length):
+    """Return a GCNL analyzeSyntax response of a random sentence, every token headed by a previous one."""
+    tokens = []
+    for i in range(length):
+        tag = rnd.choice(TAGS)
+        tokens.append({
+            'text': {'content': rnd.choice(VOCABULARY), 'beginOffset': 0},
+            'partOfSpeech': {'Number': rnd.choice(['Sing', 'Plur']), 'fPOS': tag + '++'},
+            'dependencyEdge': {'headTokenIndex': rnd.randrange(i) if i else 0, 'label': rnd.choice(LABELS)
+                               if i else 'root'},
+            'lemma': ''
+        })
+    return {'tokens': tokens, 'language': 'es'}
+
+
+def documents_trees(args):
+    if args.history:
+        with open(args.history) as history:
+            return [SyntaxTree.new_from_text(document['text']) for document in json.load(history)]
+    rnd = random.Random(0)
+    return [SyntaxTree().parse_gcnl(synthetic_gcnl(rnd, rnd.randint(3, 20))) for _ in range(args.documents)]
+
+
+def traced_size(build):
+    """Return the result of build() and the bytes it allocated and still holds."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def compact_trees(args):
+    """Return the CompactTrees of the documents, freeing the dict trees they are built from. Their strings are
+    interned by the CompactTrees, so traced as theirs."""
+    trees = documents_trees(args)
+    compacts = [CompactTree.new_from_tree(tree) for tree in trees]
+    assert all(compact.to_tree() == tree for compact, tree in zip(compacts, trees))
+    return compacts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Syntax trees memory benchmark.')
+    parser.add_argument('--documents', type=int, default=10000, help='synthetic documents')
+    parser.add_argument('--history', type=str, default=None, help='JSON dump of GET /v1/documents')
+    parser.add_argument('-l', '--locator', type=str, default=SyntaxTree.locator)
+    args = parser.parse_args()
+    SyntaxTree.locator = args.locator
+    # Each form is measured on its own, the compact one first as its interned strings and feats are global.
+    compacts, compact_size = traced_size(lambda: compact_trees(args))
+    tokens = sum(len(compact.ids) for compact in compacts)
+    del compacts
+    trees, dict_size = traced_size(lambda: documents_trees(args))
+    print('{:>10} {:>8} {:>14} {:>14}'.format('form', 'trees', 'bytes', 'bytes/token'))
+    print('{:>10} {:>8} {:>14} {:>14.1f}'.format('dict', len(trees), dict_size, dict_size / tokens))
+    print('{:>10} {:>8} {:>14} {:>14.1f}'.format('compact', len(trees), compact_size, compact_size / tokens))
+    print('dict / compact: {:.1f}x'.format(dict_size / compact_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Linearization micro-benchmarks on long sentences: rendering subtrees and replacing a branch (TREAT).
+
+Cached token orders (SyntaxTree.tokens) are timed against rebuilding and sorting the indexed forms of every
+subtree, as every rendering did before. Sentences are shaped as the fake parser does: with a branching of 1
+every word is the object of the former one, with a bigger one trees get shallower.
+
+Run it from concha/concha as: python -m benchmarks.linearize [--lengths 20 100 400] [--branchings 1 4]
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import time
+import argparse
+from syntax_tree import SyntaxTree
+from benchmarks.synthetic import NOUNS
+
+
+def sentence_tree(length, branching):
+    """Return a parsed sentence of length words, every one hanging from a former one as the fake parser does."""
+    lines = []
+    for i in range(length):
+        head = 0 if i == 0 else (i - 1) // branching + 1
+        lines.append('\t'.join([str(i + 1), NOUNS[i % len(NOUNS)], '_', 'X', '_', 'fPOS=X++', str(head),
+                                'root' if i == 0 else 'dep{}'.format((i - 1) % branching), '_', '_']))
+    return SyntaxTree().parse_connl('\n'.join(lines))
+
+
+def subtrees(tree):
+    result, pending = [], list(tree.values())
+    while pending:
+        node = pending.pop()
+        result.append(node)
+        pending.extend(value for key, value in node.items() if isinstance(value, SyntaxTree))
+    return result
+
+
+def rebuilt(node):
+    """The former linearization: indexed forms rebuilt and sorted on every call."""
+    forms = SyntaxTree._indexed_forms(node)
+    return ' '.join(str(forms[key]) for key in sorted(forms))
+
+
+def rebuilt_replacing(tree, reference, text):
+    forms = {}
+    for node in tree.values():
+        forms.update(SyntaxTree._indexed_forms(node, reference, text))
+    return ' '.join(str(forms[key]) for key in sorted(forms))
+
+
+def per_call(function, seconds):
+    """Return the microseconds per call of function, called over and over for about the given seconds."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return elapsed / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SyntaxTree linearization micro-benchmarks.')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[20, 100, 400])
+    parser.add_argument('--branchings', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--seconds', type=float, default=0.5, help='seconds of every case')
+    args = parser.parse_args()
+    print('{:>7} {:>9} {:>22} {:>14} {:>14} {:>8}'.format('words', 'branching', 'case', 'rebuilt us', 'cached us',
+                                                           'speedup'))
+    for length in args.lengths:
+        for branching in args.branchings:
+            tree = sentence_tree(length, branching)
+            nodes = subtrees(tree)
+            branch = nodes[len(nodes) // 2]
+            assert rebuilt_replacing(tree, branch, 'X') == tree.to_string_replacing(branch, 'X')
+            cases = [
+                ('format root', lambda: rebuilt(tree['root']), lambda: format(tree['root'])),
+                ('format every subtree', lambda: [rebuilt(node) for node in nodes],
+                 lambda: [format(node) for node in nodes]),
+                ('replace a branch', lambda: rebuilt_replacing(tree, branch, 'X'),
+                 lambda: tree.to_string_replacing(branch, 'X'))
+            ]
+            for name, former, cached in cases:
+                former_us, cached_us = per_call(former, args.seconds), per_call(cached, args.seconds)
+                print('{:>7} {:>9} {:>22} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(
+                    length, branching, name, former_us, cached_us, former_us / cached_us))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Trick matching cost versus domain size, linear scan against the TrickDomain index and compiled patterns.
+
+Run it from concha/concha as: python -m benchmarks.match_benchmark
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import random
+import timeit
+import argparse
+from syntax_tree import SyntaxTree
+from trick import TrickDomain, match_tricks
+
+LABELS = ['obj', 'nsubj', 'iobj', 'obl', 'advmod']
+
+
+def synthetic_tricks(size, vocabulary, wildcard_ratio=0.05, seed=0):
+    """Return a list of tricks with literal root forms and a few wildcard ones."""
+    rnd = random.Random(seed)
+    tricks = []
+    for i in range(size):
+        root_form = '*algo' if rnd.random() < wildcard_ratio else rnd.choice(vocabulary)
+        label = rnd.choice(LABELS)
+        tricks.append({
+            'given': {'root': {'form': root_form, label: {'form': '*algo'}}},
+            'then': {'200': '{{d[root][{}]}}'.format(label)}
+        })
+    return tricks
+
+
+def synthetic_tree(form, labels):
+    tree = SyntaxTree({'root': SyntaxTree({'id': 0, 'form': form})})
+    for i, label in enumerate(labels):
+        tree['root'][label] = SyntaxTree({'id': i + 1, 'form': 'x{}'.format(i)})
+    return tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trick matching benchmark.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    print('{:>8} {:>14} {:>14} {:>8}'.format('tricks', 'linear (us)', 'indexed (us)', 'speedup'))
+    for size in args.sizes:
+        vocabulary = ['verbo{}'.format(i) for i in range(max(1, size // 10))]
+        tricks = synthetic_tricks(size, vocabulary)
+        domain = TrickDomain(tricks)
+        tree = synthetic_tree(vocabulary[0], LABELS[:2])
+        assert match_tricks(tree, tricks) == match_tricks(tree, domain)
+        linear = min(timeit.repeat(lambda: match_tricks(tree, tricks), number=1, repeat=args.repeat))
+        indexed = min(timeit.repeat(lambda: match_tricks(tree, domain), number=1, repeat=args.repeat))
+        print('{:>8} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(size, linear * 1e6, indexed * 1e6, linear / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""GCNL parsing throughput over synthetic token streams, the iterative builder against the former recursive one.
+
+Run it from concha/concha as: python -m benchmarks.parse_benchmark
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import copy
+import random
+import timeit
+import argparse
+from syntax_tree import SyntaxTree
+
+LABELS = ['nsubj', 'obj', 'iobj', 'det', 'amod', 'advmod', 'obl']
+
+
+def synthetic_tokens(size, shape, seed=0):
+    """Return GCNL tokens: 'flat' hangs every token from the root, 'chain' from the previous one, 'random' mixes."""
+    rnd = random.Random(seed)
+    tokens = []
+    for i in range(size):
+        if i == 0:
+            head = 0
+        elif shape == 'flat':
+            head = 0
+        elif shape == 'chain':
+            head = i - 1
+        else:
+            head = rnd.randrange(i)
+        tokens.append({
+            'text': {'content': 'palabra{}'.format(i), 'beginOffset': 0},
+            'partOfSpeech': {'Number': 'Sing', 'fPOS': 'noun++'},
+            'dependencyEdge': {'headTokenIndex': head, 'label': 'root' if i == 0 else '{}{}'.format(
+                rnd.choice(LABELS), i)},
+            'lemma': ''
+        })
+    return {'tokens': tokens, 'language': 'es'}
+
+
+def recursive_parse_gcnl(gcnl_json):
+    """The former recursive builder, which added children lists to the response."""
+    root = None
+    for idx, token in enumerate(gcnl_json['tokens']):
+        head_index = token['dependencyEdge']['headTokenIndex']
+        if 'children' not in token:
+            token['children'] = []
+        if head_index == idx:
+            root = idx
+        elif 'children' in gcnl_json['tokens'][head_index]:
+            gcnl_json['tokens'][head_index]['children'].append(idx)
+        else:
+            gcnl_json['tokens'][head_index]['children'] = [idx]
+    return recursive_fill_gcnl(root, gcnl_json['tokens'])
+
+
+def recursive_fill_gcnl(index, tokens):
+    label = tokens[index]['dependencyEdge']['label']
+    subtree = SyntaxTree()
+    subtree.update({'id': index})
+    subtree.update({'form': tokens[index]['text']['content']})
+    subtree.update({'lemma': tokens[index]['lemma']})
+    subtree.update({'upostag': tokens[index]['partOfSpeech']['fPOS'].rstrip('+')})
+    subtree.update({'feats': tokens[index]['partOfSpeech']})
+    for child_index in tokens[index]['children']:
+        subtree.update(recursive_fill_gcnl(child_index, tokens))
+    return SyntaxTree({label: subtree})
+
+
+def throughput(parse, gcnl_json, repeat):
+    """Return tokens per second of the best run, or None if the parsing fails (i.e. recursion limit)."""
+    copies = [copy.deepcopy(gcnl_json) for _ in range(repeat)]  # The recursive builder changes its input.
+    try:
+        best = min(timeit.repeat(lambda: parse(copies.pop()), number=1, repeat=repeat))
+    except RecursionError:
+        return None
+    return len(gcnl_json['tokens']) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parsing throughput benchmark.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--shapes', type=str, nargs='+', default=['flat', 'random', 'chain'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print('{:>7} {:>8} {:>18} {:>18}'.format('shape', 'tokens', 'iterative (tok/s)', 'recursive (tok/s)'))
+    for shape in args.shapes:
+        for size in args.sizes:
+            gcnl_json = synthetic_tokens(size, shape)
+            iterative = throughput(lambda x: SyntaxTree().parse_gcnl(x), gcnl_json, args.repeat)
+            recursive = throughput(recursive_parse_gcnl, gcnl_json, args.repeat)
+            print('{:>7} {:>8} {:>18.0f} {:>18}'.format(
+                shape, size, iterative, 'recursion limit' if recursive is None else '{:.0f}'.format(recursive)))
+
+
+if __name__ == '__main__':
+    main()
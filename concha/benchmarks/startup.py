@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Startup benchmark: loading a trick domain from its JSON snapshot against mapping its binary snapshot.
+
+Both ways are timed until the domain is ready to match, and then until the first documents are matched, as
+a mapped domain decodes tricks and compiles their patterns the first time they are candidates.
+
+Run it from concha/concha as: python -m benchmarks.startup [--sizes 10000 100000]
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import json
+import time
+import argparse
+import tempfile
+from syntax_tree import SyntaxTree
+from trick import TrickDomain, match_tricks
+from domain_snapshot import MappedDomain, write_snapshot
+from benchmarks.synthetic import synthetic_domain, synthetic_documents
+
+
+def chained_tree(text):
+    """Return the tree the fake parser gives to a text: every word is the 'obj' of the former one."""
+    root = node = {}
+    words = text.split()
+    for i, word in enumerate(words):
+        node.update({'id': str(i + 1), 'form': word})
+        if i + 1 < len(words):
+            node['obj'] = {}
+            node = node['obj']
+    return SyntaxTree.new_from_dict({'root': root})
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trick domain startup times, JSON against binary snapshots.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--documents', type=int, default=100, help='documents matched after startup')
+    args = parser.parse_args()
+    print('{:>8} {:>8} {:>12} {:>12} {:>12} {:>12}'.format('tricks', 'format', 'size', 'convert s', 'ready s',
+                                                              'matched s'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            tricks = TrickDomain(synthetic_domain(size))
+            trees = [chained_tree(text) for text in synthetic_documents(args.documents, size)]
+            json_path, binary_path = os.path.join(directory, 'snapshot.json'), os.path.join(directory, 'tricks.cnd')
+            with open(json_path, 'w', encoding='utf-8') as snapshot:  # As storage.LogStorage snapshots them.
+                json.dump({'tricks': list(tricks.items()), 'next_ids': {'tricks': tricks.next_id}}, snapshot)
+            _, convert_seconds = timed(lambda: write_snapshot(binary_path, tricks))
+
+            def load_json():
+                with open(json_path, encoding='utf-8') as snapshot_:
+                    state = json.load(snapshot_)
+                return TrickDomain(dict(state['tricks']), state['next_ids']['tricks'])
+
+            for name, path, load in [('json', json_path, load_json), ('binary', binary_path,
+                                                                      lambda: MappedDomain(binary_path))]:
+                domain, ready_seconds = timed(load)
+                matches, match_seconds = timed(lambda: [match_tricks(tree, domain) for tree in trees])
+                assert all(matches)
+                print('{:>8} {:>8} {:>12} {:>12} {:>12.4f} {:>12.4f}'.format(
+                    size, name, os.path.getsize(path), '{:.3f}'.format(convert_seconds) if name == 'binary' else '-',
+                    ready_seconds, ready_seconds + match_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Reproducible benchmark suite: parse, match, link, compile with HTTP calls, TREAT recursion and end to end HTTP.
+
+The fake deterministic parser (fake/parser.py) and the fake servers world (fake/servers.py) are served in-process
+through transport.mount, so no service has to be started and results depend on Concha only. Results are saved
+as JSON to be compared against a former run, flagging the throughputs that regressed beyond a tolerance.
+
+Run it from concha/concha as: python -m benchmarks.suite [--save results.json] [--compare baseline.json]
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+from syntax_tree import SyntaxTree
+from trick import TrickDomain, match_tricks
+import kernel
+import transport
+import concha
+from benchmarks.synthetic import WORLD, synthetic_domain, synthetic_documents, treat_document
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))  # The fake package.
+import fake.parser  # noqa: E402
+import fake.servers  # noqa: E402
+
+LOCATOR = 'fake-parser:7000'
+
+
+def rate(function, items, seconds):
+    """Return the items per second calling function(item) over and over the items for about the given seconds."""
+    done = 0
+    start = time.perf_counter()
+    while True:
+        for item in items:
+            function(item)
+        done += len(items)
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return done / elapsed
+
+
+def bench_parse(args):
+    """Documents parsed per second by depth, through the fake parser without the parsing cache."""
+    return {str(depth): rate(SyntaxTree.new_from_text, synthetic_documents(50, 100, depths=(depth, )), args.seconds)
+            for depth in args.depths}
+
+
+def bench_match(args):
+    """Trees matched per second by trick domain size."""
+    result = {}
+    for size in args.domain_sizes:
+        domain = TrickDomain(synthetic_domain(size))
+        trees = [SyntaxTree.new_from_text(text) for text in synthetic_documents(50, size)]
+        result[str(size)] = rate(lambda tree: match_tricks(tree, domain), trees, args.seconds)
+    return result
+
+
+def bench_link(args):
+    """Documents linked per second by trick domain size, parsing and compiling tricks without HTTP calls."""
+    result = {}
+    for size in args.domain_sizes:
+        domain = TrickDomain(synthetic_domain(size))
+        trees = [SyntaxTree.new_from_text(text) for text in synthetic_documents(50, size)]
+        result[str(size)] = rate(lambda tree: kernel.linker(tree, domain), trees, args.seconds)
+    return result
+
+
+def bench_compile(args):
+    """Documents linked per second when every trick does a GET to the fake world, by concurrent compilations."""
+    result = {}
+    domain = TrickDomain(synthetic_domain(100, get_ratio=1.0))
+    trees = [SyntaxTree.new_from_text(text) for text in synthetic_documents(20, 100)]
+    for workers in (1, 4):
+        kernel.max_in_flight = workers
+        result['workers={}'.format(workers)] = rate(lambda tree: kernel.linker(tree, domain), trees, args.seconds)
+    kernel.max_in_flight = 1
+    return result
+
+
+def bench_treat(args):
+    """Documents linked per second by TREAT recursion depth."""
+    domain = TrickDomain(synthetic_domain(100))
+    return {str(depth): rate(lambda tree: kernel.linker(tree, domain), [SyntaxTree.new_from_text(
+        treat_document(depth))], args.seconds) for depth in args.depths}
+
+
+def bench_http(args):
+    """POST /v1/documents per second through the Flask application, parsing included."""
+    concha.reset()
+    for trick_ in synthetic_domain(1000, get_ratio=0.1):
+        concha.append_trick(trick_, concha.tricks)
+    client = concha.app.test_client()
+    bodies = [json.dumps({'text': text}) for text in synthetic_documents(50, 1000)]
+    try:
+        return {'documents': rate(lambda body: client.post('/v1/documents', data=body,
+                                                           content_type='application/json'), bodies, args.seconds)}
+    finally:
+        concha.reset()
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'match': bench_match,
+    'link': bench_link,
+    'compile': bench_compile,
+    'treat': bench_treat,
+    'http': bench_http
+}
+
+
+def compare(results, baseline, tolerance):
+    """Print every throughput against the baseline one, returning the regressed ones."""
+    regressions = []
+    print('{:>8} {:>14} {:>14} {:>14} {:>8}'.format('bench', 'case', 'baseline/s', 'now/s', 'ratio'))
+    for name, cases in results['benchmarks'].items():
+        for case, value in cases.items():
+            former = baseline.get('benchmarks', {}).get(name, {}).get(case)
+            if former is None:
+                continue
+            ratio = value / former
+            flag = ' REGRESSION' if ratio < 1 - tolerance else ''
+            print('{:>8} {:>14} {:>14.1f} {:>14.1f} {:>7.2f}x{}'.format(name, case, former, value, ratio, flag))
+            if flag:
+                regressions.append((name, case))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concha benchmark suite with an in-process fake parser and world.')
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--domain-sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--seconds', type=float, default=1.0, help='minimum seconds of every case')
+    parser.add_argument('--save', type=str, default=None, help='JSON file to save the results to')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of a former run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='throughput loss flagged as a regression')
+    args = parser.parse_args()
+    SyntaxTree.locator = LOCATOR
+    SyntaxTree.cache = None
+    transport.mount('http://{}/'.format(LOCATOR), fake.parser.app)
+    transport.mount(WORLD + '/', fake.servers.app)
+    results = {
+        'date': str(datetime.datetime.now()).split('.')[0],
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seconds': args.seconds,
+        'benchmarks': {}
+    }
+    for name in args.benchmarks:
+        results['benchmarks'][name] = BENCHMARKS[name](args)
+        for case, value in results['benchmarks'][name].items():
+            print('{:>8} {:>14} {:>14.1f}/s'.format(name, case, value))
+    transport.unmount()
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            if compare(results, json.load(baseline_file), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Reproducible synthetic trick domains and documents, shaped for the deterministic fake parser (fake/parser.py).
+
+With its default branching every word of a document is the 'obj' of the former one, so 'verbo3 casa' matches
+a trick given {"root": {"form": "verbo3", "obj": {"form": "*algo"}}}, and the document depth is its length.
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import random
+
+WORLD = 'http://fake-world'  # Prefix the fake servers mock is mounted on.
+NOUNS = ['casa', 'perro', 'mamá', 'servidor', 'proceso', 'mesa', 'libro', 'tren', 'luz', 'agua']
+
+
+def verb(i):
+    return 'verbo{}'.format(i)
+
+
+def echo_trick(i):
+    """A trick without 'when', just rendering its 'then' text."""
+    return {
+        'given': {'root': {'form': verb(i), 'obj': {'form': '*algo'}}},
+        'then': {'200': 'hecho {d[root][obj]}'}
+    }
+
+
+def get_trick(i):
+    """A trick calling the fake servers mock."""
+    return {
+        'given': {'root': {'form': verb(i), 'obj': {'form': '*algo'}}},
+        'when': {'method': 'GET', 'uri': WORLD + '/v1/servers'},
+        'then': {'200': 'consultado {d[root][obj]}'}
+    }
+
+
+def treat_trick():
+    """The TREAT trick linking the object of 'trata' first, so 'trata trata hola' recurses twice."""
+    return {
+        'given': {'root': {'form': 'trata'}},
+        'when': {'method': 'TREAT', 'uri': '{d[root][obj]}'},
+        'then': {'200': '{r[root]}'}
+    }
+
+
+def greet_trick():
+    return {'given': {'root': {'form': 'hola'}}, 'then': {'200': 'adiós'}}
+
+
+def synthetic_domain(size, get_ratio=0.0, seed=0):
+    """Return a list of size tricks on verbs verbo0..verbo<size - 1>, a get_ratio of them calling the fake world.
+
+    The TREAT and greeting tricks are appended, so TREAT documents can be linked against any domain.
+    """
+    rnd = random.Random(seed)
+    tricks = [get_trick(i) if rnd.random() < get_ratio else echo_trick(i) for i in range(size)]
+    return tricks + [treat_trick(), greet_trick()]
+
+
+def synthetic_documents(count, domain_size, depths=(2, 3, 5, 8), seed=0):
+    """Return count document texts starting with a known verb, of the given depths (words) in turn."""
+    rnd = random.Random(seed)
+    documents = []
+    for i in range(count):
+        depth = depths[i % len(depths)]
+        words = [verb(rnd.randrange(domain_size))] + [rnd.choice(NOUNS) for _ in range(depth - 1)]
+        documents.append(' '.join(words))
+    return documents
+
+
+def treat_document(depth):
+    """Return a document recursing depth times through the TREAT trick, ending in a greeting."""
+    return ' '.join(['trata'] * depth + ['hola'])
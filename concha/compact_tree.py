@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'CompactTree', 'Node'
+]
+
+import sys
+import threading
+from array import array
+from collections.abc import Mapping
+from syntax_tree import SyntaxTree, SUBTREE_KEYS
+
+COLUMNS = ('id', 'form', 'lemma', 'upostag')  # Token columns seen as node keys, besides 'feats' and extras.
+
+_feats_table = {}  # Shared feats: sorted items tuple -> feats dict, as most tokens repeat a few of them.
+_feats_lock = threading.Lock()
+
+
+def _shared_feats(feats):
+    key = tuple(sorted((sys.intern(str(k)), sys.intern(str(v))) for k, v in feats.items()))
+    with _feats_lock:
+        shared = _feats_table.get(key)
+        if shared is None:
+            shared = _feats_table[key] = dict(key)
+        return shared
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CompactTree(Mapping):
+    """Read only parsed sentence kept in token columns, seen as the {deprel: node} mapping of its root.
+
+    Strings are interned and feats dicts are shared among tokens and trees. Tokens are stored in
+    depth-first order, so the descendants of a token are a contiguous slice of the columns.
+    """
+
+    __slots__ = ('ids', 'forms', 'lemmas', 'upostags', 'deprels', 'heads', 'feats', 'ends', 'extras', '_str_ids')
+
+    def __init__(self):
+        self.ids = array('l')
+        self.forms = []
+        self.lemmas = []
+        self.upostags = []
+        self.deprels = []
+        self.heads = array('l')  # Position of the head token, -1 for the root.
+        self.feats = []
+        self.ends = array('l')  # Position after the last descendant of every token.
+        self.extras = {}  # Position -> rare keys (xpostag, deps, misc).
+        self._str_ids = False  # CoNNL ids are strings, GCNL ones are integers.
+
+    @staticmethod
+    def new_from_tree(tree):
+        """Build a CompactTree out of a SyntaxTree or its plain dict version."""
+        new = CompactTree()
+        for label, node in tree.items():  # There should be only one root node
+            new._str_ids = isinstance(node['id'], str)
+            pending = [(label, node, -1)]
+            while pending:
+                label, node, head = pending.pop()
+                if head == -2:  # Marker: every descendant of node (a position here) was added.
+                    new.ends[node] = len(new.ids)
+                    continue
+                position = len(new.ids)
+                new.ids.append(int(node['id']))
+                new.forms.append(_intern(node.get('form')))
+                new.lemmas.append(_intern(node.get('lemma')))
+                new.upostags.append(_intern(node.get('upostag')))
+                new.deprels.append(sys.intern(label))
+                new.heads.append(head)
+                new.feats.append(_shared_feats(node['feats']) if 'feats' in node else None)
+                new.ends.append(0)
+                extra = {k: node[k] for k in SUBTREE_KEYS if k in node and k not in COLUMNS and k != 'feats'}
+                if extra:
+                    new.extras[position] = extra
+                pending.append((None, position, -2))
+                children = [(k, v) for k, v in node.items() if k not in SUBTREE_KEYS and isinstance(v, dict)]
+                for child_label, child in reversed(children):
+                    pending.append((child_label, child, position))
+        return new
+
+    def to_tree(self):
+        """Return the equivalent SyntaxTree."""
+        nodes = []
+        root = SyntaxTree()
+        for position in range(len(self.ids)):
+            node = SyntaxTree(self.node(position).items_of_token())
+            nodes.append(node)
+            head = self.heads[position]
+            dict.__setitem__(nodes[head] if head >= 0 else root, self.deprels[position], node)
+        return root
+
+    def node(self, position):
+        return Node(self, position)
+
+    def children(self, position):
+        """Yield the positions of the direct children of a token."""
+        child = position + 1
+        while child < self.ends[position]:
+            yield child
+            child = self.ends[child]
+
+    def __getitem__(self, key):
+        if self.ids and self.deprels[0] == key:
+            return Node(self, 0)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.deprels[:1])
+
+    def __len__(self):
+        return 1 if self.ids else 0
+
+    def matches(self, tree):
+        """Same as SyntaxTree.matches."""
+        return all(key in self and self[key].matches(tree[key]) for key in tree)
+
+    def to_string_replacing(self, replacement_subtree_reference, replacement_text):
+        """Same as SyntaxTree.to_string_replacing, the reference being a Node of self."""
+        return Node(self, 0).to_string_replacing(replacement_subtree_reference, replacement_text) if self.ids else ''
+
+    def __format__(self, format_spec=None):
+        return format(Node(self, 0)) if self.ids else ''
+
+    def __repr__(self):
+        return 'CompactTree({!r})'.format(self.to_tree())
+
+
+class Node(Mapping):
+    """Lightweight read only view of a token of a CompactTree, behaving as its SyntaxTree node."""
+
+    __slots__ = ('tree', 'position')
+
+    def __init__(self, tree, position):
+        self.tree = tree
+        self.position = position
+
+    def items_of_token(self):
+        """Return the (key, value) pairs of the token itself, without its children."""
+        tree, position = self.tree, self.position
+        items = [('id', str(tree.ids[position]) if tree._str_ids else tree.ids[position])]
+        for key, column in (('form', tree.forms), ('lemma', tree.lemmas), ('upostag', tree.upostags)):
+            if column[position] is not None:
+                items.append((key, column[position]))
+        if tree.feats[position] is not None:
+            items.append(('feats', dict(tree.feats[position])))
+        items.extend(tree.extras.get(position, {}).items())
+        return items
+
+    def __getitem__(self, key):
+        tree, position = self.tree, self.position
+        if key == 'form' and tree.forms[position] is not None:
+            return tree.forms[position]
+        if key in SUBTREE_KEYS:
+            for token_key, value in self.items_of_token():
+                if token_key == key:
+                    return value
+            raise KeyError(key)
+        for child in tree.children(position):
+            if tree.deprels[child] == key:
+                return Node(tree, child)
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key, _ in self.items_of_token():
+            yield key
+        for child in self.tree.children(self.position):
+            yield self.tree.deprels[child]
+
+    def __len__(self):
+        return len(self.items_of_token()) + sum(1 for _ in self.tree.children(self.position))
+
+    def __eq__(self, other):
+        if isinstance(other, Node):
+            return self.tree is other.tree and self.position == other.position
+        return Mapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def matches(self, tree):
+        """Same as SyntaxTree.matches for a node."""
+        for key in tree:
+            if key == 'form':
+                form = self.tree.forms[self.position]
+                if form is None:
+                    return False
+                pattern = tree['form']
+                if pattern[0] == '*':  # Any.
+                    continue
+                if form != (pattern[1:] if pattern[0] == '~' else pattern):  # Similar or Equal.
+                    return False
+            else:
+                try:
+                    child = self[key]
+                except KeyError:
+                    return False
+                if not child.matches(tree[key]):
+                    return False
+        return True
+
+    def _forms(self, replacement=None, replacement_text=''):
+        """Return the (id, form) pairs of the subtree, the replacement node standing for its whole subtree."""
+        tree = self.tree
+        forms = []
+        position, end = self.position, tree.ends[self.position]
+        while position < end:
+            if replacement is not None and replacement.tree is tree and replacement.position == position:
+                forms.append((tree.ids[position], replacement_text))
+                position = tree.ends[position]
+            else:
+                forms.append((tree.ids[position], tree.forms[position]))
+                position += 1
+        forms.sort(key=lambda x: x[0])
+        return forms
+
+    def to_string_replacing(self, replacement_subtree_reference, replacement_text):
+        return ' '.join(str(form) for _, form in self._forms(replacement_subtree_reference, replacement_text))
+
+    def __format__(self, format_spec=None):
+        return ' '.join(str(form) for _, form in self._forms())
+
+    def __repr__(self):
+        return 'Node({!r})'.format(dict(self))
@@ -17,25 +17,159 @@ __author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
 __version__ = '1.0'
 
 import os
+import sys
+import time
+import json
 import argparse
 import datetime
+import threading
+import tempfile
+from itertools import islice
+from contextlib import contextmanager
+from collections import namedtuple
 from syntax_tree import SyntaxTree
-from trick import append_trick, syntactic_trick_errors
+from parse_cache import ParseCache
+import transport
+import tracing
+import metrics
+import trick
+from trick import TrickDomain, append_trick, syntactic_trick_errors, tricks_errors
+from storage import new_storage
+from history import DocumentHistory
+from shared_domain import SharedDomain
+from domain_snapshot import MappedDomain
+from parser_backend import WorkerPool, syntaxnet_command, stub_command, model_directory
+import kernel
 from kernel import linker
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, g
 
 # This is because of the annoying warnings of the standard CPU TF distribution
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # No TF optimization warnings
 app = Flask(__name__)
-tricks = []
-documents = []
+MAX_PAGE_SIZE = 1000
+
+Listing = namedtuple('Listing', ['items', 'next_token'])  # Items iterable and the token of the next page if any.
+
+tricks = TrickDomain()
+documents = DocumentHistory()  # Unbounded unless configured with retention policies.
+storage = None  # Optional Storage persisting tricks and documents.
+state_lock = threading.Lock()  # Changes are logged in the same order they are applied.
+shared = None  # Optional SharedDomain the tricks are read from and published to, among worker processes.
+shared_version = 0  # Version of the shared domain the tricks were loaded from.
 
 
 def reset():
     global tricks
     global documents
-    tricks = []
-    documents = []
+    global storage
+    global shared
+    global shared_version
+    tricks = TrickDomain()
+    documents = DocumentHistory()
+    storage = None
+    shared = None
+    shared_version = 0
+
+
+def restore(storage_):
+    """Load the persisted tricks and documents, building the trick indexes once. Return startup statistics.
+
+    The documents are added to the current history, so its retention policies apply to them.
+    """
+    global tricks
+    global storage
+    state = storage_.load()
+    with state_lock:
+        tricks = TrickDomain(state['tricks'], state['next_ids']['tricks'])
+        trick.error_domain.clear()
+        trick.error_domain.update(state['error_tricks'])
+        trick.error_domain.next_id = max(trick.error_domain.next_id, state['next_ids']['error_tricks'])
+        documents.extend(state['documents'], state['documents_first_id'])
+        storage = storage_
+    return storage.startup
+
+
+def persist(*change):
+    """Log an applied change, compacting the log when due. To be called holding state_lock."""
+    if storage is not None and storage.log(*change):
+        first_id, recent_documents = documents.recent()  # Spilled or dropped documents aren't snapshot.
+        storage.snapshot({
+            'tricks': tricks,
+            'error_tricks': trick.error_domain,
+            'next_ids': {'tricks': tricks.next_id, 'error_tricks': trick.error_domain.next_id},
+            'documents': recent_documents,
+            'documents_first_id': first_id
+        })
+
+
+def share(shared_):
+    """Read the tricks from a SharedDomain from now on, publishing the current ones if it has none yet."""
+    global shared
+    with state_lock, shared_.lock():
+        if shared_.version() == 0:
+            shared_.publish(tricks, trick.error_domain)
+        shared = shared_
+        _refresh()
+
+
+def refresh():
+    """Swap in the latest shared tricks if another worker changed them."""
+    if shared is not None and shared.version() != shared_version:
+        with state_lock:
+            _refresh()
+
+
+def _refresh():
+    """To be called holding state_lock. Requests already linking keep using the tricks they started with."""
+    global shared_version
+    if shared is None or shared.version() == shared_version:
+        return
+    shared_version, tricks_, error_tricks = shared.load()
+    _swap(tricks_, error_tricks)
+
+
+def _swap(tricks_, error_tricks):
+    """Replace the tricks, and the error tricks in place as other modules refer to them. Hold state_lock."""
+    global tricks
+    tricks = tricks_
+    trick.error_domain.clear()
+    trick.error_domain.update(error_tricks)
+    trick.error_domain.next_id = max(trick.error_domain.next_id, error_tricks.next_id)
+
+
+def _thaw():
+    """Make the tricks changeable, as mapped ones are read-only. To be called holding state_lock."""
+    global tricks
+    if isinstance(tricks, MappedDomain):
+        tricks = tricks.thaw()
+
+
+def map_tricks(path):
+    """Serve the tricks of a binary domain snapshot in place, until they are changed. Return their number."""
+    mapped = MappedDomain(path)
+    with state_lock:
+        _swap(mapped, mapped.error_tricks)
+    return len(mapped)
+
+
+@contextmanager
+def changing_tricks():
+    """Hold state_lock to change the tricks, publishing them as a new shared version if they are shared.
+
+    The shared domain is locked among workers meanwhile, and the change is applied to its latest version.
+    Mapped tricks are thawed into a TrickDomain first.
+    """
+    global shared_version
+    with state_lock:
+        if shared is None:
+            _thaw()
+            yield
+            return
+        with shared.lock():
+            _refresh()
+            _thaw()
+            yield
+            shared_version = shared.publish(tricks, trick.error_domain)
 
 
 def error_explained(code, message, status):
@@ -50,15 +184,203 @@ def error_explained(code, message, status):
     return response
 
 
-def process_document(id_, text):
-    tree = SyntaxTree.new_from_text(text)
-    artifact = linker(tree, tricks)
-    return {
+def read_json_lines(lines):
+    """Decode JSON Lines returning the list of objects and a list of (line number, error) of the wrong lines."""
+    objects, errors = [], []
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            objects.append((number, json.loads(line)))
+        except ValueError as exception:
+            errors.append((number, 'Wrong JSON line: "{}"'.format(exception)))
+    return objects, errors
+
+
+def create_tricks(numbered_tricks, line_errors=()):
+    """Validate a batch of (line number, trick) and create all of them at once, or none if any is wrong.
+
+    Return the response body and status code.
+    """
+    errors = [{"line": number, "errors": [error]} for number, error in line_errors]
+    tricks_ = [trick_ for _, trick_ in numbered_tricks]
+    for (number, _), trick_errors in zip(numbered_tricks, tricks_errors(tricks_)):
+        if trick_errors:
+            errors.append({"line": number, "errors": trick_errors})
+    if errors:
+        errors.sort(key=lambda x: x['line'])
+        return {"error": {"code": 400, "message": "No trick created", "status": "SYNTAX_ERROR",
+                          "details": errors}}, 400
+    with changing_tricks():
+        ids = [append_trick(trick_, tricks) for trick_ in tricks_]
+        persist('batch', [['append', id_, trick_] for id_, trick_ in zip(ids, tricks_)])
+    return {"ids": ids, "message": "{} tricks created Ok".format(len(ids))}, 201
+
+
+def export_tricks():
+    """Yield every trick as a JSON line, in id order, followed by the ERROR tricks, which a batchCreate appends
+    to the error domain again."""
+    with state_lock:
+        snapshot = list(tricks.values()) + list(trick.error_domain.values())
+    for trick_ in snapshot:
+        yield json.dumps(trick_, ensure_ascii=False) + '\n'
+
+
+def record_document(text):
+    """Append a document to the history returning its id."""
+    with state_lock:  # Dated inside the lock, so documents are sorted by date.
+        record = {
+            'date': str(datetime.datetime.now()).split('.')[0],
+            'text': text
+        }
+        id_ = documents.append(record)
+        persist('document', record)
+    return id_
+
+
+def documents_listing(query):
+    """Return the Listing of the documents selected by the query parameters (see listing()).
+
+    The startDate (included) and endDate (excluded) filters are 'YYYY-MM-DD HH:MM:SS' prefixes. As the history
+    is sorted by date, the first document is found by bisection. Documents no longer retained are skipped.
+    """
+    start = int(query.get('pageToken') or 0)
+    if query.get('startDate'):
+        start = max(start, documents.first_id_since(query['startDate']))
+    end_date = query.get('endDate')
+
+    def numbered():
+        for id_, document in documents.numbered(start):  # Append only, so it is safe to go on while it grows.
+            if end_date and document['date'] >= end_date:
+                break
+            yield id_, document
+
+    return listing(numbered(), query)
+
+
+def tricks_listing(query):
+    """Return the Listing of the tricks selected by the query parameters (see listing()), in id order.
+
+    Ids are walked lazily from the page token, so a page only costs its tricks and the deleted ids among them.
+    Lookups are atomic, so it is safe to go on while tricks change.
+    """
+    start = int(query.get('pageToken') or 0)
+    domain = tricks  # The one at hand, even if it is swapped meanwhile.
+
+    def numbered():
+        for id_ in range(start, domain.next_id):
+            trick_ = domain.get(id_)
+            if trick_ is not None:
+                yield id_, trick_
+
+    return listing(numbered(), query, with_ids=True)
+
+
+def listing(numbered, query, with_ids=False):
+    """Select a page of (id, item) pairs according to the pageSize and fields query parameters.
+
+    Without a pageSize every item is listed lazily. The fields parameter is a comma separated list of the
+    item keys to keep, 'id' included. Without it items are listed whole, with their 'id' if with_ids (i.e.
+    tricks, whose ids are needed to change them). Raise ValueError on wrong parameters.
+    """
+    fields = [field for field in query.get('fields', '').split(',') if field]
+
+    def project(id_, item):
+        if not fields:
+            return dict(item, id=id_) if with_ids else item
+        return {field: id_ if field == 'id' else item[field] for field in fields if field == 'id' or field in item}
+
+    if not query.get('pageSize'):
+        return Listing((project(id_, item) for id_, item in numbered), None)
+    page_size = int(query['pageSize'])
+    if not 0 < page_size <= MAX_PAGE_SIZE:
+        raise ValueError('pageSize must be between 1 and {}'.format(MAX_PAGE_SIZE))
+    selected = list(islice(numbered, page_size + 1))  # One more to know if there's a next page.
+    next_token = str(selected[page_size][0]) if len(selected) > page_size else None
+    return Listing([project(id_, item) for id_, item in selected[:page_size]], next_token)
+
+
+def listing_chunks(items, json_lines):
+    """Yield the encoded JSON array, or JSON Lines, of the items one by one."""
+    if json_lines:
+        for item in items:
+            yield json.dumps(item) + '\n'
+    else:
+        separator = '['
+        for item in items:
+            yield separator + json.dumps(item)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+
+def listing_response(listing_factory):
+    """Stream the Listing built out of the request arguments, as JSON Lines if asked (format=jsonl or Accept)."""
+    try:
+        result = listing_factory(request.args)
+    except ValueError as exception:
+        return error_explained(400, str(exception), 'INVALID_ARGUMENT')
+    json_lines = request.args.get('format') == 'jsonl' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    response = Response(listing_chunks(result.items, json_lines),
+                        mimetype='application/x-ndjson' if json_lines else 'application/json')
+    if result.next_token is not None:
+        response.headers['X-Next-Page-Token'] = result.next_token
+    return response
+
+
+def process_document(id_, text, trace=False):
+    """Parse and link a document returning the response body and status, with its trace if asked.
+
+    Traces are saved as well when there's a tracing.trace_dir.
+    """
+    metrics.documents_in_flight.inc()
+    try:
+        if not trace and tracing.trace_dir is None:
+            tree = SyntaxTree.new_from_text(text)
+            return document_result(id_, tree, linker(tree, tricks))
+        with tracing.traced('document', id=id_) as trace_:
+            tree = SyntaxTree.new_from_text(text)
+            artifact = linker(tree, tricks)
+    finally:
+        metrics.documents_in_flight.dec()
+    if tracing.trace_dir is not None:
+        tracing.save(trace_, id_)
+    return document_result(id_, tree, artifact, trace_ if trace else None)
+
+
+def document_result(id_, tree, artifact, trace=None):
+    """Build the response body and status of a processed document, with the trace events and breakdown if any."""
+    result = {
         'id': id_,
         'answer_text': '{root}'.format_map(artifact.tree),  # TODO error handling
         'request': tree,
         'tricks': artifact.used_tricks
-    }, int(artifact.status)
+    }
+    if trace is not None:
+        result['trace'] = dict(trace.to_chrome(), breakdown=trace.breakdown())
+    return result, int(artifact.status)
+
+
+def trace_requested(query):
+    """Return whether the trace query parameter asks for the document trace."""
+    return query.get('trace', '').lower() in ('1', 'true')
+
+
+@app.before_request
+def start_request():
+    g.start = time.perf_counter()
+    refresh()
+
+
+@app.after_request
+def account_request(response):
+    """Count the request and observe its latency, by route (the URL rule, not the path with ids)."""
+    route = request.url_rule.rule if request.url_rule is not None else 'unknown'
+    metrics.requests_total.inc(route, request.method, response.status_code)
+    if 'start' in g:
+        metrics.request_seconds.observe(time.perf_counter() - g.start, route)
+    return response
 
 
 @app.route('/v1/tricks', methods=['POST', 'GET'])
@@ -74,19 +396,22 @@ def tricks_methods(id_=None):
             if err:
                 return error_explained(400, str(err), 'SYNTAX_ERROR')
             else:
-                id_ = len(tricks)
-                append_trick(request.json, tricks)
+                with changing_tricks():
+                    id_ = append_trick(request.json, tricks)
+                    persist('append', id_, request.json)
                 response = jsonify({"id": id_, "message": "trick {} created Ok".format(id_)})
                 response.status_code = 201
         elif request.method == 'GET':
-            response = jsonify(tricks)
+            response = listing_response(tricks_listing)
         else:
             abort(400)
     else:
-        if id_ < 0 or len(tricks) <= id_:
+        if id_ not in tricks:
             abort(404)
         if request.method == 'DELETE':
-            tricks.pop(id_)
+            with changing_tricks():
+                del tricks[id_]
+                persist('delete', id_)
             response = jsonify({"message": "trick {} deleted Ok".format(id_)})
         elif request.method == 'PUT':
             if not request.json:
@@ -95,7 +420,9 @@ def tricks_methods(id_=None):
             if err:
                 return error_explained(400, str(err), 'SYNTAX_ERROR')
             else:
-                tricks[id_] = request.json
+                with changing_tricks():
+                    tricks[id_] = request.json
+                    persist('set', id_, request.json)
                 response = jsonify({"message": "trick {} modified Ok".format(id_)})
         elif request.method == 'GET':
             response = jsonify(tricks[id_])
@@ -104,6 +431,21 @@ def tricks_methods(id_=None):
     return response
 
 
+@app.route('/v1/tricks:batchCreate', methods=['POST'])
+def tricks_batch_create():
+    """Create every trick of a JSON Lines body atomically, reporting the errors of every wrong line."""
+    result, status = create_tricks(*read_json_lines(request.stream))
+    response = jsonify(result)
+    response.status_code = status
+    return response
+
+
+@app.route('/v1/tricks:export', methods=['GET'])
+def tricks_export():
+    """Stream every trick as JSON Lines, ready for a batchCreate."""
+    return Response(export_tricks(), mimetype='application/x-ndjson')
+
+
 @app.route('/v1/documents:analyzeSyntax', methods=['POST'])
 def documents_analyze_syntax():
     """Return just a text parsing. No document handling."""
@@ -112,6 +454,20 @@ def documents_analyze_syntax():
     return jsonify(SyntaxTree.new_from_text(request.json['text']))
 
 
+@app.route('/v1/documents:batchAnalyzeSyntax', methods=['POST'])
+def documents_batch_analyze_syntax():
+    """Return the parsing of several texts in a single call. No document handling.
+
+    As the parsing service batch route, a {"requests": [...]} list of analyzeSyntax request bodies is answered
+    with a {"responses": [...]} list in the same order, though of trees as the analyzeSyntax route answers.
+    """
+    try:
+        texts = [body['document']['content'] for body in request.json['requests']]
+    except (KeyError, TypeError):
+        abort(400)
+    return jsonify({"responses": SyntaxTree.new_many_from_texts(texts)})
+
+
 @app.route('/v1/documents', methods=['POST', 'GET'])
 def documents_methods():
     """Handle restful methods for documents resources."""
@@ -119,22 +475,66 @@ def documents_methods():
     if request.method == 'POST':
         if not request.json:
             abort(400)
-        id_ = len(documents)  # Append only.
-        documents.append({
-            'date': str(datetime.datetime.now()).split('.')[0],
-            'text': request.json['text']
-        })
-        result, status = process_document(id_, request.json['text'])
+        id_ = record_document(request.json['text'])
+        result, status = process_document(id_, request.json['text'], trace_requested(request.args))
         response = jsonify(result)
         response.status_code = 201 if status == 200 else status
     elif request.method == 'GET':
-        response = jsonify(documents)
-        response.status_code = 200
+        response = listing_response(documents_listing)
     else:
         abort(400)
     return response
 
 
+@app.route('/v1/stats', methods=['GET'])
+def stats_methods():
+    """Return monitoring statistics of the parsing cache, the linker memo, the TREAT sources, the storage, the
+    document history and the HTTP connection pools."""
+    return jsonify({
+        'parse_cache': SyntaxTree.cache.stats() if SyntaxTree.cache is not None else None,
+        'linker_memo': dict(kernel.memo_stats),
+        'treat': dict(kernel.treat_stats),
+        'storage': storage.stats() if storage is not None else None,
+        'parser_backend': SyntaxTree.backend.stats() if SyntaxTree.backend is not None else None,
+        'documents': documents.stats(),
+        'transport': transport.stats()
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_methods():
+    """Return the service metrics in the Prometheus text format."""
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
+def cache_lookups():
+    if SyntaxTree.cache is None:
+        return None
+    cache_stats = SyntaxTree.cache.stats()
+    return {('hit', ): cache_stats['hits'], ('miss', ): cache_stats['misses']}
+
+
+def memo_lookups():
+    return {(result, ): count for result, count in kernel.memo_stats.items()}
+
+
+metrics.CallbackMetric('concha_parse_cache_lookups_total', 'Parsing cache lookups by result.', cache_lookups,
+                       ['result'], kind='counter')
+metrics.CallbackMetric('concha_parse_cache_hit_ratio', 'Parsing cache hits among lookups.',
+                       lambda: SyntaxTree.cache.stats()['hit_ratio'] if SyntaxTree.cache is not None else None)
+metrics.CallbackMetric('concha_linker_memo_lookups_total', 'Linker memo lookups by result.', memo_lookups,
+                       ['result'], kind='counter')
+metrics.CallbackMetric('concha_treat_sources_total', 'TREAT sources by way of building: grafted, grafted with '
+                       'the linked tree (reused) or reparsed.',
+                       lambda: {(way, ): kernel.treat_stats[way] for way in ('grafted', 'reused', 'reparsed')},
+                       ['way'], kind='counter')
+metrics.CallbackMetric('concha_treat_extra_parser_calls_total', 'Parsings of TREAT replacements which could not be '
+                       'grafted.', lambda: kernel.treat_stats['extra_parses'], kind='counter')
+metrics.CallbackMetric('concha_documents_retained', 'Documents of the history by tier.',
+                       lambda: {('memory', ): documents.stats()['memory_documents'],
+                                ('disk', ): documents.stats()['spilled_documents']}, ['tier'])
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Executes HTTP service calls according to natural language tricks.')
@@ -146,6 +546,130 @@ if __name__ == '__main__':
                         help='listen to the port number')
     parser.add_argument('-X', '--debug', action="store_true",
                         help='debug mode')
+    parser.add_argument('--parser-workers', type=int, default=0,
+                        help='long-lived local SyntaxNet parser processes instead of the parsing service (0)')
+    parser.add_argument('--parser-model-dir', type=str, default=None,
+                        help='model directory of the local parsers (lang_models/<Language> by default)')
+    parser.add_argument('--parser-stub', action="store_true",
+                        help='local stub parsers chaining every word as the object of the former one, for testing')
+    parser.add_argument('--parser-timeout', type=float, default=60,
+                        help='seconds before a local parser not answering is killed')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='max number of cached parsings (0 disables the cache)')
+    parser.add_argument('--cache-bytes', type=int, default=16 * 1024 * 1024,
+                        help='max size in bytes of the cached parsings')
+    parser.add_argument('--cache-ttl', type=float, default=None,
+                        help='seconds a cached parsing is valid (no expiration by default)')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='directory of the on-disk parsing cache tier')
+    parser.add_argument('--cache-dir-bytes', type=int, default=256 * 1024 * 1024,
+                        help='max size in bytes of the on-disk parsing cache tier')
+    parser.add_argument('--pool-size', type=int, default=transport.pool_size,
+                        help='keep-alive HTTP connections per host')
+    parser.add_argument('--connect-timeout', type=float, default=transport.connect_timeout,
+                        help='seconds to wait for a HTTP connection')
+    parser.add_argument('--read-timeout', type=float, default=transport.read_timeout,
+                        help='seconds to wait for a HTTP response')
+    parser.add_argument('--retries', type=int, default=transport.retries,
+                        help='retries with backoff of idempotent HTTP calls')
+    parser.add_argument('--batch-parsing', action="store_true",
+                        help='parse all the trick responses of a linker round in a single parsing call')
+    parser.add_argument('--document-workers', type=int, default=kernel.max_in_flight,
+                        help='candidate tricks compiled concurrently per document')
+    parser.add_argument('--max-in-flight', type=int, default=kernel.max_global_in_flight,
+                        help='candidate tricks compiled concurrently among all documents')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='seconds before the outstanding compilations of a document are cancelled')
+    parser.add_argument('--no-memoize', action="store_true",
+                        help='compile again identical tree and trick pairs of a document')
+    parser.add_argument('--memoize-tricks', action="store_true",
+                        help='keep pure trick compilations among documents until the tricks change')
+    parser.add_argument('--incremental-treat', action="store_true",
+                        help='graft the parsed TREAT replacements instead of parsing their sources again')
+    parser.add_argument('--intern-trees', action="store_true",
+                        help='share identical subtrees among parsed documents')
+    parser.add_argument('--storage', type=str, default=None,
+                        help='persist tricks and documents in a directory (log and snapshot) or a .db SQLite file')
+    parser.add_argument('--snapshot-every', type=int, default=1000,
+                        help='logged changes before the storage log is compacted in a new snapshot')
+    parser.add_argument('--history-max-count', type=int, default=None,
+                        help='documents kept in memory (unbounded by default)')
+    parser.add_argument('--history-max-bytes', type=int, default=None,
+                        help='max size in bytes of the documents kept in memory')
+    parser.add_argument('--history-max-age', type=float, default=None,
+                        help='seconds a document is kept in the history (forever by default)')
+    parser.add_argument('--history-dir', type=str, default=None,
+                        help='directory the documents over the memory limits are spilled to, instead of dropped')
+    parser.add_argument('--validation-workers', type=int, default=trick.validation_workers,
+                        help='processes validating batches of tricks')
+    parser.add_argument('--trace-dir', type=str, default=None,
+                        help='save the trace of every document as a Chrome trace file of the directory')
+    parser.add_argument('--asgi', action="store_true",
+                        help='serve the asynchronous ASGI application with uvicorn instead of Flask')
+    parser.add_argument('--domain-snapshot', type=str, default=None,
+                        help='serve the tricks of a binary snapshot (see domain_snapshot.py) mapped in place')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes sharing the listening socket and the tricks (documents are per worker)')
+    parser.add_argument('--domain-dir', type=str, default=None,
+                        help='directory of the tricks shared by the workers (a temporary one by default)')
     args = parser.parse_args()
+    if args.workers > 1 and args.storage:
+        parser.error('--storage needs a single worker, as every worker has its own documents')
+    if args.domain_snapshot and args.storage:
+        parser.error('--domain-snapshot and --storage are alternative sources of tricks')
     SyntaxTree.locator = args.locator
-    app.run(host=args.ip, port=args.port, debug=args.debug)
+    SyntaxTree.interning = args.intern_trees
+    if args.parser_workers > 0:
+        command, env = (stub_command(), None) if args.parser_stub else \
+            syntaxnet_command(args.parser_model_dir or model_directory(SyntaxTree.language))
+        SyntaxTree.backend = WorkerPool(command, size=args.parser_workers, env=env,
+                                        parse_timeout=args.parser_timeout)
+    kernel.batch_parsing = args.batch_parsing
+    kernel.max_in_flight = args.document_workers
+    kernel.max_global_in_flight = args.max_in_flight
+    kernel.document_deadline = args.deadline
+    kernel.memoize = not args.no_memoize
+    trick.validation_workers = args.validation_workers
+    tracing.trace_dir = args.trace_dir
+    kernel.cross_request_memo = args.memoize_tricks
+    kernel.incremental_treat = args.incremental_treat
+    transport.configure(pool_size=args.pool_size, connect_timeout=args.connect_timeout,
+                        read_timeout=args.read_timeout, retries=args.retries)
+    if args.cache_size > 0:
+        SyntaxTree.cache = ParseCache(args.cache_size, args.cache_bytes, args.cache_ttl, args.cache_dir,
+                                      max_disk_bytes=args.cache_dir_bytes)
+    service = sys.modules[__name__]
+    if args.asgi:
+        import asgi
+        service = asgi.concha  # The ASGI application works on the imported module, not on __main__.
+    service.documents = DocumentHistory(args.history_max_count, args.history_max_bytes, args.history_max_age,
+                                        args.history_dir)
+    if args.storage:
+        startup = service.restore(new_storage(args.storage, args.snapshot_every))
+        print('Restored {tricks} tricks and {documents} documents ({replayed_changes} logged changes) '
+              'in {seconds:.3f} seconds'.format(**startup))
+    if args.domain_snapshot:
+        start = time.monotonic()
+        count = service.map_tricks(args.domain_snapshot)
+        print('Mapped {} tricks in {:.3f} seconds'.format(count, time.monotonic() - start))
+    if args.workers > 1:
+        import prefork
+        service.share(SharedDomain(args.domain_dir or tempfile.mkdtemp(prefix='concha-domain-')))
+        if args.asgi:
+            import uvicorn
+
+            def serve_worker(sock):
+                uvicorn.Server(uvicorn.Config(asgi.app, fd=sock.fileno(),
+                                              log_level='debug' if args.debug else 'info')).run()
+        else:
+            from werkzeug.serving import make_server
+
+            def serve_worker(sock):
+                make_server(args.ip, args.port, app, threaded=True, fd=sock.fileno()).serve_forever()
+        print('Serving on {}:{} with {} workers'.format(args.ip, args.port, args.workers))
+        prefork.serve(args.workers, prefork.listening_socket(args.ip, args.port), serve_worker)
+    elif args.asgi:
+        import uvicorn
+        uvicorn.run(asgi.app, host=args.ip, port=args.port, log_level='debug' if args.debug else 'info')
+    else:
+        app.run(host=args.ip, port=args.port, debug=args.debug)
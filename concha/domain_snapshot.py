@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'MappedDomain', 'write_snapshot', 'read_tricks'
+]
+
+import os
+import sys
+import mmap
+import json
+import struct
+import bisect
+import argparse
+from collections.abc import Mapping
+from trick import IndexedTricks, CompiledPattern, TrickIndex, TrickDomain, tricks_errors, trick_templates, _calls_http
+
+MAGIC = b'CNCD'
+FORMAT_VERSION = 1
+# Magic, format version, next trick id, next error trick id, tricks doing HTTP calls, then (offset, size) of:
+SECTIONS = ['ids', 'spans', 'blob', 'error_tricks', 'signatures', 'key_spans', 'keys', 'postings', 'entries']
+HEADER = struct.Struct('<4sIqqq' + 'QQ' * len(SECTIONS))
+SIMILAR, WILDCARDS = 0, 1  # Postings of the similar (~) and wildcard (*) buckets, literal (label, form) ones follow.
+
+
+def _key(label, form):
+    return '{}\0{}'.format(label, form).encode('utf-8')
+
+
+def write_snapshot(path, tricks, error_tricks=()):
+    """Write a binary snapshot of a trick domain, plus its error tricks, with its index tables precomputed.
+
+    Every table is an array of 64 bits integers used in place once mapped, so opening a snapshot costs the
+    same whatever the number of tricks. Trick ids are sorted, each one with the span of its JSON in the blob.
+    Literal bucket keys ('label\\0form' UTF-8) are sorted to be binary searched, every bucket posting a
+    (start, count) slice of the (trick id, signature) entries. Signatures are few, so they are stored as JSON.
+    """
+    tricks = tricks if isinstance(tricks, Mapping) else dict(enumerate(tricks))
+    error_tricks = error_tricks if isinstance(error_tricks, Mapping) else dict(enumerate(error_tricks))
+    ids = sorted(tricks)
+    blob, spans = bytearray(), []
+    for id_ in ids:
+        data = json.dumps(tricks[id_], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        spans.extend((len(blob), len(data)))
+        blob += data
+    index = TrickIndex()
+    for id_ in ids:
+        bucket, signature = index._bucket(tricks[id_], create=True)
+        bucket[id_] = signature
+    signatures, entries, postings = {}, [], []
+    literal_keys = sorted(index.literals, key=lambda label_form: _key(*label_form))
+    for bucket in [index.similar, index.wildcards] + [index.literals[key] for key in literal_keys]:
+        postings.extend((len(entries) // 2, len(bucket)))
+        for id_, signature in sorted(bucket.items()):
+            entries.extend((id_, signatures.setdefault(signature, len(signatures))))
+    keys, key_spans = bytearray(), []
+    for label, form in literal_keys:
+        key = _key(label, form)
+        key_spans.extend((len(keys), len(key)))
+        keys += key
+    sections = [
+        struct.pack('<{}q'.format(len(ids)), *ids),
+        struct.pack('<{}Q'.format(len(spans)), *spans),
+        bytes(blob),
+        json.dumps(list(error_tricks.items()), ensure_ascii=False).encode('utf-8'),
+        json.dumps([[sorted(top_labels), sorted(required_keys)] for top_labels, required_keys in signatures],
+                   ensure_ascii=False).encode('utf-8'),
+        struct.pack('<{}Q'.format(len(key_spans)), *key_spans),
+        bytes(keys),
+        struct.pack('<{}Q'.format(len(postings)), *postings),
+        struct.pack('<{}q'.format(len(entries)), *entries)
+    ]
+    layout, offset = [], HEADER.size
+    for section in sections:
+        layout.extend((offset, len(section)))
+        offset += len(section)
+    next_id = max(getattr(tricks, 'next_id', 0), max(tricks, default=-1) + 1)
+    error_next_id = max(getattr(error_tricks, 'next_id', 0), max(error_tricks, default=-1) + 1)
+    http_tricks = sum(1 for trick in tricks.values() if _calls_http(trick))
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as snapshot:
+        snapshot.write(HEADER.pack(MAGIC, FORMAT_VERSION, next_id, error_next_id, http_tricks, *layout))
+        for section in sections:
+            snapshot.write(section)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temporary_path, path)
+
+
+class _Unrevised(object):
+    """Revisions of a MappedDomain: tricks are never changed in place, so all of them are at version 0."""
+
+    def __init__(self, domain):
+        self.domain = domain
+
+    def get(self, id_, default=None):
+        return 0 if id_ in self.domain else default
+
+
+class MappedDomain(IndexedTricks):
+    """Read-only trick domain used in place from a memory mapped binary snapshot written by write_snapshot.
+
+    Opening it only reads the header, the error tricks and the signatures. Tricks are decoded from their JSON
+    the first time they are used, and their patterns and templates compiled the first time they are needed, so
+    a worker only pays for the tricks its documents need. Use thaw() to get a TrickDomain which can be changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as snapshot:
+            self._map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._map, 0)
+        if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError('{} is not a version {} trick domain snapshot'.format(path, FORMAT_VERSION))
+        self.next_id, self.error_next_id, self.http_tricks = header[2:5]
+        view = memoryview(self._map)
+        sections = {name: view[header[5 + 2 * i]:header[5 + 2 * i] + header[6 + 2 * i]]
+                    for i, name in enumerate(SECTIONS)}
+        self._ids = sections['ids'].cast('q')
+        self._spans = sections['spans'].cast('Q')
+        self._blob = sections['blob']
+        self._key_spans = sections['key_spans'].cast('Q')
+        self._keys = sections['keys']
+        self._postings = sections['postings'].cast('Q')
+        self._entries = sections['entries'].cast('q')
+        self._views = [self._ids, self._spans, self._key_spans, self._postings, self._entries] + \
+            list(sections.values()) + [view]  # Released in this order on close.
+        self.error_tricks = TrickDomain({id_: trick for id_, trick in json.loads(bytes(sections['error_tricks']))},
+                                        self.error_next_id)
+        self._signatures = [(frozenset(top_labels), frozenset(required_keys))
+                            for top_labels, required_keys in json.loads(bytes(sections['signatures']))]
+        self._decoded = {}  # Trick id -> trick.
+        self._patterns = {}  # Trick id -> CompiledPattern.
+        self._templates = {}  # Trick id -> TrickTemplates.
+        self.version = 0
+        self.revisions = _Unrevised(self)
+        self.uid = TrickDomain.new_uid()
+
+    def _position(self, id_):
+        position = bisect.bisect_left(self._ids, id_) if isinstance(id_, int) else len(self._ids)
+        return position if position < len(self._ids) and self._ids[position] == id_ else None
+
+    def __getitem__(self, id_):
+        trick = self._decoded.get(id_)
+        if trick is None:
+            position = self._position(id_)
+            if position is None:
+                raise KeyError(id_)
+            start, size = self._spans[2 * position], self._spans[2 * position + 1]
+            trick = self._decoded.setdefault(id_, json.loads(bytes(self._blob[start:start + size])))
+        return trick
+
+    def __contains__(self, id_):
+        return id_ in self._decoded or self._position(id_) is not None
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _bucket(self, number):
+        start, count = self._postings[2 * number], self._postings[2 * number + 1]
+        entries = self._entries[2 * start:2 * (start + count)]
+        return zip(entries[::2], entries[1::2])
+
+    def _literal_bucket(self, label, form):
+        """Return the bucket number of a literal (label, form), binary searching the sorted keys, or None."""
+        key = _key(label, form)
+        low, high = 0, len(self._key_spans) // 2
+        while low < high:
+            middle = (low + high) // 2
+            start, size = self._key_spans[2 * middle], self._key_spans[2 * middle + 1]
+            other = self._keys[start:start + size]
+            if other == key:
+                return 2 + middle
+            elif bytes(other) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def candidates(self, tree):
+        """Return the sorted ids of the tricks which may match the tree, as TrickIndex.candidates does."""
+        result = []
+        labels = tree.keys()
+        for label, node in tree.items():
+            keys = node.keys() if isinstance(node, dict) else ()
+            buckets = [SIMILAR, WILDCARDS]
+            if 'form' in keys:
+                literal = self._literal_bucket(label, node['form'])
+                if literal is not None:
+                    buckets.append(literal)
+            for bucket in buckets:
+                for i, signature in self._bucket(bucket):
+                    top_labels, required_keys = self._signatures[signature]
+                    if top_labels <= labels and (not top_labels or label in top_labels) and required_keys <= keys:
+                        result.append(i)
+        return sorted(set(result))
+
+    def match(self, tree):
+        """Return the ids of the tricks matching the tree, compiling the patterns of new candidates."""
+        flat_tree = tree.flatten()
+        result = []
+        for i in self.candidates(tree):
+            pattern = self._patterns.get(i)
+            if pattern is None:
+                pattern = self._patterns.setdefault(i, CompiledPattern(self[i].get('given', {})))
+            if pattern.matches(flat_tree):
+                result.append(i)
+        return result
+
+    def templates(self, id_):
+        """Return the TrickTemplates of a trick, compiled the first time it is used."""
+        templates = self._templates.get(id_)
+        if templates is None:
+            templates = self._templates.setdefault(id_, trick_templates(self[id_]))
+        return templates
+
+    def thaw(self):
+        """Return a TrickDomain with the same tricks and next id, which can be changed."""
+        return TrickDomain(dict(self.items()), self.next_id)
+
+    def close(self):
+        """Unmap the snapshot. Tricks already decoded can still be used."""
+        for view in self._views:
+            view.release()
+        self._map.close()
+
+
+def read_tricks(path):
+    """Return the tricks and error tricks of a JSON Lines file of tricks (as exported), or of a storage snapshot.
+
+    Raise ValueError on wrong tricks, naming their lines.
+    """
+    with open(path, encoding='utf-8') as source:
+        lines = [line for line in source if line.strip()]
+    if len(lines) == 1 and 'tricks' in json.loads(lines[0]):  # A storage snapshot.json.
+        snapshot = json.loads(lines[0])
+        return TrickDomain({id_: trick for id_, trick in snapshot['tricks']}, snapshot['next_ids']['tricks']), \
+            TrickDomain({id_: trick for id_, trick in snapshot.get('error_tricks', [])},
+                        snapshot['next_ids']['error_tricks'])
+    numbered = []
+    for number, line in enumerate(lines, 1):
+        try:
+            numbered.append((number, json.loads(line)))
+        except ValueError as exception:
+            raise ValueError('Line {}: wrong JSON line: "{}"'.format(number, exception))
+    for (number, _), errors in zip(numbered, tricks_errors([trick for _, trick in numbered])):
+        if errors:
+            raise ValueError('Line {}: {}'.format(number, '; '.join(errors)))
+    tricks, error_tricks = TrickDomain(), TrickDomain()
+    for _, trick in numbered:
+        (error_tricks if trick.get('when', {}).get('method') == 'ERROR' else tricks).append(trick)
+    return tricks, error_tricks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Converts JSON Lines tricks (or a storage snapshot.json) into a binary trick domain snapshot.')
+    parser.add_argument('source', type=str, help='JSON Lines file of tricks, as GET /v1/tricks:export answers')
+    parser.add_argument('target', type=str, help='binary snapshot file to write')
+    args = parser.parse_args()
+    try:
+        tricks_, error_tricks_ = read_tricks(args.source)
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+    write_snapshot(args.target, tricks_, error_tricks_)
+    print('{} tricks and {} error tricks written to {}'.format(len(tricks_), len(error_tricks_), args.target))
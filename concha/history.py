@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'DocumentHistory',
+]
+
+import os
+import gzip
+import json
+import datetime
+import threading
+from bisect import bisect_left
+from itertools import islice
+from collections import namedtuple
+
+Segment = namedtuple('Segment', ['first_id', 'last_id', 'first_date', 'last_date', 'path'])  # Spilled documents.
+
+
+class DocumentHistory(object):
+    """Append only history of documents, sorted by date, with retention policies.
+
+    Documents keep their id (position since the first document ever recorded) for their whole life. The
+    newest ones are kept in memory up to max_count documents and max_bytes of UTF-8 JSON. Older ones are
+    spilled in gzipped JSON Lines segments to the directory, or dropped if there's none. Documents older than
+    max_age seconds are dropped from both tiers, on appends and on reads. Lookups by date bisect the memory
+    tier and the index of segments, as documents are sorted by date.
+    """
+
+    def __init__(self, max_count=None, max_bytes=None, max_age=None, directory=None, segment_size=1000):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.directory = directory
+        self.segment_size = segment_size  # Documents spilled at least at once, so segments aren't tiny.
+        self.first_id = 0  # Id of the first document in memory.
+        self.dropped = 0
+        self._records = []  # (date, size, record), the ones in memory from _head on.
+        self._head = 0
+        self._bytes = 0
+        self._segments = []
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_segments()
+            if self._segments:
+                self.first_id = self._segments[-1].last_id + 1
+
+    def __len__(self):
+        """Return the id of the next document, as the list of every recorded document would."""
+        with self._lock:
+            return self.first_id + len(self._records) - self._head
+
+    def append(self, record):
+        """Add the newest document returning its id, applying the retention policies."""
+        size = len(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            self._records.append((record['date'], size, record))
+            self._bytes += size
+            self._retain()
+            return len(self) - 1
+
+    def extend(self, records, first_id=None):
+        """Add documents in bulk, i.e. when restored, optionally starting at a given id.
+
+        Documents with ids already spilled to the directory are skipped.
+        """
+        with self._lock:
+            if first_id is not None and len(self) == self.first_id:
+                if first_id > self.first_id:
+                    self.first_id = first_id
+                records = islice(records, self.first_id - first_id, None)
+            for record in records:
+                self.append(record)
+
+    def __getitem__(self, id_):
+        with self._lock:
+            if id_ < 0 or id_ >= len(self):
+                raise IndexError(id_)
+            cutoff = self._expire()
+            if id_ >= self.first_id:
+                return self._records[self._head + id_ - self.first_id][2]
+            segments = list(self._segments)
+        for segment in segments:
+            if segment.first_id <= id_ <= segment.last_id:
+                for segment_id, record in self._read_segment(segment):
+                    if segment_id == id_:
+                        if cutoff is not None and record['date'] < cutoff:
+                            break
+                        return record
+        raise KeyError('Document {} is no longer retained'.format(id_))
+
+    def first_id_since(self, date):
+        """Return the id of the first retained document dated on or after the date ('YYYY-MM-DD HH:MM:SS' prefix)."""
+        with self._lock:
+            cutoff = self._expire()
+            if cutoff is not None:
+                date = max(date, cutoff)
+            segments = list(self._segments)
+            if not segments or segments[-1].last_date < date:
+                position = bisect_left(self._records, date, lo=self._head, key=lambda entry: entry[0])
+                return self.first_id + position - self._head
+        index = bisect_left([segment.last_date for segment in segments], date)  # First one ending on or after.
+        for id_, record in self._read_segment(segments[index]):
+            if record['date'] >= date:
+                return id_
+        return segments[index].last_id + 1
+
+    def numbered(self, start=0):
+        """Yield the retained (id, document) pairs from the start id on, reading spilled segments as a stream."""
+        with self._lock:
+            cutoff = self._expire()
+            segments = [segment for segment in self._segments if segment.last_id >= start]
+        for segment in segments:
+            for id_, record in self._read_segment(segment):
+                if id_ >= start and (cutoff is None or record['date'] >= cutoff):
+                    yield id_, record
+                    start = id_ + 1
+        while True:
+            with self._lock:
+                start = max(start, self._segments[0].first_id if self._segments else self.first_id)  # Retained ids.
+                if start >= len(self):
+                    return
+                record = self._records[self._head + start - self.first_id][2] if start >= self.first_id else None
+            if record is None:  # Spilled meanwhile.
+                try:
+                    record = self[start]
+                except KeyError:  # And dropped.
+                    start += 1
+                    continue
+            yield start, record
+            start += 1
+
+    def recent(self):
+        """Return the first id and the list of the documents in memory, i.e. to snapshot them."""
+        with self._lock:
+            self._expire()
+            return self.first_id, [entry[2] for entry in self._records[self._head:]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_documents': len(self._records) - self._head,
+                'memory_bytes': self._bytes,
+                'spilled_documents': sum(x.last_id - x.first_id + 1 for x in self._segments),
+                'segments': len(self._segments),
+                'dropped_documents': self.dropped
+            }
+
+    def _expire(self):
+        """Drop the segments and the documents in memory older than max_age, returning the date before which
+        documents are expired, or None. To be called holding the lock."""
+        if self.max_age is None:
+            return None
+        cutoff = str(datetime.datetime.now() - datetime.timedelta(seconds=self.max_age)).split('.')[0]
+        while self._segments and self._segments[0].last_date < cutoff:
+            os.remove(self._segments.pop(0).path)
+            self._save_segments()
+        expired = bisect_left(self._records, cutoff, lo=self._head, key=lambda entry: entry[0]) - self._head
+        self._evict(expired, spill=False)
+        return cutoff
+
+    def _retain(self):
+        """Apply the retention policies. To be called holding the lock."""
+        self._expire()
+        excess = 0
+        count, size = len(self._records) - self._head, self._bytes
+        while (self.max_count is not None and count > self.max_count) or \
+                (self.max_bytes is not None and size > self.max_bytes and count > 1):
+            size -= self._records[self._head + excess][1]
+            count -= 1
+            excess += 1
+        if excess and self.directory:  # Spill a whole segment, leaving room for the next documents.
+            excess = min(len(self._records) - self._head - 1, max(excess, self.segment_size))
+        self._evict(excess, spill=True)
+
+    def _evict(self, count, spill):
+        """Take out the count oldest documents of memory, spilling them to a segment if there's a directory."""
+        if count <= 0:
+            return
+        evicted = self._records[self._head:self._head + count]
+        self._head += count
+        if self._head > len(self._records) // 2:  # Amortized O(1) removal of the oldest ones.
+            del self._records[:self._head]
+            self._head = 0
+        self._bytes -= sum(entry[1] for entry in evicted)
+        first_id = self.first_id
+        self.first_id += count
+        if spill and self.directory:
+            path = os.path.join(self.directory, '{:012d}.jsonl.gz'.format(first_id))
+            with gzip.open(path, 'wt', encoding='utf-8') as segment_file:
+                for entry in evicted:
+                    segment_file.write(json.dumps(entry[2], ensure_ascii=False) + '\n')
+            self._segments.append(Segment(first_id, self.first_id - 1, evicted[0][0], evicted[-1][0], path))
+            self._save_segments()
+        else:
+            self.dropped += count
+
+    @staticmethod
+    def _read_segment(segment):
+        try:
+            with gzip.open(segment.path, 'rt', encoding='utf-8') as segment_file:
+                for id_, line in enumerate(segment_file, segment.first_id):
+                    yield id_, json.loads(line)
+        except FileNotFoundError:  # Dropped by the max age policy meanwhile.
+            return
+
+    def _save_segments(self):
+        index_path = os.path.join(self.directory, 'segments.json')
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as index:
+            json.dump([list(segment) for segment in self._segments], index)
+        os.replace(index_path + '.tmp', index_path)
+
+    def _load_segments(self):
+        index_path = os.path.join(self.directory, 'segments.json')
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as index:
+                self._segments = [Segment(*x) for x in json.load(index) if os.path.exists(x[4])]
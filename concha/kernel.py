@@ -16,17 +16,140 @@
 __author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
 __version__ = '1.0'
 __all__ = [
-    'linker', 'compiler', 'Artifact'
+    'linker', 'compiler', 'async_linker', 'async_compiler', 'Artifact'
 ]
 
 import json
-import requests
+import time
+import asyncio
+import contextvars
+import threading
+import transport
+import tracing
+import metrics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from random import choice
-from collections import namedtuple
-from trick import match_tricks, error_domain
+from collections import namedtuple, OrderedDict
+from trick import IndexedTricks, match_tricks, trick_ids, trick_templates, error_domain
 from syntax_tree import SyntaxTree
 
 Artifact = namedtuple('Artifact', ['tree', 'used_tricks', 'status'])
+Rendering = namedtuple('Rendering', ['text', 'used_tricks', 'status'])  # An Artifact whose tree is not parsed yet.
+Call = namedtuple('Call', ['method', 'uri', 'kwargs'])  # A HTTP call needed by a rendering.
+Parse = namedtuple('Parse', ['text'])  # A parsing needed by a rendering.
+Link = namedtuple('Link', ['tree'])  # A (TREAT) linking needed by a rendering.
+
+batch_parsing = False  # Parse the 'then' texts of every linker round in a single parsing service call.
+max_in_flight = 1  # Candidate tricks compiled concurrently per document, 1 means sequentially.
+max_global_in_flight = 32  # Candidate tricks compiled concurrently among all documents.
+document_deadline = None  # Seconds before outstanding compilations of a document are cancelled.
+memoize = True  # Compile identical (tree, trick) pairs and link identical sub-documents once per document.
+cross_request_memo = False  # Keep pure trick compilations among documents, until the trick domain changes.
+cross_request_memo_size = 4096
+memo_stats = {'hits': 0, 'cross_request_hits': 0, 'linked_hits': 0, 'misses': 0}
+incremental_treat = False  # Graft the parsed TREAT replacement into the source tree instead of parsing it again.
+treat_stats = {'grafted': 0, 'reused': 0, 'reparsed': 0, 'extra_parses': 0}  # See _grafted_steps.
+
+_local = threading.local()
+_async_job = contextvars.ContextVar('job', default=None)
+_executor = None
+_executor_lock = threading.Lock()
+_memo_lock = threading.Lock()
+_cross_request_results = OrderedDict()  # (domain, domain or trick version, step, tree key, trick id) -> result
+
+
+class Job(object):
+    """Linking state of a single document, shared by its TREAT recursions and pool workers."""
+
+    def __init__(self):
+        self.deadline = None if document_deadline is None else time.monotonic() + document_deadline
+        self.memo = {} if memoize else None
+        self.texts = {}  # id(subtree) -> (subtree, text) of the subtrees rendered by templates.
+        self.parser_calls_saved = 0  # TREAT sources grafted with the linked tree, without any parsing.
+        self.grafts_parsed = 0  # TREAT sources grafted with their parsed replacement, a shorter parsing.
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def recall(self, key, tricks):
+        """Return the memoized result of a (step, tree key, trick id) key, or None."""
+        if self.memo is None:
+            return None
+        result = self.memo.get((id(tricks), ) + key)
+        if result is not None:
+            _count('linked_hits' if key[0] == 'link' else 'hits')
+            return result
+        cross_request_key = _cross_request_key(tricks, key) if cross_request_memo else None
+        if cross_request_key is not None:
+            with _memo_lock:
+                result = _cross_request_results.get(cross_request_key)
+                if result is not None:
+                    _cross_request_results.move_to_end(cross_request_key)
+            if result is not None:
+                _count('cross_request_hits')
+                self.memo[(id(tricks), ) + key] = result
+                return result
+        _count('misses')
+        return None
+
+    def remember(self, key, tricks, result):
+        """Memoize a result unless the deadline was reached, as it could be a partial one."""
+        if self.memo is None or self.expired():
+            return
+        self.memo[(id(tricks), ) + key] = result
+        cross_request_key = _cross_request_key(tricks, key) if cross_request_memo else None
+        if cross_request_key is not None:
+            with _memo_lock:
+                _cross_request_results[cross_request_key] = result
+                while len(_cross_request_results) > cross_request_memo_size:
+                    _cross_request_results.popitem(last=False)
+
+
+def _cross_request_key(tricks, key):
+    """Return the key of a compilation kept among documents, or None if it doesn't only depend on its tree.
+
+    Tricks without 'when' only depend on themselves, so their results outlive changes of other tricks. TREAT
+    tricks depend on the whole domain and on the error tricks their links fall back to, which can't have
+    tricks doing HTTP calls.
+    """
+    if key[0] == 'link' or not isinstance(tricks, IndexedTricks):
+        return None
+    trick = tricks.get(key[-1])
+    revision = tricks.revisions.get(key[-1])
+    if trick is None or revision is None:  # Deleted meanwhile.
+        return None
+    if 'when' not in trick:
+        return (tricks.uid, 'trick', revision) + key
+    if trick['when'].get('method') == 'TREAT' and tricks.http_tricks == 0 and error_domain.http_tricks == 0:
+        return (tricks.uid, 'domain', tricks.version, error_domain.uid, error_domain.version) + key
+    return None
+
+
+def _count(counter):
+    with _memo_lock:
+        memo_stats[counter] += 1
+
+
+def _observe_treats(job):
+    if incremental_treat:
+        metrics.treat_parser_calls_saved.observe(job.parser_calls_saved)
+        metrics.treat_grafts_parsed.observe(job.grafts_parsed)
+
+
+def _templates(tricks, trick_idx):
+    """Return the TrickTemplates of a trick, compiled once by its domain unless tricks is a plain list."""
+    if isinstance(tricks, IndexedTricks):
+        return tricks.templates(trick_idx)
+    return trick_templates(tricks[trick_idx])
+
+
+def _domain_label(tricks):
+    return 'error' if tricks is error_domain else 'tricks'
+
+
+def _tree_key(tree):
+    """Memo key of a tree: itself, compared by its cached structural hash. Trees are never changed while linking."""
+    return tree if isinstance(tree, SyntaxTree) else SyntaxTree.new_from_dict(tree)
 
 
 def resolve_artifact(artifacts):
@@ -47,59 +170,188 @@ def resolve_artifact(artifacts):
 
 def linker(tree, tricks):
     """Return an Artifact according to a given source tree and trick domain."""
+    job = getattr(_local, 'job', None)
+    if job is not None:  # A TREAT recursion of the document.
+        return _memo_link(job, tree, tricks)
+    _local.job = Job()
+    try:
+        return _memo_link(_local.job, tree, tricks)
+    finally:
+        _observe_treats(_local.job)
+        _local.job = None
+
+
+def _memo_link(job, tree, tricks):
+    with tracing.span('linker', level=tracing.nesting('linker')):
+        key = ('link', _tree_key(tree), None)
+        artifact = job.recall(key, tricks)
+        if artifact is None:
+            artifact = _link(tree, tricks)
+            job.remember(key, tricks, artifact)
+        else:
+            tracing.annotate(memo=True)
+        tracing.annotate(status=artifact.status)
+        return artifact
+
+
+def _link(tree, tricks):
+    """Link a tree according to the trick domain compiling every linker round of candidates at once."""
     artifacts = []
     candidate_tricks = match_tricks(tree, tricks)
+    metrics.linker_candidates.observe(len(candidate_tricks))
     if len(candidate_tricks) > 0:
-        for trick_idx in candidate_tricks:
-            artifact = compiler(tree, trick_idx, tricks)
-            artifacts.append(artifact)
-            new_candidate_tricks = match_tricks(artifact.tree, tricks)
-            original = set(candidate_tricks)
-            new = set(new_candidate_tricks)
-            candidate_tricks.extend(set(new.difference(original)))  # add difference to candidates
+        linker_round = candidate_tricks
+        while linker_round:  # Every round compiles the tricks matched by the artifacts of the previous one.
+            new_artifacts = _build(_render_round(tree, linker_round, tricks))
+            artifacts.extend(new_artifacts)
+            linker_round = _next_round(new_artifacts, candidate_tricks, tricks)
+            if _local.job.expired():
+                break
     elif len(error_domain) > 0:
-        for trick in error_domain:
-            artifacts.append(compiler(tree, trick, error_domain))
+        artifacts.extend(_build(_render_round(tree, trick_ids(error_domain), error_domain)))
     else:  # Fallback in English
         artifacts.append(Artifact(tree={'root': {'form': 'NoTrick'}}, used_tricks=[], status='600'))  # Not a HTTP code
+    if not artifacts:  # Deadline reached before any compilation was done.
+        artifacts.append(Artifact(tree={'root': {'form': 'Timeout'}}, used_tricks=[], status='504'))
     return resolve_artifact(artifacts)
 
 
+def _next_round(new_artifacts, candidate_tricks, tricks):
+    """Return the tricks matched by the new artifacts which weren't candidates yet, adding them as candidates."""
+    linker_round = []
+    for artifact in new_artifacts:
+        if artifact.tree is not None:
+            for trick_idx in match_tricks(artifact.tree, tricks):
+                if trick_idx not in candidate_tricks:
+                    candidate_tricks.append(trick_idx)
+                    linker_round.append(trick_idx)
+    return linker_round
+
+
+def _render_round(tree, trick_idxs, tricks):
+    """Render a round of candidate tricks, concurrently if allowed, keeping the candidates order."""
+    job = _local.job
+    step = _render if batch_parsing else compiler  # Without batch parsing each worker parses its own text.
+    tree_key = _tree_key(tree) if job.memo is not None else None
+    results = {}
+    pending = []
+    for position, trick_idx in enumerate(trick_idxs):
+        result = job.recall((step.__name__, tree_key, trick_idx), tricks) if tree_key is not None else None
+        if result is None:
+            pending.append((position, trick_idx))
+        else:
+            results[position] = result
+    for position, result in _run_steps(job, step, tree, pending, tricks).items():
+        results[position] = result
+        if tree_key is not None:
+            job.remember((step.__name__, tree_key, trick_idxs[position]), tricks, result)
+    return [results[position] for position in sorted(results)]
+
+
+def _run_steps(job, step, tree, pending, tricks):
+    """Run the step of every pending (position, trick id) returning a dict of results by position."""
+    results = {}
+    if max_in_flight <= 1 or len(pending) <= 1 or getattr(_local, 'in_worker', False):
+        for position, trick_idx in pending:  # Nested TREAT linkers run inline to never wait for their own pool.
+            if job.expired():
+                break
+            results[position] = step(tree, trick_idx, tricks)
+        return results
+    deadline = job.deadline
+    pending = list(reversed(pending))
+    in_flight = {}
+    while pending or in_flight:
+        while pending and len(in_flight) < max_in_flight:
+            position, trick_idx = pending.pop()
+            in_flight[_pool().submit(contextvars.copy_context().run,  # The trace spans of the document.
+                                     _worker, job, step, tree, trick_idx, tricks)] = position
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:  # Deadline reached, give up outstanding work.
+            for future in in_flight:
+                future.cancel()
+            break
+        for future in done:
+            results[in_flight.pop(future)] = future.result()
+    return results
+
+
+def _worker(job, step, *args):
+    """Run a compilation step in a pool thread inheriting the document job."""
+    _local.in_worker = True
+    _local.job = job
+    try:
+        return step(*args)
+    finally:
+        _local.in_worker = False
+        _local.job = None
+
+
+def _pool():
+    """Return the thread pool shared by every document, bounding the global in flight compilations."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_global_in_flight, thread_name_prefix='linker')
+        return _executor
+
+
 def compiler(tree, trick_idx, tricks):
     """Return a new Artifact generated according to a single given trick."""
-    r_tree = None
+    return _build([_render(tree, trick_idx, tricks)])[0]
+
+
+def _build(renderings):
+    """Turn Renderings into Artifacts parsing their texts, all of them at once in batch parsing mode."""
+    texts = [rendering.text for rendering in renderings if isinstance(rendering, Rendering)]
+    if batch_parsing and len(texts) > 1:
+        trees = iter(SyntaxTree.new_many_from_texts(texts))
+    else:
+        trees = (SyntaxTree.new_from_text(text) for text in texts)
+    return [
+        Artifact(tree=next(trees), used_tricks=x.used_tricks, status=x.status) if isinstance(x, Rendering) else x
+        for x in renderings
+    ]
+
+
+def _render(tree, trick_idx, tricks):
+    """Return a Rendering with the 'then' text of a single given trick, or an Artifact if there's nothing to parse."""
+    with tracing.span('compiler', trick=trick_idx, method=tricks[trick_idx].get('when', {}).get('method')), \
+            metrics.trick_compile_seconds.time(_domain_label(tricks), trick_idx):
+        metrics.trick_compilations.inc(_domain_label(tricks), trick_idx)
+        job = getattr(_local, 'job', None)
+        steps = _render_steps(tree, trick_idx, tricks, None if job is None else job.texts)
+        result = None
+        while True:
+            try:
+                need = steps.send(result)
+            except StopIteration as stop:
+                tracing.annotate(status=stop.value.status)
+                return stop.value
+            if isinstance(need, Call):
+                result = transport.request(need.method, need.uri, **need.kwargs)
+                tracing.annotate(uri=need.uri, http_status=result.status_code)
+            elif isinstance(need, Parse):
+                result = SyntaxTree.new_from_text(need.text)
+            else:
+                result = linker(need.tree, tricks)
+
+
+def _render_steps(tree, trick_idx, tricks, texts=None):
+    """Render a single given trick yielding the Call, Parse and Link needs to be served by the caller.
+
+    texts memoizes the text of the subtrees rendered by the templates of the document, if given.
+    """
     r_status = None
     trick = tricks[trick_idx]
+    templates = _templates(tricks, trick_idx)
     context = {'d': tree}
     if 'when' in trick:
         method = trick['when']['method']
-        if method == 'POST':
-            uri = trick['when']['uri'].format_map(context)
-            response = requests.post(url=uri, json=trick['when']['body'])
-            r_status = str(response.status_code)
-            if 'json' in response.headers['content-type']:
-                context.update({'r': {'body': json.loads(response.text)}})
-            else:
-                context.update({'r': {'body': ''}})
-        elif method == 'PUT':
-            uri = trick['when']['uri'].format_map(context)
-            response = requests.put(url=uri, json=trick['when']['body'])
-            r_status = str(response.status_code)
-            if 'json' in response.headers['content-type']:
-                context.update({'r': {'body': json.loads(response.text)}})
-            else:
-                context.update({'r': {'body': ''}})
-        elif method == 'GET':
-            uri = trick['when']['uri'].format_map(context)
-            response = requests.get(url=uri)
-            r_status = str(response.status_code)
-            if 'json' in response.headers['content-type']:
-                context.update({'r': {'body': json.loads(response.text)}})
-            else:
-                context.update({'r': {'body': ''}})
-        elif method == 'DELETE':
-            uri = trick['when']['uri'].format_map(context)  # TODO protect
-            response = requests.delete(url=uri)
+        if method in ('POST', 'PUT', 'GET', 'DELETE'):
+            uri = templates.uri.render(context, texts)  # TODO protect
+            kwargs = {'json': trick['when']['body']} if method in ('POST', 'PUT') else {}
+            response = yield Call(method=method, uri=uri, kwargs=kwargs)
             r_status = str(response.status_code)
             if 'json' in response.headers['content-type']:
                 context.update({'r': {'body': json.loads(response.text)}})
@@ -107,14 +359,19 @@ def compiler(tree, trick_idx, tricks):
                 context.update({'r': {'body': ''}})
         elif method == 'TREAT':
             pointed_content = SyntaxTree.point_to_content(context, trick['when']['uri'])
-            sub_tree = SyntaxTree.new_from_text('{}'.format(pointed_content))
-            sub_artifact = linker(sub_tree, tricks)  # First pass, only the to_tree.
+            sub_tree = yield Parse(text='{}'.format(pointed_content))
+            sub_artifact = yield Link(tree=sub_tree)  # First pass, only the to_tree.
             r_status = sub_artifact.status
             if r_status in trick['then']:
                 context.update({'r': sub_artifact.tree})
-                replacement_text = trick['then'][r_status].format_map(context)
-                treated_source = SyntaxTree.new_from_text(tree.to_string_replacing(pointed_content, replacement_text))
-                treated_artifact = linker(treated_source, tricks)  # Second pass, to_tree response expanded in from_tree
+                replacement_text = templates.then[r_status].render(context, texts)
+                treated_source = None
+                if incremental_treat:
+                    treated_source = yield from _grafted_steps(tree, pointed_content, replacement_text,
+                                                               sub_artifact.tree)
+                if treated_source is None:
+                    treated_source = yield Parse(text=tree.to_string_replacing(pointed_content, replacement_text))
+                treated_artifact = yield Link(tree=treated_source)  # Second pass, to_tree response expanded in from_tree
                 return Artifact(
                     tree=treated_artifact.tree,
                     used_tricks=[trick_idx] + sub_artifact.used_tricks + treated_artifact.used_tricks,
@@ -131,8 +388,156 @@ def compiler(tree, trick_idx, tricks):
     else:  # No 'when' in trick means "do the 'then' part"
         r_status = '200'
     if r_status in trick['then']:
-        then = trick['then'][r_status]
-        r_tree = SyntaxTree.new_from_text(then.format_map(context))
+        return Rendering(text=templates.then[r_status].render(context, texts), used_tricks=[trick_idx],
+                         status=r_status)
+    else:
+        return Artifact(tree=None, used_tricks=[trick_idx], status='501')
+
+
+def _grafted_steps(tree, pointed_content, replacement_text, linked_tree):
+    """Return the TREAT source tree with the replacement text grafted at the pointed branch, or None to parse it.
+
+    Only the replacement text is parsed, unless it is the text of the linked tree, which is grafted as it is.
+    Sources are counted by way: 'grafted' ones take a parser call as before, only of a shorter text, while
+    'reused' ones save it, and 'reparsed' ones take an extra call if their replacement was parsed in vain.
+    """
+    if isinstance(linked_tree, SyntaxTree) and len(linked_tree) == 1 and \
+            format(next(iter(linked_tree.values()))) == replacement_text:
+        replacement_tree, counter = linked_tree, 'reused'
+    else:
+        replacement_tree, counter = (yield Parse(text=replacement_text)), 'grafted'
+    treated_source = tree.grafting(pointed_content, replacement_tree) if isinstance(tree, SyntaxTree) else None
+    if treated_source is None:
+        counter = 'reparsed'
+    job = _async_job.get() or getattr(_local, 'job', None)
+    with _memo_lock:
+        treat_stats[counter] += 1
+        if counter == 'reparsed' and replacement_tree is not linked_tree:
+            treat_stats['extra_parses'] += 1
+        if job is not None and counter == 'reused':
+            job.parser_calls_saved += 1
+        elif job is not None and counter == 'grafted':
+            job.grafts_parsed += 1
+    tracing.annotate(treat=counter)
+    return treated_source
+
+
+async def async_linker(tree, tricks):
+    """Asynchronous version of linker, waiting for HTTP calls and parsings without blocking the event loop."""
+    job = _async_job.get()
+    if job is not None:  # A TREAT recursion of the document.
+        return await _async_memo_link(job, tree, tricks)
+    token = _async_job.set(Job())  # Inherited by the tasks of the document.
+    try:
+        return await _async_memo_link(_async_job.get(), tree, tricks)
+    finally:
+        _observe_treats(_async_job.get())
+        _async_job.reset(token)
+
+
+async def async_compiler(tree, trick_idx, tricks):
+    """Asynchronous version of compiler."""
+    return (await _async_build([await _async_render(tree, trick_idx, tricks)]))[0]
+
+
+async def _async_memo_link(job, tree, tricks):
+    with tracing.span('linker', level=tracing.nesting('linker')):
+        key = ('link', _tree_key(tree), None)
+        artifact = job.recall(key, tricks)
+        if artifact is None:
+            artifact = await _async_link(tree, tricks)
+            job.remember(key, tricks, artifact)
+        else:
+            tracing.annotate(memo=True)
+        tracing.annotate(status=artifact.status)
+        return artifact
+
+
+async def _async_link(tree, tricks):
+    """Asynchronous version of _link."""
+    artifacts = []
+    candidate_tricks = match_tricks(tree, tricks)
+    metrics.linker_candidates.observe(len(candidate_tricks))
+    if len(candidate_tricks) > 0:
+        linker_round = candidate_tricks
+        while linker_round:
+            new_artifacts = await _async_build(await _async_render_round(tree, linker_round, tricks))
+            artifacts.extend(new_artifacts)
+            linker_round = _next_round(new_artifacts, candidate_tricks, tricks)
+            if _async_job.get().expired():
+                break
+    elif len(error_domain) > 0:
+        artifacts.extend(await _async_build(
+            await _async_render_round(tree, trick_ids(error_domain), error_domain)))
+    else:  # Fallback in English
+        artifacts.append(Artifact(tree={'root': {'form': 'NoTrick'}}, used_tricks=[], status='600'))  # Not a HTTP code
+    if not artifacts:  # Deadline reached before any compilation was done.
+        artifacts.append(Artifact(tree={'root': {'form': 'Timeout'}}, used_tricks=[], status='504'))
+    return resolve_artifact(artifacts)
+
+
+async def _async_render_round(tree, trick_idxs, tricks):
+    """Render a round of candidate tricks as concurrent tasks, keeping the candidates order.
+
+    The global in flight bound is the one of the transport connection pool.
+    """
+    job = _async_job.get()
+    step = _async_render if batch_parsing else async_compiler
+    name = '_render' if batch_parsing else 'compiler'  # Same memo keys than the blocking steps.
+    tree_key = _tree_key(tree) if job.memo is not None else None
+    semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def bounded_step(trick_idx):
+        if tree_key is not None:
+            result = job.recall((name, tree_key, trick_idx), tricks)
+            if result is not None:
+                return result
+        async with semaphore:
+            result = await step(tree, trick_idx, tricks)
+        if tree_key is not None:
+            job.remember((name, tree_key, trick_idx), tricks, result)
+        return result
+
+    tasks = [asyncio.ensure_future(bounded_step(trick_idx)) for trick_idx in trick_idxs]
+    timeout = None if job.deadline is None else max(0.0, job.deadline - time.monotonic())
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:  # Deadline reached, give up outstanding work.
+        task.cancel()
+    return [task.result() for task in tasks if task in done]
+
+
+async def _async_build(renderings):
+    """Asynchronous version of _build. Batches are parsed in the default executor."""
+    texts = [rendering.text for rendering in renderings if isinstance(rendering, Rendering)]
+    if batch_parsing and len(texts) > 1:
+        trees = iter(await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, SyntaxTree.new_many_from_texts, texts))
     else:
-        r_status = '501'
-    return Artifact(tree=r_tree, used_tricks=[trick_idx], status=r_status)
+        trees = iter(await asyncio.gather(*[SyntaxTree.new_from_text_async(text) for text in texts]))
+    return [
+        Artifact(tree=next(trees), used_tricks=x.used_tricks, status=x.status) if isinstance(x, Rendering) else x
+        for x in renderings
+    ]
+
+
+async def _async_render(tree, trick_idx, tricks):
+    """Asynchronous version of _render."""
+    with tracing.span('compiler', trick=trick_idx, method=tricks[trick_idx].get('when', {}).get('method')), \
+            metrics.trick_compile_seconds.time(_domain_label(tricks), trick_idx):
+        metrics.trick_compilations.inc(_domain_label(tricks), trick_idx)
+        job = _async_job.get()
+        steps = _render_steps(tree, trick_idx, tricks, None if job is None else job.texts)
+        result = None
+        while True:
+            try:
+                need = steps.send(result)
+            except StopIteration as stop:
+                tracing.annotate(status=stop.value.status)
+                return stop.value
+            if isinstance(need, Call):
+                result = await transport.async_request(need.method, need.uri, **need.kwargs)
+                tracing.annotate(uri=need.uri, http_status=result.status_code)
+            elif isinstance(need, Parse):
+                result = await SyntaxTree.new_from_text_async(need.text)
+            else:
+                result = await async_linker(need.tree, tricks)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'Counter', 'Gauge', 'Histogram', 'CallbackMetric', 'exposition', 'CONTENT_TYPE',
+    'requests_total', 'request_seconds', 'parser_calls', 'parser_errors', 'parser_seconds', 'trick_compilations',
+    'trick_compile_seconds', 'linker_candidates', 'documents_in_flight', 'parser_call'
+]
+
+import time
+import threading
+import weakref
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+registry = []  # Every metric, in exposition order.
+
+
+class _Metric(object):
+    """Metric whose values are sharded by thread, so updating them takes no lock.
+
+    Every thread updates its own shard, a dict of label values -> value, and only its first update of a
+    metric takes a lock to register the shard. Readers add up the shards. Shards of finished threads are folded
+    into a base one, as servers may run a thread per request.
+    """
+    kind = None
+
+    def __init__(self, name, help_, labels=()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = {}  # id(shard) -> shard of a live thread.
+        self._base = {}  # Shards of the finished threads added up.
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            self._local.owner = _Owner()  # Dropped with the thread locals when the thread finishes.
+            with self._lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(self._local.owner, self._retire, shard)
+            return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            del self._shards[id(shard)]
+            for values, value in shard.items():
+                self._base[values] = self._added(self._base.get(values), value)
+
+    @staticmethod
+    def _added(total, value):
+        """Return a total plus a shard value, the total being None at first."""
+        raise NotImplementedError
+
+    def _snapshots(self):
+        with self._lock:
+            shards = [self._base.copy()] + list(self._shards.values())
+        return [shard.copy() for shard in shards]  # Atomic copies, the owners may be updating them.
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in pairs) + '}'
+
+    def samples(self):
+        """Yield the (name suffix, label text, value) samples of the metric."""
+        raise NotImplementedError
+
+    def reset(self):
+        with self._lock:
+            self._base.clear()
+            for shard in self._shards.values():
+                shard.clear()
+
+
+class _Owner(object):
+    """Weak referenceable object owned by the thread locals of a metric shard."""
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally by labels."""
+    kind = 'counter'
+
+    def inc(self, *values, amount=1):
+        shard = self._shard()
+        shard[values] = shard.get(values, 0) + amount
+
+    @staticmethod
+    def _added(total, value):
+        return value if total is None else total + value
+
+    def value(self, *values):
+        return sum(shard.get(values, 0) for shard in self._snapshots())
+
+    def totals(self):
+        result = {}
+        for shard in self._snapshots():
+            for values, value in shard.items():
+                result[values] = result.get(values, 0) + value
+        return result
+
+    def samples(self):
+        for values, value in sorted(self.totals().items()):
+            yield '', self._label_text(values), value
+
+
+class Gauge(Counter):
+    """Value going up and down, i.e. the requests in flight. Shards may go negative, their sum can't."""
+    kind = 'gauge'
+
+    def dec(self, *values, amount=1):
+        self.inc(*values, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help_, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *values):
+        shard = self._shard()
+        counts = shard.get(values)
+        if counts is None:
+            counts = shard[values] = [0] * (len(self.buckets) + 1) + [0.0]  # Bucket counts, +Inf, sum.
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *values):
+        """Return a context manager observing the seconds it encloses."""
+        return _Timer(self, values)
+
+    @staticmethod
+    def _added(total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]  # New lists, read unlocked.
+
+    def totals(self):
+        result = {}
+        for shard in self._snapshots():
+            for values, counts in shard.items():
+                counts = list(counts)
+                total = result.setdefault(values, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        return result
+
+    def count(self, *values):
+        counts = self.totals().get(values)
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        for values, counts in sorted(self.totals().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                yield '_bucket', self._label_text(values, [('le', _number(bound))]), cumulative
+            yield '_sum', self._label_text(values), counts[-1]
+            yield '_count', self._label_text(values), cumulative
+
+
+class CallbackMetric(_Metric):
+    """Metric read from a function at exposition time, returning a value or a dict of label values -> value.
+
+    It exposes the counters other modules keep on their own, i.e. the parsing cache ones.
+    """
+
+    def __init__(self, name, help_, function, labels=(), kind='gauge'):
+        super(CallbackMetric, self).__init__(name, help_, labels)
+        self.function = function
+        self.kind = kind
+
+    def reset(self):
+        pass
+
+    def samples(self):
+        values = self.function()
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            yield '', self._label_text(label_values), value
+
+
+class _Timer(object):
+    __slots__ = ('histogram', 'values', 'start')
+
+    def __init__(self, histogram, values):
+        self.histogram = histogram
+        self.values = values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, *self.values)
+        return False
+
+
+class _Call(object):
+    """Context manager counting and timing a call, and counting it as an error if it raises."""
+    __slots__ = ('calls', 'errors', 'seconds', 'values', 'start')
+
+    def __init__(self, calls, errors, seconds, values):
+        self.calls = calls
+        self.errors = errors
+        self.seconds = seconds
+        self.values = values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds.observe(time.perf_counter() - self.start, *self.values)
+        self.calls.inc(*self.values)
+        if exc_type is not None:
+            self.errors.inc(*self.values)
+        return False
+
+
+def parser_call(mode):
+    """Return a context manager accounting a parsing service call of the mode ('single' or 'batch')."""
+    return _Call(parser_calls, parser_errors, parser_seconds, (mode, ))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.append('# HELP {} {}'.format(metric.name, metric.help))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for suffix, labels, value in metric.samples():
+            lines.append('{}{}{} {}'.format(metric.name, suffix, labels, _number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+requests_total = Counter('concha_requests_total', 'HTTP requests served.', ['route', 'method', 'code'])
+request_seconds = Histogram('concha_request_seconds', 'HTTP request latency until the response is built.',
+                            ['route'])
+documents_in_flight = Gauge('concha_documents_in_flight', 'Documents being parsed and linked.')
+parser_calls = Counter('concha_parser_calls_total', 'Parsing service calls.', ['mode'])
+parser_errors = Counter('concha_parser_errors_total', 'Failed parsing service calls.', ['mode'])
+parser_seconds = Histogram('concha_parser_seconds', 'Parsing service call latency.', ['mode'])
+trick_compilations = Counter('concha_trick_compilations_total', 'Compilations of every trick.',
+                             ['domain', 'trick'])
+trick_compile_seconds = Histogram('concha_trick_compile_seconds', 'Trick compilation latency, HTTP calls and '
+                                  'TREAT linkings included.', ['domain', 'trick'])
+linker_candidates = Histogram('concha_linker_candidates', 'Tricks matched by the trees linked.',
+                              buckets=SIZE_BUCKETS)
+treat_parser_calls_saved = Histogram('concha_treat_parser_calls_saved', 'Parser calls saved grafting TREAT sources '
+                                     'with their linked trees, per document.', buckets=SIZE_BUCKETS)
+treat_grafts_parsed = Histogram('concha_treat_grafts_parsed', 'TREAT sources grafted with their parsed replacements, '
+                                'still a parser call each, per document.', buckets=SIZE_BUCKETS)
@@ -28,6 +28,7 @@ else
   INPUT_FORMAT=stdin
 fi
 MODEL_DIR=$1
+BATCH_SIZE=${BATCH_SIZE:=1024}  # 1 parses every line once it is read, as a long-lived parser worker does.
 
 $PARSER_EVAL \
   --input=$INPUT_FORMAT \
@@ -39,7 +40,7 @@ $PARSER_EVAL \
   --resource_dir=$MODEL_DIR \
   --model_path=$MODEL_DIR/morpher-params \
   --slim_model \
-  --batch_size=1024 \
+  --batch_size=$BATCH_SIZE \
   --alsologtostderr \
   | \
   $PARSER_EVAL \
@@ -52,7 +53,7 @@ $PARSER_EVAL \
   --resource_dir=$MODEL_DIR \
   --model_path=$MODEL_DIR/tagger-params \
   --slim_model \
-  --batch_size=1024 \
+  --batch_size=$BATCH_SIZE \
   --alsologtostderr \
   | \
   $PARSER_EVAL \
@@ -65,5 +66,5 @@ $PARSER_EVAL \
   --resource_dir=$MODEL_DIR \
   --model_path=$MODEL_DIR/parser-params \
   --slim_model \
-  --batch_size=1024 \
+  --batch_size=$BATCH_SIZE \
   --alsologtostderr
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'ParseCache',
+]
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from syntax_tree import SyntaxTree
+
+STALE_SECONDS = 3600  # Age of the temporary files no longer being written.
+
+
+class ParseCache(object):
+    """Content addressed cache of parsed trees with LRU/TTL eviction and an optional on-disk tier.
+
+    Entries are keyed on (normalized text, language, locator). Trees are stored and handed out as deep
+    copies, so callers can freely modify what they get without poisoning the cache.
+
+    The on-disk tier has its own LRU bounds. Its files are found on startup in modification time order, which
+    is refreshed on every hit, so the least recently used ones are evicted first across restarts too.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=None, directory=None,
+                 max_disk_entries=16 * 1024, max_disk_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # Seconds, None means no expiration.
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()  # key -> (expiry, size, tree), in LRU order.
+        self._disk_bytes = 0
+        self._disk_entries = OrderedDict()  # file path -> size, in LRU order.
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def key(text, language, locator):
+        """Build the cache key of a text, ignoring irrelevant whitespace differences."""
+        return ' '.join(text.split()), language, locator
+
+    def get(self, key):
+        """Return a copy of the cached tree for the key, or None if it is not (or no longer) cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] is not None and entry[0] < time.time():
+                    self._remove(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2].deepcopy()
+        tree, expiry = self._disk_get(key)
+        with self._lock:
+            if tree is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._insert(key, tree, expiry)
+        return tree.deepcopy()
+
+    def put(self, key, tree):
+        """Store a copy of a tree under the key, evicting the least recently used entries if needed."""
+        tree = tree.deepcopy()
+        expiry = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._insert(key, tree, expiry)
+        self._disk_put(key, tree, expiry)
+
+    def clear(self):
+        """Forget every entry, both in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._disk_entries.clear()
+            self._disk_bytes = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        """Return a dict with the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'disk_entries': len(self._disk_entries),
+                'disk_bytes': self._disk_bytes,
+                'disk_evictions': self.disk_evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _insert(self, key, tree, expiry):
+        """Add an entry and enforce size bounds. The lock must be held."""
+        size = len(json.dumps(tree.to_rows(), ensure_ascii=False).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expiry, size, tree)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        """Drop an entry from memory. The lock must be held."""
+        expiry, size, tree = self._entries.pop(key)
+        self._bytes -= size
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    def _disk_get(self, key):
+        """Read an entry from the on-disk tier returning a (tree, expiry) tuple. Trees are stored as flat rows, as
+        the JSON decoder recursion is bounded, and files without them are ignored."""
+        if not self.directory:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if tuple(record['key']) != key or 'rows' not in record:  # Hash collision, ignore it.
+            return None, None
+        if record['expiry'] is not None and record['expiry'] < time.time():
+            with self._lock:
+                self._disk_remove(path)
+            return None, None
+        with self._lock:
+            if path in self._disk_entries:
+                self._disk_entries.move_to_end(path)
+        try:
+            os.utime(path)  # Recently used for the next startups as well.
+        except OSError:
+            pass
+        return SyntaxTree.new_from_rows(record['rows']), record['expiry']
+
+    def _disk_put(self, key, tree, expiry):
+        """Write an entry in the on-disk tier atomically."""
+        if not self.directory:
+            return
+        path = self._disk_path(key)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'expiry': expiry, 'rows': tree.to_rows()}, f, ensure_ascii=False)
+            size = f.tell()
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_insert(path, size)
+
+    def _scan_disk(self):
+        """Index the files of the on-disk tier in modification time order, dropping stale temporary leftovers
+        of crashes (not the ones other processes sharing the directory are writing)."""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.tmp') and os.stat(path).st_mtime < time.time() - STALE_SECONDS:
+                    os.remove(path)
+                elif name.endswith('.json'):
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, path, stat.st_size))
+            except OSError:  # Removed meanwhile by another process.
+                pass
+        with self._lock:
+            for _, path, size in sorted(files):
+                self._disk_insert(path, size)
+
+    def _disk_insert(self, path, size):
+        """Index a file of the on-disk tier and enforce its bounds. The lock must be held."""
+        self._disk_bytes += size - self._disk_entries.pop(path, 0)
+        self._disk_entries[path] = size
+        while len(self._disk_entries) > self.max_disk_entries or self._disk_bytes > self.max_disk_bytes:
+            self._disk_remove(next(iter(self._disk_entries)))
+            self.disk_evictions += 1
+
+    def _disk_remove(self, path):
+        """Drop a file of the on-disk tier. The lock must be held."""
+        self._disk_bytes -= self._disk_entries.pop(path, 0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # Already evicted, i.e. by another worker sharing the directory.
+            pass
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'WorkerPool', 'syntaxnet_command', 'stub_command', 'model_directory'
+]
+
+import os
+import sys
+import time
+import queue
+import select
+import argparse
+import threading
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODEL_LANGUAGES = {'es': 'Spanish', 'en': 'English'}  # Language code -> lang_models directory.
+
+
+def model_directory(language, root=os.path.join(HERE, '..', 'lang_models')):
+    """Return the lang_models/<Language> directory of a language code."""
+    return os.path.join(root, MODEL_LANGUAGES.get(language, language))
+
+
+def syntaxnet_command(model_dir):
+    """Return the command and environment of a parse.sh SyntaxNet pipeline parsing every line once it is read."""
+    return ['bash', os.path.join(HERE, 'parse.sh'), model_dir], dict(os.environ, BATCH_SIZE='1')
+
+
+def stub_command(load_seconds=0.0):
+    """Return the command of a stub worker, chaining every word as the object of the former one."""
+    return [sys.executable, os.path.abspath(__file__), '--stub', '--load-seconds', str(load_seconds)]
+
+
+class Worker(object):
+    """A long-lived parser process reading a sentence per line and writing its CoNLL lines plus a blank one.
+
+    Its stdout is read from the pipe descriptor, waiting for it with select, so a parsing has a deadline.
+    """
+
+    def __init__(self, command, env=None):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, cwd=HERE, env=env, encoding='utf-8',
+                                        bufsize=1)  # Line buffered.
+        self._buffer = b''  # Read but not yet returned stdout bytes.
+
+    def parse(self, sentence, timeout=None):
+        """Return the CoNLL lines of a sentence, raising TimeoutError if they aren't read in timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.process.stdin.write(sentence + '\n')
+        self.process.stdin.flush()
+        lines = []
+        while True:
+            line = self._readline(deadline)
+            if not line:
+                raise EOFError('Parser worker {} exited'.format(self.process.pid))
+            if not line.strip():
+                if lines:  # The blank line ending the sentence.
+                    return ''.join(lines)
+                continue
+            lines.append(line)
+
+    def _readline(self, deadline):
+        descriptor = self.process.stdout.fileno()
+        while b'\n' not in self._buffer:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and (remaining <= 0 or not select.select([descriptor], [], [], remaining)[0]):
+                raise TimeoutError('Parser worker {} did not answer in time'.format(self.process.pid))
+            chunk = os.read(descriptor, 65536)
+            if not chunk:
+                return ''
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode('utf-8') + '\n'
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self, kill=False):
+        """Stop the process, at once if kill (i.e. a hung one)."""
+        if not kill:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+                return
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self.process.kill()
+        self.process.wait()
+
+
+class WorkerPool(object):
+    """Pool of long-lived parser worker processes, so models are loaded once instead of on every parsing.
+
+    Every parse() takes an idle worker, waiting up to timeout seconds for one, and sends it a single
+    sentence over its stdin pipe. A worker failing or exiting is replaced by a new one, at most restarts
+    times in a row. A worker not answering in parse_timeout seconds is killed and TimeoutError raised, as
+    it would likely hang again. Workers are started lazily, up to size.
+    """
+
+    def __init__(self, command, size=2, timeout=30, restarts=3, env=None, parse_timeout=60):
+        self.command = command
+        self.size = size
+        self.timeout = timeout
+        self.parse_timeout = parse_timeout  # Seconds, None means no deadline.
+        self.restarts = restarts
+        self.env = env
+        self.parsings = 0
+        self.failures = 0
+        self._idle = queue.LifoQueue()  # Recently used workers first, keeping their caches warm.
+        self._started = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def parse(self, text):
+        """Return the CoNLL text of a sentence."""
+        sentence = ' '.join(text.split())  # A sentence per line.
+        if not sentence:
+            raise ValueError('There is no sentence to parse')
+        for attempt in range(self.restarts + 1):
+            worker = self._acquire()
+            try:
+                result = worker.parse(sentence, self.parse_timeout)
+            except TimeoutError:
+                self._discard(worker, kill=True)
+                raise
+            except (OSError, EOFError, ValueError):
+                self._discard(worker)
+                if attempt == self.restarts:
+                    raise
+                continue
+            with self._lock:
+                self.parsings += 1
+            if self._closed:
+                self._discard(worker, failed=False)
+            else:
+                self._idle.put(worker)
+            return result
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            start = self._started < self.size
+            if start:
+                self._started += 1
+        if start:
+            try:
+                return Worker(self.command, self.env)
+            except OSError:
+                with self._lock:
+                    self._started -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError('No parser worker was idle in {} seconds'.format(self.timeout))
+
+    def _discard(self, worker, failed=True, kill=False):
+        worker.close(kill)
+        with self._lock:
+            self._started -= 1
+            self.failures += failed
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self._started, 'idle': self._idle.qsize(), 'parsings': self.parsings,
+                    'failures': self.failures}
+
+    def close(self):
+        """Stop the idle workers. Busy ones are stopped once they are done."""
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(worker, failed=False)
+
+
+def stub_worker(load_seconds, stdin=sys.stdin, stdout=sys.stdout):
+    """Serve stub CoNLL parsings of the stdin lines, after simulating a model load."""
+    time.sleep(load_seconds)
+    for line in stdin:
+        words = line.split()
+        for i, word in enumerate(words):
+            stdout.write('\t'.join([str(i + 1), word, word.lower(), 'X', '_', 'fPOS=X++', str(i),
+                                    'root' if i == 0 else 'obj', '_', '_']) + '\n')
+        stdout.write('\n')
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parser worker process.')
+    parser.add_argument('--stub', action="store_true", help='stub parser, no model needed')
+    parser.add_argument('--load-seconds', type=float, default=0.0, help='simulated model loading time')
+    args = parser.parse_args()
+    if args.stub:
+        stub_worker(args.load_seconds)
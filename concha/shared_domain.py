@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'SharedDomain'
+]
+
+import os
+import mmap
+import fcntl
+import struct
+import threading
+from contextlib import contextmanager
+from domain_snapshot import MappedDomain, write_snapshot
+
+VERSION = struct.Struct('<Q')  # Published version, in the memory mapped version file.
+
+
+class SharedDomain(object):
+    """Trick domain shared by the worker processes of a directory, as versioned read-only snapshots.
+
+    The current version number lives in a memory mapped file every process reads on each request, which
+    costs a few hundred nanoseconds. A changed version is mapped once per process from its binary snapshot,
+    with its match index precomputed, and swapped in whole, so every request sees a consistent domain.
+    Changes are done holding an exclusive flock of the directory: the latest version is applied the change
+    and published as a new snapshot file, written aside and renamed before the version number is increased.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = None
+        self._thread_lock = threading.RLock()  # The flock is per open file, threads need their own lock.
+        version_path = os.path.join(directory, 'version')
+        with self.lock():
+            if not os.path.exists(version_path) or os.path.getsize(version_path) < VERSION.size:
+                with open(version_path, 'wb') as version_file:
+                    version_file.write(VERSION.pack(0))
+        self._version_file = open(version_path, 'r+b')
+        self._version_map = mmap.mmap(self._version_file.fileno(), VERSION.size)
+
+    def version(self):
+        """Return the published version, 0 meaning nothing was published yet."""
+        return VERSION.unpack_from(self._version_map, 0)[0]
+
+    @contextmanager
+    def lock(self):
+        """Hold the exclusive lock of the domain among processes and threads."""
+        with self._thread_lock:
+            if self._lock_file is not None:  # Reentrant.
+                yield
+                return
+            self._lock_file = open(os.path.join(self.directory, 'lock'), 'a')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                yield
+            finally:
+                self._lock_file.close()  # Releases the flock.
+                self._lock_file = None
+
+    def load(self):
+        """Return the (version, tricks, error tricks) of the latest published version.
+
+        Tricks are a read-only MappedDomain, and error tricks a TrickDomain.
+        """
+        while True:
+            version = self.version()
+            try:
+                tricks = MappedDomain(self._path(version))
+            except FileNotFoundError:  # Collected after a newer version was published, read it instead.
+                continue
+            return version, tricks, tricks.error_tricks
+
+    def publish(self, tricks, error_tricks):
+        """Publish the domains as the next version. To be called holding the lock. Return the new version."""
+        version = self.version() + 1
+        write_snapshot(self._path(version), tricks, error_tricks)
+        VERSION.pack_into(self._version_map, 0, version)
+        self._version_map.flush()
+        self._collect(version)
+        return version
+
+    def _collect(self, version):
+        """Remove the snapshots older than the former version, which readers may still be opening.
+
+        Removed snapshots stay mapped by the workers still using them until they are unmapped.
+        """
+        for name in os.listdir(self.directory):
+            if name.startswith('domain-') and name.endswith('.cnd') and int(name[7:-4]) < version - 1:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _path(self, version):
+        return os.path.join(self.directory, 'domain-{}.cnd'.format(version))
+
+    def close(self):
+        self._version_map.close()
+        self._version_file.close()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'Storage', 'LogStorage', 'SQLiteStorage', 'new_storage'
+]
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class Storage(object):
+    """Persistence of the tricks and documents state as a write-ahead log of changes plus a compacted snapshot.
+
+    Changes are ('append', id, trick), ('set', id, trick), ('delete', id), ('document', record) and ('batch',
+    [change, ...]) lists, a batch being logged in a single line so it is replayed whole or not at all. They are
+    applied in order to the snapshot state: {"tricks": {id: trick}, "error_tricks": {id: trick}, "next_ids":
+    {"tricks": id, "error_tricks": id}, "documents": [...], "documents_first_id": id}, the id of the first document
+    snapshot as the older ones may no longer be retained. Next ids are kept so deleted ids are never given
+    again. Every snapshot_every changes the caller is asked to compact the log writing a new snapshot.
+
+    Every snapshot has a new "log_generation", and logs whose changes are already in the snapshot, as a crash
+    between writing the snapshot and truncating the log leaves them, are not replayed.
+    """
+
+    def __init__(self, snapshot_every=1000):
+        self.snapshot_every = snapshot_every
+        self.changes = 0  # Logged changes since the last snapshot.
+        self.startup = None  # Statistics of the last load.
+        self.generation = 0  # Log generation of the last snapshot.
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the state replaying the log over the snapshot, without validating tricks again."""
+        start = time.monotonic()
+        snapshot, changes = self._read()
+        self.generation = snapshot.get('log_generation', 0)
+        state = {  # JSON objects can't have integer keys, so tricks are snapshot as [id, trick] pairs.
+            'tricks': {id_: trick for id_, trick in snapshot.get('tricks', [])},
+            'error_tricks': {id_: trick for id_, trick in snapshot.get('error_tricks', [])},
+            'next_ids': snapshot.get('next_ids', {'tricks': 0, 'error_tricks': 0}),
+            'documents': list(snapshot.get('documents', [])),
+            'documents_first_id': snapshot.get('documents_first_id', 0)  # Older documents weren't retained.
+        }
+        for change in changes:
+            Storage.apply(state, change)
+        self.changes = len(changes)
+        self.startup = {
+            'tricks': len(state['tricks']) + len(state['error_tricks']),
+            'documents': len(state['documents']),
+            'replayed_changes': len(changes),
+            'seconds': time.monotonic() - start
+        }
+        return state
+
+    @staticmethod
+    def apply(state, change):
+        """Apply a logged change to a state."""
+        kind = change[0]
+        if kind == 'append':
+            id_, trick = change[1], change[2]
+            is_error = trick.get('when', {}).get('method') == 'ERROR'  # As trick.append_trick does.
+            domain = 'error_tricks' if is_error else 'tricks'
+            state[domain][id_] = trick
+            state['next_ids'][domain] = max(state['next_ids'][domain], id_ + 1)
+        elif kind == 'set':
+            state['tricks'][change[1]] = change[2]
+            state['next_ids']['tricks'] = max(state['next_ids']['tricks'], change[1] + 1)
+        elif kind == 'delete':
+            state['tricks'].pop(change[1], None)
+        elif kind == 'document':
+            state['documents'].append(change[1])
+        elif kind == 'batch':
+            for batch_change in change[1]:
+                Storage.apply(state, batch_change)
+        else:
+            raise ValueError('Unknown change "{}"'.format(kind))
+
+    def log(self, *change):
+        """Durably append a change. Return True when a snapshot is due."""
+        line = json.dumps(change, ensure_ascii=False)
+        with self._lock:
+            self._write_change(line)
+            self.changes += 1
+            return self.snapshot_every is not None and self.changes >= self.snapshot_every
+
+    def snapshot(self, state):
+        """Replace the snapshot by the given state and truncate the log."""
+        data = {
+            'tricks': list(state['tricks'].items()),
+            'error_tricks': list(state['error_tricks'].items()),
+            'next_ids': state['next_ids'],
+            'documents': state['documents'],
+            'documents_first_id': state.get('documents_first_id', 0)
+        }
+        with self._lock:
+            data['log_generation'] = self.generation + 1
+            self._write_snapshot(json.dumps(data, ensure_ascii=False))
+            self.generation += 1
+            self.changes = 0
+
+    def stats(self):
+        return {'changes_since_snapshot': self.changes, 'startup': self.startup}
+
+    def close(self):
+        pass
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _write_change(self, line):
+        raise NotImplementedError
+
+    def _write_snapshot(self, data):
+        raise NotImplementedError
+
+
+class LogStorage(Storage):
+    """Storage in a directory holding a snapshot.json file and a changes.jsonl append-only log.
+
+    The log starts with a ["generation", generation] line, missing in the first one (generation 0).
+    """
+
+    def __init__(self, directory, snapshot_every=1000, sync=True):
+        super(LogStorage, self).__init__(snapshot_every)
+        self.directory = directory
+        self.sync = sync  # fsync every change, otherwise only flushed.
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, 'snapshot.json')
+        self.log_path = os.path.join(directory, 'changes.jsonl')
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+
+    def _read(self):
+        state = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as snapshot:
+                state = json.load(snapshot)
+        changes, end, generation = [], 0, 0
+        with open(self.log_path, 'rb') as log:
+            for line in log:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    change = json.loads(line.decode('utf-8'))
+                    if change[0] == 'generation':
+                        generation = change[1]
+                    else:
+                        changes.append(change)
+                except ValueError:  # A torn last line of a crash, that change was never acknowledged.
+                    break
+                end += len(line)
+        if end < os.path.getsize(self.log_path):  # Removed, or the next change would be appended to it.
+            os.truncate(self.log_path, end)
+        if generation < state.get('log_generation', 0):  # Already in the snapshot.
+            self._new_log(state['log_generation'])
+            changes = []
+        return state, changes
+
+    def _write_change(self, line):
+        self._log.write(line + '\n')
+        self._log.flush()
+        if self.sync:
+            os.fsync(self._log.fileno())
+
+    def _write_snapshot(self, data):
+        temporary_path = self.snapshot_path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as snapshot:
+            snapshot.write(data)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary_path, self.snapshot_path)  # Atomic, the former log is skipped after a crash.
+        self._new_log(self.generation + 1)
+
+    def _new_log(self, generation):
+        self._log.close()
+        self._log = open(self.log_path, 'w', encoding='utf-8')
+        self._write_change(json.dumps(['generation', generation]))
+
+    def close(self):
+        self._log.close()
+
+
+class SQLiteStorage(Storage):
+    """Storage in a local SQLite database, with the same log and snapshot tables."""
+
+    def __init__(self, path, snapshot_every=1000):
+        super(SQLiteStorage, self).__init__(snapshot_every)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY, state TEXT)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY, change TEXT)')
+        self._connection.commit()
+
+    def _read(self):
+        row = self._connection.execute('SELECT state FROM snapshot WHERE id = 0').fetchone()
+        changes = [json.loads(x[0]) for x in self._connection.execute('SELECT change FROM changes ORDER BY seq')]
+        return json.loads(row[0]) if row else {}, changes
+
+    def _write_change(self, line):
+        with self._connection:
+            self._connection.execute('INSERT INTO changes (change) VALUES (?)', (line, ))
+
+    def _write_snapshot(self, data):
+        with self._connection:  # A single transaction.
+            self._connection.execute('INSERT OR REPLACE INTO snapshot (id, state) VALUES (0, ?)', (data, ))
+            self._connection.execute('DELETE FROM changes')
+
+    def close(self):
+        self._connection.close()
+
+
+def new_storage(location, snapshot_every=1000):
+    """Return a SQLiteStorage for .db/.sqlite files or a LogStorage for directories."""
+    if location.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteStorage(location, snapshot_every)
+    return LogStorage(location, snapshot_every)
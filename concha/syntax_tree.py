@@ -19,9 +19,18 @@ __all__ = [
     'SyntaxTree',
 ]
 
-import subprocess
-import requests
 import json
+import asyncio
+import contextvars
+import threading
+import weakref
+import transport
+import tracing
+import metrics
+from parser_backend import WorkerPool, syntaxnet_command, model_directory
+from bisect import bisect_left
+from itertools import chain
+from operator import itemgetter
 from functools import reduce
 from ast import literal_eval
 # from collections import namedtuple
@@ -42,37 +51,203 @@ class SyntaxTree(dict):
 #        super(SyntaxTree, self).__init__(*arg, **kw)
 
     locator = 'localhost:7000'
+    language = 'es'
+    cache = None  # Optional ParseCache shared by every parsing.
+    interning = False  # Share identical subtrees of the parsed trees, which become immutable.
+    backend = None  # Optional parser_backend.WorkerPool parsing locally to CoNLL instead of the parsing service.
+    shell_backend = None  # SyntaxNet WorkerPool of the deprecated shell_method, started on first use.
+
+    _hash = None  # Cached structural hash.
+    _tokens = None  # Cached (id, form) of the subtree tokens, in token order.
+    _text = None  # Cached linearization of the subtree.
+    _parent = None  # Weak reference to the node whose hash or tokens include this one.
+    _interned = False
+    _interned_trees = weakref.WeakValueDictionary()  # Structural hash -> shared immutable node.
+    _intern_lock = threading.Lock()
 
     @staticmethod
     def new_from_text(text, shell_method=False):
-        new = SyntaxTree()
         if shell_method:  # TODO DEPRECATED
-            """Do a slow Syntaxnet UniversalParsey parsing returning its connl text output in a CoNNL tree."""
-            text = reduce(lambda a, kv: a.replace(*kv), REPLS, text)  # Tokenize punctuation symbols
-            shell_cmd = 'echo "' + text + '" | ./parse.sh ../lang_models/Spanish'
-            connl_bin_output = subprocess.check_output([shell_cmd], shell=True)
-            connl_txt = connl_bin_output.decode('utf-8')  # From Binary to String
-            new.parse_connl(connl_txt)
+            """Do a Syntaxnet UniversalParsey parsing by a long-lived parse.sh worker, loading the model once."""
+            if SyntaxTree.shell_backend is None:
+                SyntaxTree.shell_backend = WorkerPool(*syntaxnet_command(model_directory(SyntaxTree.language)))
+            return SyntaxTree().parse_connl(SyntaxTree.shell_backend.parse(SyntaxTree._tokenized(text)))
         else:
-            uri = 'http://{}/v1/documents:analyzeSyntax'.format(SyntaxTree.locator)
-            response = requests.post(
+            with tracing.span('new_from_text', characters=len(text)):
+                key = None
+                if SyntaxTree.cache is not None:
+                    key = SyntaxTree.cache.key(text, SyntaxTree.language, SyntaxTree.locator)
+                    cached = SyntaxTree.cache.get(key)
+                    if cached is not None:
+                        tracing.annotate(cached=True)
+                        return cached
+                new = SyntaxTree._analyze(text)
+                if key is not None:
+                    SyntaxTree.cache.put(key, new)
+                return new
+
+    @staticmethod
+    async def new_from_text_async(text):
+        """Asynchronous version of new_from_text for the parsing service."""
+        with tracing.span('new_from_text', characters=len(text)):
+            key = None
+            if SyntaxTree.cache is not None:
+                key = SyntaxTree.cache.key(text, SyntaxTree.language, SyntaxTree.locator)
+                cached = SyntaxTree.cache.get(key)
+                if cached is not None:
+                    tracing.annotate(cached=True)
+                    return cached
+            if SyntaxTree.backend is not None:  # Worker pipes are blocking.
+                new = await asyncio.get_running_loop().run_in_executor(
+                    None, contextvars.copy_context().run, SyntaxTree._analyze, text)
+            else:
+                uri = 'http://{}/v1/documents:analyzeSyntax'.format(SyntaxTree.locator)
+                with metrics.parser_call('single'):
+                    response = await transport.async_request('POST', uri, json=SyntaxTree._analyze_request(text))
+                    new = SyntaxTree._analyze_response(text, response)
+            if key is not None:
+                SyntaxTree.cache.put(key, new)
+            return new
+
+    @staticmethod
+    def new_many_from_texts(texts):
+        """Parse a list of texts in a single round trip to the parsing service, returning a list of trees.
+
+        The parsing service is expected to answer a {"requests": [...]} batch of analyzeSyntax requests with
+        a {"responses": [...]} list of analyzeSyntax responses in the same order. Services without the batch
+        route are called once per text. With a local backend texts are parsed one by one by its workers.
+        """
+        with tracing.span('new_many_from_texts', texts=len(texts)):
+            results = [None] * len(texts)
+            pending = {}  # Text -> positions in results, so repeated texts are parsed once.
+            for i, text in enumerate(texts):
+                if SyntaxTree.cache is not None:
+                    cached = SyntaxTree.cache.get(SyntaxTree.cache.key(text, SyntaxTree.language, SyntaxTree.locator))
+                    if cached is not None:
+                        results[i] = cached
+                        continue
+                pending.setdefault(text, []).append(i)
+            if not pending:
+                return results
+            unique_texts = list(pending)
+            if SyntaxTree.backend is not None:  # Parsed one by one by the local workers.
+                trees = [SyntaxTree._analyze(text) for text in unique_texts]
+            else:
+                trees = SyntaxTree._batch_analyze(unique_texts)
+            for text, tree in zip(unique_texts, trees):
+                if SyntaxTree.cache is not None:
+                    SyntaxTree.cache.put(SyntaxTree.cache.key(text, SyntaxTree.language, SyntaxTree.locator), tree)
+                positions = pending[text]
+                results[positions[0]] = tree
+                for position in positions[1:]:
+                    results[position] = tree.deepcopy()
+            return results
+
+    @staticmethod
+    def _batch_analyze(texts):
+        """Call the batch route of the parsing service, or the single one per text if there's no batch route."""
+        uri = 'http://{}/v1/documents:batchAnalyzeSyntax'.format(SyntaxTree.locator)
+        with metrics.parser_call('batch'):
+            response = transport.post(
                 url=uri,
-                json={
-                    "document": {
-                        "type": "PLAIN_TEXT",
-                        "language": "es",
-                        "content": text
-                    },
-                    "encodingType": "UTF8"
-                }
+                json={"requests": [SyntaxTree._analyze_request(text) for text in texts]}
             )
-            if response.status_code == 200 and 'json' in response.headers['content-type']:
-                new.parse_gcnl(json.loads(response.text))
-            else:
+        if response.status_code in (404, 405):  # No batch support, fallback to one by one.
+            trees = [SyntaxTree._analyze(text) for text in texts]
+        elif response.status_code == 200 and 'json' in response.headers['content-type']:
+            responses = json.loads(response.text).get('responses', [])
+            if len(responses) != len(texts):
+                metrics.parser_errors.inc('batch')
                 raise SyntaxTree.SyntaxError(
-                    text,
-                    'Parsing service returned the error code ({}): "{}"'.format(response.status_code, response.text))
-            return new
+                    texts, 'Parsing service returned {} responses for {} texts'.format(
+                        len(responses), len(texts)))
+            trees = [SyntaxTree().parse_gcnl(gcnl_json) for gcnl_json in responses]
+        else:
+            metrics.parser_errors.inc('batch')
+            raise SyntaxTree.SyntaxError(
+                texts,
+                'Parsing service returned the error code ({}): "{}"'.format(response.status_code, response.text))
+        return trees
+
+    @staticmethod
+    def _analyze(text):
+        """Call the parsing service, or the local backend, for a single text."""
+        if SyntaxTree.backend is not None:
+            with metrics.parser_call('backend'):
+                return SyntaxTree().parse_connl(SyntaxTree.backend.parse(SyntaxTree._tokenized(text)))
+        uri = 'http://{}/v1/documents:analyzeSyntax'.format(SyntaxTree.locator)
+        with metrics.parser_call('single'):
+            response = transport.post(url=uri, json=SyntaxTree._analyze_request(text))
+            return SyntaxTree._analyze_response(text, response)
+
+    @staticmethod
+    def _tokenized(text):
+        """Split the punctuation symbols of a text as separated words, as SyntaxNet expects them."""
+        return reduce(lambda a, kv: a.replace(*kv), REPLS, text)
+
+    @staticmethod
+    def _analyze_response(text, response):
+        """Build a tree out of an analyzeSyntax response."""
+        if response.status_code == 200 and 'json' in response.headers['content-type']:
+            return SyntaxTree().parse_gcnl(json.loads(response.text))
+        else:
+            raise SyntaxTree.SyntaxError(
+                text,
+                'Parsing service returned the error code ({}): "{}"'.format(response.status_code, response.text))
+
+    @staticmethod
+    def _analyze_request(text):
+        """Build the body of an analyzeSyntax request."""
+        return {
+            "document": {
+                "type": "PLAIN_TEXT",
+                "language": SyntaxTree.language,
+                "content": text
+            },
+            "encodingType": "UTF8"
+        }
+
+    @staticmethod
+    def new_from_dict(tree_dict):
+        """Rebuild a SyntaxTree out of its plain dict (i.e. JSON) version, without recursion."""
+        new = SyntaxTree()
+        pending = [(tree_dict, new)]
+        while pending:
+            source, target = pending.pop()
+            for key, value in source.items():
+                if isinstance(value, dict) and key not in SUBTREE_KEYS:
+                    node = SyntaxTree()
+                    pending.append((value, node))
+                    value = node
+                dict.__setitem__(target, key, value)
+        return new
+
+    @staticmethod
+    def new_from_rows(rows):
+        """Rebuild a SyntaxTree out of the rows given by to_rows()."""
+        nodes = []
+        for parent, label, fields in rows:
+            node = SyntaxTree()
+            dict.update(node, fields)
+            if parent is not None:
+                dict.__setitem__(nodes[parent], label, node)
+            nodes.append(node)
+        return nodes[0]
+
+    def to_rows(self):
+        """Return the tree as a flat list of [parent row, label, fields] rows, parents first, so it can be stored
+        as JSON whatever its depth. The first row is self, without parent nor label."""
+        rows, pending = [], [(None, None, self)]
+        while pending:
+            parent, label, node = pending.pop()
+            fields = {}
+            for key, value in node.items():
+                if isinstance(value, dict) and key not in SUBTREE_KEYS:
+                    pending.append((len(rows), key, value))
+                else:
+                    fields[key] = value
+            rows.append([parent, label, fields])
+        return rows
 
     @staticmethod
     def point_to_content(tree, path):
@@ -89,26 +264,26 @@ class SyntaxTree(dict):
         """Update inner dict structure out of a CoNNL text format."""
         try:
             connl_tabular_text = connl_tabular_text.rstrip()  # Removing unwanted ending '\n'.
-            tokens = []
             root = None
+            labels, heads, nodes = [], [], []
             words = connl_tabular_text.split('\n')  # A word per line.
             for word in words:
-                values = word.split('\t')  # A CoNLL field per tab.
-                token = dict(zip(CONNL_KEYS, values))  # New Token with Key-Value joining.
-                token['children'] = []  # Add an extra empty field for tree dependency reversing.
-                if token['head'] == '0':  # Identify ROOT index.
-                    token['deprel'] = 'root'
-                    root = int(token['id']) - 1
+                token = dict(zip(CONNL_KEYS, word.split('\t')))  # A CoNLL field per tab.
                 token['feats'] = literal_eval('{{"{}"}}'.format(
                     reduce(lambda a, kv: a.replace(*kv), REPL2, token['feats'])
                 ))
-                tokens.append(token)  # Add k-v to the token list.
-            for token in tokens:  # Reverse the tree dependencies fulfilling the children field.
-                head_index = int(token['head']) - 1
-                if head_index >= 0:
-                    tokens[head_index]['children'].append(int(token['id']) - 1)
-            tree = SyntaxTree._fill_connl(root, tokens)  # Recursive tree completion.
-            self.update(tree)
+                if token['head'] == '0':  # Identify ROOT index.
+                    token['deprel'] = 'root'
+                    root = int(token['id']) - 1
+                labels.append(token['deprel'])
+                heads.append(int(token['head']) - 1)
+                node = SyntaxTree()
+                for key in SUBTREE_KEYS:
+                    if token[key] != '_':
+                        dict.__setitem__(node, key, token[key])
+                nodes.append(node)
+            tree = SyntaxTree._fill_tree(root, labels, heads, nodes)
+            self.update(SyntaxTree._intern_nodes(tree) if SyntaxTree.interning else tree)
         except Exception:
             raise SyntaxTree.SyntaxError(connl_tabular_text, 'The text was not CoNNL compliant.')
         return self
@@ -117,63 +292,202 @@ class SyntaxTree(dict):
         """Update inner dict structure out of a Google Cloud Natural Language syntax format."""
         try:
             root = None
-            for idx, token in enumerate(gcnl_json['tokens']):  # Reverse tree dependencies adding the children field.
+            labels, heads, nodes = [], [], []
+            for idx, token in enumerate(gcnl_json['tokens']):
                 head_index = token['dependencyEdge']['headTokenIndex']
-                if 'children' not in token:  # Extra field for tree dependency reversing.
-                    token['children'] = []
                 if head_index == idx:  # Identify ROOT index.
                     root = idx
-                elif 'children' in gcnl_json['tokens'][head_index]:  # Not in ROOT
-                        gcnl_json['tokens'][head_index]['children'].append(idx)
-                else:
-                    gcnl_json['tokens'][head_index]['children'] = [idx]
-            tree = SyntaxTree._fill_gcnl(root, gcnl_json['tokens'])  # Recursive tree completion.
-            self.update(tree)
+                labels.append(token['dependencyEdge']['label'])
+                heads.append(head_index)
+                node = SyntaxTree()
+                dict.__setitem__(node, 'id', idx)
+                dict.__setitem__(node, 'form', token['text']['content'])
+                dict.__setitem__(node, 'lemma', token['lemma'])
+                part_of_speech = token['partOfSpeech']
+                if 'fPOS' in part_of_speech:
+                    dict.__setitem__(node, 'upostag', part_of_speech['fPOS'].rstrip('+'))
+                elif 'tag' in part_of_speech:
+                    dict.__setitem__(node, 'upostag', part_of_speech['tag'])
+                dict.__setitem__(node, 'feats', part_of_speech)
+                nodes.append(node)
+            tree = SyntaxTree._fill_tree(root, labels, heads, nodes)
+            self.update(SyntaxTree._intern_nodes(tree) if SyntaxTree.interning else tree)
         except Exception:
             raise SyntaxTree.SyntaxError(gcnl_json, 'The json was not Google compliant.')
         return self
 
     @staticmethod
-    def _fill_connl(index, tokens):
-        """Recursively fulfill DEPREL relationships."""
-        label = tokens[index]['deprel']
-        subtree = SyntaxTree()
-        for i in SUBTREE_KEYS:
-            if tokens[index][i] != '_':
-                subtree.update({i: tokens[index][i]})
-        for child_index in tokens[index]['children']:
-            subtree.update(SyntaxTree._fill_connl(child_index, tokens))
-        result = SyntaxTree({label: subtree})
-        return result
+    def _fill_tree(root, labels, heads, nodes):
+        """Link every token node to its head node under its DEPREL label, in a single pass without recursion.
 
-    @staticmethod
-    def _fill_gcnl(index, tokens):
-        """Recursively fulfill dependencyEdge relationships."""
-        label = tokens[index]['dependencyEdge']['label']
-        subtree = SyntaxTree()
-        subtree.update({'id': index})
-        subtree.update({'form': tokens[index]['text']['content']})
-        subtree.update({'lemma': tokens[index]['lemma']})
-        if 'fPOS' in tokens[index]['partOfSpeech']:
-            subtree.update({'upostag': tokens[index]['partOfSpeech']['fPOS'].rstrip('+')})
-        elif 'tag' in tokens[index]['partOfSpeech']:
-            subtree.update({'upostag': tokens[index]['partOfSpeech']['tag']})
-        subtree.update({'feats': tokens[index]['partOfSpeech']})
-        for child_index in tokens[index]['children']:
-            subtree.update(SyntaxTree._fill_gcnl(child_index, tokens))
-        result = SyntaxTree({label: subtree})
-        return result
+        Children are added in token order, as the former recursive builders did, so a repeated label keeps
+        the last child.
+        """
+        for index, node in enumerate(nodes):
+            if index != root and heads[index] >= 0:
+                dict.__setitem__(nodes[heads[index]], labels[index], node)
+        return SyntaxTree({labels[root]: nodes[root]})
 
     def deepcopy(self):
-        """Creates a deep copy of self."""
+        """Creates a deep copy of self without recursion. Interned nodes are immutable, so they are shared instead
+        of copied."""
         branch = SyntaxTree()
-        for key, value in self.items():
-            if isinstance(value, SyntaxTree):
-                branch.update(SyntaxTree({key: value.deepcopy()}))
-            else:
-                branch.update(SyntaxTree({key: value}))
+        pending = [(self, branch)]
+        while pending:
+            source, target = pending.pop()
+            for key, value in source.items():
+                if isinstance(value, SyntaxTree):
+                    if not value._interned:
+                        node = SyntaxTree()
+                        node._parent = weakref.ref(target)  # Its copied hash is included in the target one.
+                        pending.append((value, node))
+                        value = node
+                elif isinstance(value, dict):  # 'feats' are plain dicts.
+                    value = dict(value)
+                dict.__setitem__(target, key, value)
+            target._hash = source._hash
         return branch
 
+    @staticmethod
+    def intern(tree):
+        """Return a shared immutable tree equal to the given one, reusing identical subtrees of other trees.
+
+        Nodes are interned children first, without recursion."""
+        if tree._interned:
+            return tree
+        order, pending = [], [tree]
+        while pending:  # Parents before their children, so they are interned in the reverse order.
+            node = pending.pop()
+            order.append(node)
+            pending.extend(value for value in node.values() if isinstance(value, SyntaxTree) and not value._interned)
+        interned = {}  # id() of the source node -> its interned version.
+        for node in reversed(order):
+            candidate = SyntaxTree()
+            for key, value in node.items():
+                if isinstance(value, SyntaxTree):
+                    value = interned.get(id(value), value)
+                elif isinstance(value, dict):
+                    value = dict(value)
+                dict.__setitem__(candidate, key, value)
+            candidate._interned = True
+            structural_hash = hash(candidate)
+            with SyntaxTree._intern_lock:
+                shared = SyntaxTree._interned_trees.get(structural_hash)
+                if shared is None:
+                    SyntaxTree._interned_trees[structural_hash] = candidate
+                elif dict.__eq__(shared, candidate):  # Children are interned, so compared by identity.
+                    candidate = shared
+            interned[id(node)] = candidate  # New, shared, or a hash collision kept unshared.
+        return interned[id(tree)]
+
+    @staticmethod
+    def _intern_nodes(tree):
+        """Intern the nodes under the root labels of a tree, keeping the top level dict mutable."""
+        return SyntaxTree((label, SyntaxTree.intern(node)) for label, node in tree.items())
+
+    def __hash__(self):
+        """Structural hash, cached until the node or any of its hashed descendants is modified.
+
+        Descendants are hashed first, without recursion. 'feats' plain dicts are hashed by value but their in
+        place changes aren't tracked.
+        """
+        if self._hash is None:
+            order, pending = [], [self]
+            while pending:  # Parents before their children, so they are hashed in the reverse order.
+                node = pending.pop()
+                order.append(node)
+                pending.extend(value for value in node.values()
+                               if isinstance(value, SyntaxTree) and value._hash is None)
+            for node in reversed(order):
+                items = []
+                for key, value in node.items():
+                    if isinstance(value, SyntaxTree):
+                        if not value._interned:
+                            value._parent = weakref.ref(node)
+                        items.append((key, value._hash))
+                    elif isinstance(value, dict):
+                        items.append((key, frozenset(value.items())))
+                    elif isinstance(value, list):
+                        items.append((key, tuple(value)))
+                    else:
+                        items.append((key, value))
+                node._hash = hash(frozenset(items))
+        return self._hash
+
+    def __eq__(self, other):
+        """Compare by value, deciding by identity or by structural hash in the common cases, without recursion."""
+        pending = [(self, other)]
+        while pending:
+            a, b = pending.pop()
+            if a is b:
+                continue
+            if not isinstance(b, dict) or len(a) != len(b):
+                return False
+            if isinstance(b, SyntaxTree) and hash(a) != hash(b):
+                return False
+            for key, value in a.items():
+                if key not in b:
+                    return False
+                if isinstance(value, SyntaxTree):
+                    pending.append((value, b[key]))
+                elif isinstance(b[key], SyntaxTree):
+                    pending.append((b[key], value))
+                elif value != b[key]:
+                    return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def _changed(self):
+        """Drop the cached hash and tokens of self and of every ancestor including them, or refuse changes of
+        shared nodes. Ancestors only cache them once their descendants do, so the walk stops at the first one
+        without any."""
+        if self._interned:
+            raise TypeError('Interned SyntaxTree nodes are shared and immutable.')
+        node = self
+        while node is not None and (node._hash is not None or node._tokens is not None):
+            node._hash = None
+            node._tokens = None
+            node._text = None
+            node = node._parent() if node._parent is not None else None
+
+    def __setitem__(self, key, value):
+        self._changed()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._changed()
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        self._changed()
+        dict.update(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._changed()
+        return dict.setdefault(self, key, default)
+
+    def pop(self, *args):
+        self._changed()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._changed()
+        return dict.popitem(self)
+
+    def clear(self):
+        self._changed()
+        dict.clear(self)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __getstate__(self):
+        return {}  # Cached hashes and weak references aren't pickled.
+
     def matches(self, tree):
         """Return if self is equal or similar to a dict tree, which can be a pattern."""
         tree_matches = True
@@ -197,12 +511,144 @@ class SyntaxTree(dict):
                 break
         return tree_matches
 
+    def flatten(self):
+        """Return every node of the tree indexed by its path of DEPREL labels, in a single traversal."""
+        result = {}
+        pending = [((label, ), node) for label, node in self.items() if isinstance(node, dict)]
+        while pending:
+            path, node = pending.pop()
+            result[path] = node
+            for key, value in node.items():
+                if key not in SUBTREE_KEYS and isinstance(value, dict):
+                    pending.append((path + (key, ), value))
+        return result
+
+    def tokens(self):
+        """Return the (id, form) of every token of the subtree in token order, cached until it is modified.
+
+        Descendants are cached first, without recursion, so the tokens of a node merge the sorted runs of its
+        children and any subtree is then linearized without sorting again.
+        """
+        if self._tokens is None:
+            order, pending = [], [self]
+            while pending:  # Parents before their children, so they are cached in the reverse order.
+                node = pending.pop()
+                order.append(node)
+                pending.extend(value for key, value in node.items()
+                               if key not in SUBTREE_KEYS and isinstance(value, SyntaxTree) and value._tokens is None)
+            for node in reversed(order):
+                runs = [((int(node['id']), node['form']), )]
+                for key, value in node.items():
+                    if key in SUBTREE_KEYS:
+                        continue
+                    if isinstance(value, SyntaxTree):
+                        if not value._interned:
+                            value._parent = weakref.ref(node)
+                        runs.append(value._tokens)
+                    else:  # A plain dict node.
+                        runs.append(tuple(sorted(SyntaxTree._indexed_forms(value).items())))
+                node._tokens = runs[0] if len(runs) == 1 else tuple(sorted(chain.from_iterable(runs),
+                                                                           key=itemgetter(0)))
+        return self._tokens
+
     def to_string_replacing(self, replacement_subtree_reference, replacement_text):
         """Creates a text version of self replacing source branch."""
-        forms = {}
-        for tree in self.values():  # There should be only one root node
-            forms.update(SyntaxTree._indexed_forms(tree, replacement_subtree_reference, replacement_text))
-        return ' '.join(str(forms[key]) for key in sorted(forms))
+        runs = [SyntaxTree._tokens_replacing(tree, replacement_subtree_reference, replacement_text)
+                if isinstance(tree, SyntaxTree) else tuple(sorted(SyntaxTree._indexed_forms(
+                    tree, replacement_subtree_reference, replacement_text).items()))
+                for tree in self.values()]  # There should be only one root node
+        tokens = runs[0] if len(runs) == 1 else sorted(chain.from_iterable(runs), key=itemgetter(0))
+        return ' '.join(str(form) for _, form in tokens)
+
+    @staticmethod
+    def _tokens_replacing(tree, replacement_subtree_reference, replacement_text):
+        """Return the cached tokens of a node with the branch equal to the reference spliced by the text.
+
+        The branch text takes the place of the branch node, and its descendants are removed. Their tokens are
+        usually a contiguous run of the node ones, which is spliced, or filtered out otherwise. Ids are unique,
+        so only the node with the id of the reference is compared, and there is a single branch at most.
+        """
+        tokens = tree.tokens()
+        reference_id = replacement_subtree_reference.get('id') if isinstance(replacement_subtree_reference, dict) \
+            else None
+        pending = [tree]
+        while pending:
+            node = pending.pop()
+            if node.get('id') == reference_id and node == replacement_subtree_reference:
+                break
+            for key, value in node.items():
+                if key not in SUBTREE_KEYS:
+                    pending.append(value)
+        else:
+            return tokens
+        branch = node.tokens() if isinstance(node, SyntaxTree) else \
+            tuple(sorted(SyntaxTree._indexed_forms(node).items()))
+        index = int(node['id'])
+        start = bisect_left(tokens, (branch[0][0], ))  # Ids are unique, so forms are never compared.
+        if tokens[start:start + len(branch)] == branch:
+            return tokens[:start] + ((index, replacement_text), ) + tokens[start + len(branch):]
+        removed = {i for i, _ in branch}
+        return tuple((i, replacement_text) if i == index else (i, form)
+                     for i, form in tokens if i not in removed or i == index)
+
+    def grafting(self, replacement_subtree_reference, replacement_tree):
+        """Return a new tree with the branch equal to the reference replaced by the root of another tree, or None.
+
+        The replacement root hangs from the head of the branch under its label, and its tokens take the place
+        of the branch node ones, so ids are renumbered as parsing to_string_replacing text would do. None means
+        a full parsing is needed: the replacement isn't a single rooted tree or its root part of speech differs
+        from the branch one, which would change its attachment to the head.
+        """
+        if len(self) != 1 or len(replacement_tree) != 1 or not all(
+                isinstance(tree, SyntaxTree) for tree in chain(self.values(), replacement_tree.values())):
+            return None
+        graft = next(iter(replacement_tree.values()))
+        reference_id = replacement_subtree_reference.get('id') if isinstance(replacement_subtree_reference, dict) \
+            else None
+        pending = list(self.values())
+        while pending:
+            branch = pending.pop()
+            if branch.get('id') == reference_id and branch == replacement_subtree_reference:
+                break
+            pending.extend(value for key, value in branch.items() if key not in SUBTREE_KEYS)
+        else:
+            return None
+        if branch is next(iter(self.values())):  # The whole text is replaced.
+            return replacement_tree
+        if graft.get('upostag') != branch.get('upostag'):  # A new part of speech would be attached elsewhere.
+            return None
+        try:
+            tokens = next(iter(self.values())).tokens()
+            removed = {i for i, _ in branch.tokens()}
+            ids, graft_ids, new_id = {}, {}, tokens[0][0]
+            for i, _ in tokens:
+                if i == int(branch['id']):
+                    for j, _ in graft.tokens():
+                        graft_ids[j] = new_id
+                        new_id += 1
+                elif i not in removed:
+                    ids[i] = new_id
+                    new_id += 1
+        except (KeyError, ValueError, TypeError, AttributeError):  # Nodes without numeric ids, or plain dicts.
+            return None
+        id_type = type(branch['id'])
+        label, root = next(iter(self.items()))
+        new_root = SyntaxTree()
+        pending = [(root, new_root, ids)]
+        while pending:  # Copied without recursion, renumbering the ids of every node.
+            source, target, source_ids = pending.pop()
+            for key, value in source.items():
+                if key == 'id':
+                    value = id_type(source_ids[int(value)])
+                elif key not in SUBTREE_KEYS and isinstance(value, dict):
+                    new_node = SyntaxTree()
+                    pending.append((graft, new_node, graft_ids) if value is branch else (value, new_node, source_ids))
+                    value = new_node
+                elif isinstance(value, dict):  # 'feats' are plain dicts.
+                    value = dict(value)
+                dict.__setitem__(target, key, value)
+        new = SyntaxTree({label: new_root})
+        return SyntaxTree._intern_nodes(new) if SyntaxTree.interning else new
 
     @staticmethod
     def _indexed_forms(tree_values, replacement_subtree_reference=None, replacement_text=''):
@@ -220,8 +666,9 @@ class SyntaxTree(dict):
 
     def __format__(self, format_spec=None):
         """Format a SyntaxTree object for string.format() focusing on ordered 'FORM' fields."""
-        forms = SyntaxTree._indexed_forms(self)
-        return ' '.join(str(forms[key]) for key in sorted(forms))
+        if self._text is None:
+            self._text = ' '.join(str(form) for _, form in self.tokens())
+        return self._text
 
     class SyntaxError(Exception):
         """Exception raised for errors in the parsing.
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+import asgi
+import concha
+from domain_snapshot import MappedDomain, write_snapshot
+from shared_domain import SharedDomain
+from syntax_tree import SyntaxTree
+from trick import TrickDomain
+
+TRICK = {
+    "given": {"root": {"form": "repite", "obj": {"form": "*algo"}}},
+    "then": {"200": "{d[root][obj]}"}
+}
+WRONG_TRICK = {
+    "given": {"root": {"form": "repite", "obj": {"form": "*algo"}}},
+    "then": {"200": "{d[root][wrong]}"}
+}
+
+
+def call(method, path, data=None):
+    """Run a single HTTP request through the ASGI application returning its status and JSON body."""
+    status, _, body = call_raw(method, path, data)
+    return status, json.loads(body.decode('utf-8'))
+
+
+def call_raw(method, path, data=None):
+    """Run a single HTTP request through the ASGI application returning its status, headers and body."""
+    messages = []
+    body = json.dumps(data).encode('utf-8') if data is not None else b''
+    path, _, query_string = path.partition('?')
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode()}
+    asyncio.run(asgi.app(scope, receive, send))
+    return messages[0]['status'], dict(messages[0]['headers']), b''.join(x['body'] for x in messages[1:])
+
+
+def fake_connl(text):
+    """Chain every word as the object of the previous one, being the first one the root."""
+    return '\n'.join(
+        '\t'.join([str(i + 1), word, '_', 'x', '_', 'fPOS=x++', str(i), 'obj', '_', '_'])
+        for i, word in enumerate(text.split()))
+
+
+async def monkey_patching_new_from_text_async(text):
+    return SyntaxTree().parse_connl(fake_connl(text))
+
+
+class AsgiTestCase(unittest.TestCase):
+    def setUp(self):
+        global new_from_text_async_tmp
+        new_from_text_async_tmp = SyntaxTree.new_from_text_async
+        SyntaxTree.new_from_text_async = staticmethod(monkey_patching_new_from_text_async)
+
+    def tearDown(self):
+        SyntaxTree.new_from_text_async = staticmethod(new_from_text_async_tmp)
+        concha.reset()
+
+    def test_create_and_read_trick(self):
+        status, body = call('POST', '/v1/tricks', TRICK)
+        self.assertTrue(status == 201 and body['id'] == 0)
+        status, body = call('GET', '/v1/tricks/0')
+        self.assertTrue(status == 200 and body['given']['root']['form'] == 'repite')
+
+    def test_create_trick_2ndp_bad_request(self):
+        self.assertTrue(call('POST', '/v1/tricks')[0] == 400)
+        status, body = call('POST', '/v1/tricks', WRONG_TRICK)
+        self.assertTrue(status == 400 and body['error']['status'] == 'SYNTAX_ERROR')
+
+    def test_delete_trick_2ndp_not_found(self):
+        call('POST', '/v1/tricks', TRICK)
+        self.assertTrue(call('DELETE', '/v1/tricks/1')[0] == 404)
+        self.assertTrue(call('DELETE', '/v1/tricks/0')[0] == 200)
+        self.assertTrue(call('GET', '/v1/tricks') == (200, []))
+
+    def test_shared_trick_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            concha.share(SharedDomain(directory))
+            self.assertTrue(isinstance(concha.tricks, MappedDomain))
+            self.assertTrue(call('POST', '/v1/tricks', TRICK) == (201, {"id": 0, "message": "trick 0 created Ok"}))
+            self.assertTrue(call('PUT', '/v1/tricks/0', dict(TRICK, then={"200": "eco"}))[0] == 200)
+            self.assertTrue(call('GET', '/v1/tricks/0')[1]['then'] == {"200": "eco"})
+            self.assertTrue(call('POST', '/v1/tricks', TRICK)[0] == 201 and call('DELETE', '/v1/tricks/0')[0] == 200)
+            other_worker = SharedDomain(directory)
+            with other_worker.lock():
+                _, tricks, _ = other_worker.load()
+            self.assertTrue(list(tricks.items()) == [(1, TRICK)])
+            other_worker.close()
+            concha.shared.close()
+
+    def test_mapped_trick_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tricks.cnd')
+            write_snapshot(path, TrickDomain([TRICK]))
+            concha.map_tricks(path)
+            self.assertTrue(call('POST', '/v1/tricks', TRICK)[0] == 201)
+            self.assertTrue(call('PUT', '/v1/tricks/0', dict(TRICK, then={"200": "eco"}))[0] == 200)
+            self.assertTrue(isinstance(concha.tricks, TrickDomain) and concha.tricks[0]['then'] == {"200": "eco"})
+            self.assertTrue(list(concha.tricks) == [0, 1])
+
+    def test_post_document(self):
+        call('POST', '/v1/tricks', TRICK)
+        status, body = call('POST', '/v1/documents', {'text': 'repite hola'})
+        self.assertTrue(status == 201 and body['answer_text'] == 'hola' and body['tricks'] == [0])
+        status, body = call('GET', '/v1/documents')
+        self.assertTrue(status == 200 and body[0]['text'] == 'repite hola')
+
+    def test_post_document_traced(self):
+        call('POST', '/v1/tricks', TRICK)
+        status, body = call('POST', '/v1/documents?trace=true', {'text': 'repite hola'})
+        events = body['trace']['traceEvents']
+        names = {event['name'] for event in events}  # Parsings are patched out.
+        self.assertTrue(status == 201 and {'document', 'linker', 'match_tricks', 'compiler'} <= names)
+        compiler = [event for event in events if event['name'] == 'compiler'][0]
+        self.assertTrue(compiler['args']['trick'] == 0 and compiler['args']['status'] == '200')
+        self.assertTrue('trace' not in call('POST', '/v1/documents', {'text': 'repite hola'})[1])
+
+    def test_list_documents_pages(self):
+        for text in ('uno', 'dos', 'tres'):
+            concha.record_document(text)
+        status, headers, body = call_raw('GET', '/v1/documents?pageSize=2&fields=id,text')
+        self.assertTrue(status == 200 and json.loads(body) == [{'id': 0, 'text': 'uno'}, {'id': 1, 'text': 'dos'}])
+        token = headers[b'x-next-page-token'].decode()
+        status, headers, body = call_raw('GET', '/v1/documents?format=jsonl&fields=text&pageToken=' + token)
+        self.assertTrue(body == b'{"text": "tres"}\n' and b'x-next-page-token' not in headers)
+        self.assertTrue(call('GET', '/v1/documents?endDate=2000-01-01') == (200, []))
+        self.assertTrue(call('GET', '/v1/documents?pageSize=0')[0] == 400)
+
+    def test_unknown_resource(self):
+        self.assertTrue(call('GET', '/v1/unknown')[0] == 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import unittest
+from compact_tree import CompactTree
+from syntax_tree import SyntaxTree
+
+a_tree_txt = '\
+1	mi	_	det	_	Number=Sing|Person=1|Poss=Yes|PronType=Prs|fPOS=det++	2	det	_	_\n\
+2	mamá	_	noun	_	Gender=Fem|Number=Sing|fPOS=noun++	4	nsubj	_	_\n\
+3	me	_	pron	_	Case=Acc,Dat|Number=Sing|Person=1|PrepCase=Npr|PronType=Prs|Reflex=Yes|fPOS=pron++	4	iobj	_	_\n\
+4	mima	_	verb	_	Mood=Ind|Number=Sing|Person=1|Tense=Past|VerbForm=Fin|fPOS=verb++	0	root	_	_\n\
+\n\
+'
+
+
+class CompactTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = SyntaxTree().parse_connl(a_tree_txt)
+        self.compact = CompactTree.new_from_tree(self.tree)
+
+    def test_round_trip(self):
+        self.assertTrue(self.compact.to_tree() == self.tree)
+        self.assertTrue(dict(self.compact['root']['nsubj']['det']) == self.tree['root']['nsubj']['det'])
+
+    def test_shared_strings_and_feats(self):
+        other = CompactTree.new_from_tree(self.tree.deepcopy())
+        self.assertTrue(other.forms[0] is self.compact.forms[0])
+        self.assertTrue(other.feats[1] is self.compact.feats[1])
+
+    def test_match(self):
+        self.assertTrue(self.compact.matches({'root': {'form': 'mima', 'iobj': {'form': 'me'}}}))
+        self.assertTrue(self.compact.matches({'root': {'form': '~mima', 'nsubj': {'det': {'form': '*cosa'}}}}))
+        self.assertFalse(self.compact.matches({'root': {'form': 'mima', 'dobj': {'form': '*cosa'}}}))
+        self.assertFalse(self.compact.matches({'root': {'form': 'mima', 'iobj': {'form': 'te'}}}))
+
+    def test_format_and_replace(self):
+        self.assertTrue('{root[nsubj]} es muy mimosa'.format_map(self.compact) == 'mi mamá es muy mimosa')
+        pointed = SyntaxTree.point_to_content({'d': self.compact}, 'd[root][nsubj]')
+        self.assertTrue(self.compact.to_string_replacing(pointed, 'ella') == 'ella me mima')
+        with self.assertRaises(KeyError):
+            '{root[wrong]}'.format_map(self.compact)
+
+
+if __name__ == '__main__':
+    unittest.main()
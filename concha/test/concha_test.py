@@ -16,8 +16,12 @@
 __author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
 __version__ = '1.0'
 
+import json
 import unittest
 import concha
+import trick
+from parser_backend import WorkerPool, stub_command
+from syntax_tree import SyntaxTree
 
 GIVEN_OK = """
 "given": {
@@ -188,6 +192,60 @@ class TricksResourceTestCase(unittest.TestCase):
 
         self.assertTrue(rv.status_code == 404)
 
+    def test_batch_create_and_export(self):
+        tricks = [json.loads("{{{}, {}}}".format(*parts)) for parts in [(GIVEN_OK, THEN_OK), (GIVEN_OK2, THEN_OK2)]]
+        lines = '{}\n\n{}\n'.format(*[json.dumps(x) for x in tricks])
+        rv = self.app.post('/v1/tricks:batchCreate', data=lines, mimetype='application/x-ndjson')
+
+        self.assertTrue(rv.status_code == 201)
+        self.assertTrue(json.loads(rv.data)['ids'] == [0, 1])
+        rv = self.app.get('/v1/tricks:export')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue([json.loads(x) for x in rv.data.splitlines()] == tricks)
+
+    def test_export_error_tricks(self):
+        error_trick = json.loads("{{{}, {}}}".format(GIVEN_OK, THEN_OK))
+        error_trick['when'] = {"method": "ERROR", "uri": ""}
+        tricks = [json.loads("{{{}, {}}}".format(GIVEN_OK2, THEN_OK2)), error_trick]
+        self.app.post('/v1/tricks:batchCreate', data='\n'.join(json.dumps(x) for x in tricks),
+                      mimetype='application/x-ndjson')
+        try:
+            rv = self.app.get('/v1/tricks:export')
+            self.assertTrue([json.loads(x) for x in rv.data.splitlines()] == tricks)
+            concha.reset()
+            trick.error_domain.clear()
+            rv = self.app.post('/v1/tricks:batchCreate', data=rv.data, mimetype='application/x-ndjson')
+            self.assertTrue(rv.status_code == 201)
+            self.assertTrue(list(concha.tricks.values()) == tricks[:1])
+            self.assertTrue(list(trick.error_domain.values()) == tricks[1:])
+        finally:
+            trick.error_domain.clear()
+
+    def test_read_tricks_pages(self):
+        create_trick(self.app, "{{{}, {}}}".format(GIVEN_OK, THEN_OK))
+        create_trick(self.app, "{{{}, {}}}".format(GIVEN_OK2, THEN_OK2))
+        self.app.delete('/v1/tricks/0')
+        create_trick(self.app, "{{{}, {}}}".format(GIVEN_OK, THEN_OK))
+
+        rv = self.app.get('/v1/tricks?pageSize=1&fields=id')
+
+        self.assertTrue(json.loads(rv.data) == [{'id': 1}])
+        rv = self.app.get('/v1/tricks?fields=id&pageToken=' + rv.headers['X-Next-Page-Token'])
+        self.assertTrue(json.loads(rv.data) == [{'id': 2}] and 'X-Next-Page-Token' not in rv.headers)
+        rv = self.app.get('/v1/tricks')
+        listed = json.loads(rv.data)
+        self.assertTrue([trick['id'] for trick in listed] == [1, 2])
+        self.assertTrue(listed[1] == dict(json.loads("{{{}, {}}}".format(GIVEN_OK, THEN_OK)), id=2))
+
+    def test_batch_create_2ndp_atomic(self):
+        lines = '{}\n{{"given": \n{}\n'.format(json.dumps({"given": {}, "then": {}}), json.dumps({"then": {}}))
+
+        rv = self.app.post('/v1/tricks:batchCreate', data=lines, mimetype='application/x-ndjson')
+
+        self.assertTrue(rv.status_code == 400)
+        self.assertTrue([x['line'] for x in json.loads(rv.data)['error']['details']] == [2, 3])
+        self.assertTrue(b'[]' in self.app.get('/v1/tricks').data)
+
 
 #   Monkey |  ´..`3 | Patches some internal calls out of testing paths.
 # Patching | (-  )\ | No monkey was harmed in the process. """
@@ -202,7 +260,7 @@ def undo_monkey_patching():
     concha.process_document = process_document_tmp
 
 
-def monkey_patching_process_document(_, __):
+def monkey_patching_process_document(_, __, trace=False):
     return {
         "root": {
             "form": "repite",
@@ -251,6 +309,33 @@ class DocumentsResourceTestCase(unittest.TestCase):
 
         self.assertTrue(rv.status_code == 400)
 
+    def test_batch_analyze_syntax(self):
+        SyntaxTree.backend = WorkerPool(stub_command(), size=1)
+        try:
+            requests = [{"document": {"type": "PLAIN_TEXT", "content": text}} for text in ('repite hola', 'uno')]
+            rv = self.app.post('/v1/documents:batchAnalyzeSyntax', data=json.dumps({"requests": requests}),
+                               mimetype='application/json')
+            self.assertTrue(rv.status_code == 200)
+            responses = json.loads(rv.data)['responses']
+            self.assertTrue([response['root']['form'] for response in responses] == ['repite', 'uno'])
+            rv = self.app.post('/v1/documents:batchAnalyzeSyntax', data='{"texts": ["uno"]}',
+                               mimetype='application/json')
+            self.assertTrue(rv.status_code == 400)
+        finally:
+            SyntaxTree.backend.close()
+            SyntaxTree.backend = None
+
+    def test_metrics(self):
+        create_trick(self.app, "{{{}, {}}}".format(GIVEN_OK, THEN_OK))
+        post_document(self.app, '{"text": "uno"}')
+
+        rv = self.app.get('/metrics')
+
+        self.assertTrue(rv.status_code == 200 and rv.content_type.startswith('text/plain'))
+        self.assertTrue(b'concha_requests_total{route="/v1/documents",method="POST",code="201"}' in rv.data)
+        self.assertTrue(b'concha_request_seconds_bucket{route="/v1/tricks",le="+Inf"}' in rv.data)
+        self.assertTrue(b'concha_documents_in_flight' in rv.data)
+
     def test_get_documents(self):
         create_trick(self.app, "{{{}, {}}}".format(GIVEN_OK, THEN_OK))
         post_document(self.app, '{"text": "uno"}')
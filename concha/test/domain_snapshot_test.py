@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import json
+import tempfile
+import unittest
+import concha
+import kernel
+import trick
+from domain_snapshot import MappedDomain, write_snapshot, read_tricks
+from syntax_tree import SyntaxTree
+from trick import TrickDomain, match_tricks
+
+repeat_trick = {"given": {"root": {"form": "repite", "obj": {"form": "*algo"}}}, "then": {"200": "{d[root][obj]}"}}
+greet_trick = {"given": {"root": {"form": "hola"}}, "then": {"200": "adiós"}}
+any_trick = {"given": {"root": {"form": "*algo", "obj": {"form": "casa"}}}, "then": {"200": "{d[root][form]}"}}
+similar_trick = {"given": {"root": {"form": "~hola"}}, "then": {"200": "parecido"}}
+nsubj_trick = {"given": {"nsubj": {"form": "mamá"}}, "then": {"200": "mamá"}}
+error_trick = {"given": {"root": {"form": "*algo"}}, "when": {"method": "ERROR", "uri": ""},
+               "then": {"200": "no"}}
+
+trees = [
+    SyntaxTree.new_from_dict({'root': {'form': 'repite', 'obj': {'form': 'casa'}}}),
+    SyntaxTree.new_from_dict({'root': {'form': 'hola'}}),
+    SyntaxTree.new_from_dict({'root': {'form': 'come', 'obj': {'form': 'casa'}}, 'nsubj': {'form': 'mamá'}}),
+    SyntaxTree.new_from_dict({'root': {'form': 'nada'}})
+]
+
+
+class DomainSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tricks.cnd')
+        self.domain = TrickDomain([repeat_trick, greet_trick, any_trick, similar_trick, nsubj_trick])
+        del self.domain[1]
+
+    def tearDown(self):
+        concha.reset()
+        trick.error_domain.clear()
+        self.directory.cleanup()
+
+    def test_mapped_domain(self):
+        write_snapshot(self.path, self.domain, TrickDomain([error_trick]))
+        mapped = MappedDomain(self.path)
+        self.assertTrue(mapped == self.domain and list(mapped) == [0, 2, 3, 4] and mapped.next_id == 5)
+        self.assertTrue(1 not in mapped and 'x' not in mapped and mapped.error_tricks == {0: error_trick})
+        for tree in trees:
+            self.assertTrue(mapped.candidates(tree) == self.domain.candidates(tree))
+            self.assertTrue(match_tricks(tree, mapped) == match_tricks(tree, self.domain))
+        thawed = mapped.thaw()
+        thawed.append(greet_trick)
+        self.assertTrue(isinstance(thawed, TrickDomain) and list(thawed) == [0, 2, 3, 4, 5])
+        mapped.close()
+        with open(self.path, 'wb') as wrong:
+            wrong.write(b'{}' * 100)
+        self.assertRaises(ValueError, MappedDomain, self.path)
+
+    def test_cross_request_key(self):
+        write_snapshot(self.path, self.domain)
+        mapped, other = MappedDomain(self.path), MappedDomain(self.path)
+        self.assertTrue(kernel._cross_request_key(mapped, ('compile', 'tree', 0)) == (mapped.uid, 'trick', 0,
+                                                                                     'compile', 'tree', 0))
+        self.assertTrue(mapped.uid != other.uid and kernel._cross_request_key(mapped, ('compile', 'tree', 1)) is None)
+        mapped.close()
+        other.close()
+
+    def test_read_tricks(self):
+        source = os.path.join(self.directory.name, 'tricks.jsonl')
+        with open(source, 'w', encoding='utf-8') as tricks_file:
+            for trick_ in [repeat_trick, error_trick, greet_trick]:
+                tricks_file.write(json.dumps(trick_) + '\n\n')
+        tricks, error_tricks = read_tricks(source)
+        self.assertTrue(tricks == {0: repeat_trick, 1: greet_trick} and error_tricks == {0: error_trick})
+        with open(source, 'a', encoding='utf-8') as tricks_file:
+            tricks_file.write(json.dumps({"given": {"root": {"form": "hola"}}, "then": {"200": "{d[x]}"}}) + '\n')
+        self.assertRaises(ValueError, read_tricks, source)
+
+    def test_served(self):
+        write_snapshot(self.path, self.domain, TrickDomain([error_trick]))
+        self.assertTrue(concha.map_tricks(self.path) == 4)
+        self.assertTrue(isinstance(concha.tricks, MappedDomain) and trick.error_domain == {0: error_trick})
+        client = concha.app.test_client()
+        self.assertTrue(json.loads(client.get('/v1/tricks/2').data) == any_trick)
+        response = client.post('/v1/tricks', data=json.dumps(greet_trick), content_type='application/json')
+        self.assertTrue(json.loads(response.data)['id'] == 5)
+        self.assertTrue(isinstance(concha.tricks, TrickDomain) and len(concha.tricks) == 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
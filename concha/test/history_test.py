@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import datetime
+import json
+import tempfile
+import unittest
+from history import DocumentHistory
+
+
+def record(day, text='hola'):
+    return {'date': '2018-01-{:02d} 00:00:00'.format(day), 'text': text}
+
+
+class DocumentHistoryTest(unittest.TestCase):
+
+    def test_max_count(self):
+        history = DocumentHistory(max_count=3)
+        ids = [history.append(record(day)) for day in range(1, 6)]
+        self.assertTrue(ids == [0, 1, 2, 3, 4] and len(history) == 5)
+        self.assertTrue([id_ for id_, _ in history.numbered()] == [2, 3, 4])
+        self.assertTrue(history[4]['date'] == record(5)['date'] and history.stats()['dropped_documents'] == 2)
+        with self.assertRaises(KeyError):
+            history[1]
+
+    def test_max_bytes(self):
+        history = DocumentHistory(max_bytes=200)
+        for day in range(1, 11):
+            history.append(record(day, 'x' * 50))
+        self.assertTrue(history.stats()['memory_bytes'] <= 200 and history.stats()['memory_documents'] == 2)
+
+    def test_max_age(self):
+        history = DocumentHistory(max_age=60)
+        history.append(record(1))
+        now = str(datetime.datetime.now()).split('.')[0]
+        history.append({'date': now, 'text': 'hola'})
+        self.assertTrue([id_ for id_, _ in history.numbered()] == [1])
+
+    def test_max_age_reads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = DocumentHistory(max_age=600, max_count=2, directory=directory, segment_size=1)
+            for seconds in (300, 200, 100, 0):
+                date = str(datetime.datetime.now() - datetime.timedelta(seconds=seconds)).split('.')[0]
+                history.append({'date': date, 'text': str(seconds)})
+            history.max_age = 150  # Time goes by with no more documents.
+            self.assertTrue([x['text'] for _, x in history.numbered()] == ['100', '0'])
+            self.assertTrue(history.first_id_since('2018-01-01') == 2 and history[2]['text'] == '100')
+            with self.assertRaises(KeyError):
+                history[1]
+
+    def test_max_bytes_utf8(self):
+        history = DocumentHistory()
+        history.append(record(1, 'ñ' * 50))
+        size = len(json.dumps(record(1, 'ñ' * 50), ensure_ascii=False))
+        self.assertTrue(history.stats()['memory_bytes'] == size + 50)  # 'ñ' takes 2 bytes.
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = DocumentHistory(max_count=4, directory=directory, segment_size=3)
+            for day in range(1, 11):
+                history.append(record(day, str(day)))
+            stats = history.stats()
+            self.assertTrue(stats['spilled_documents'] + stats['memory_documents'] == 10 and stats['segments'] >= 2)
+            self.assertTrue([x['text'] for _, x in history.numbered(1)] == [str(day) for day in range(2, 11)])
+            self.assertTrue(history[0]['text'] == '1' and history.first_id_since('2018-01-05') == 4)
+            self.assertTrue(history.first_id_since('2018-01-10 00:00:01') == 10)
+            reopened = DocumentHistory(max_count=4, directory=directory, segment_size=3)
+            first_id, recent = history.recent()
+            reopened.extend(recent, first_id)
+            self.assertTrue(len(reopened) == 10 and [id_ for id_, _ in reopened.numbered()] == list(range(10)))
+
+    def test_extend_skips_spilled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = DocumentHistory(max_count=1, directory=directory, segment_size=2)
+            for day in range(1, 5):
+                history.append(record(day))
+            reopened = DocumentHistory(max_count=1, directory=directory, segment_size=2)
+            reopened.extend([record(day) for day in range(1, 5)], 0)  # i.e. an older snapshot.
+            self.assertTrue(len(reopened) == 4 and len(list(reopened.numbered())) == 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import time
+import asyncio
+import unittest
+import kernel
+import metrics
+from syntax_tree import SyntaxTree
+from trick import TrickDomain
+
+repeat_trick = {
+    "given": {
+        "root": {
+            "form": "repite",
+            "obj": {
+                "form": "*algo"
+            }
+        }
+    },
+    "then": {
+        "200": "{d[root][obj]}"
+    }
+}
+
+echo_trick = {
+    "given": {
+        "root": {
+            "form": "repite",
+            "obj": {
+                "form": "*algo"
+            }
+        }
+    },
+    "then": {
+        "200": "eco {d[root][obj]}"
+    }
+}
+
+greet_trick = {
+    "given": {
+        "root": {
+            "form": "hola"
+        }
+    },
+    "then": {
+        "200": "adiós"
+    }
+}
+
+slow_trick = {
+    "given": {
+        "root": {
+            "form": "repite"
+        }
+    },
+    "then": {
+        "200": "lento"
+    }
+}
+
+treat_trick = {
+    "given": {
+        "root": {
+            "form": "repite"
+        }
+    },
+    "when": {
+        "method": "TREAT",
+        "uri": "{d[root][obj]}"
+    },
+    "then": {
+        "200": "{r[root]}"
+    }
+}
+
+error_trick = {
+    "given": {
+        "root": {
+            "form": "*algo"
+        }
+    },
+    "when": {
+        "method": "ERROR",
+        "uri": ""
+    },
+    "then": {
+        "501": "uy"
+    }
+}
+
+
+def fake_connl(text):
+    """Chain every word as the object of the previous one, being the first one the root."""
+    lines = []
+    for i, word in enumerate(text.split()):
+        lines.append('\t'.join([str(i + 1), word, '_', 'x', '_', 'fPOS=x++', str(i), 'obj', '_', '_']))
+    return '\n'.join(lines)
+
+
+#   Monkey |  ´..`3 | Patches the parsing service out of testing paths.
+# Patching | (-  )\ | No monkey was harmed in the process. """
+def do_monkey_patching(parsed_texts, batches):
+    global new_from_text_tmp, new_many_from_texts_tmp, new_from_text_async_tmp
+    new_from_text_tmp = SyntaxTree.new_from_text
+    new_many_from_texts_tmp = SyntaxTree.new_many_from_texts
+    new_from_text_async_tmp = SyntaxTree.new_from_text_async
+
+    def monkey_patching_new_from_text(text):
+        parsed_texts.append(text)
+        if text == 'lento':
+            time.sleep(0.5)
+        return SyntaxTree().parse_connl(fake_connl(text))
+
+    def monkey_patching_new_many_from_texts(texts):
+        batches.append(texts)
+        return [SyntaxTree().parse_connl(fake_connl(text)) for text in texts]
+
+    async def monkey_patching_new_from_text_async(text):
+        parsed_texts.append(text)
+        if text == 'lento':
+            await asyncio.sleep(0.5)
+        return SyntaxTree().parse_connl(fake_connl(text))
+
+    SyntaxTree.new_from_text = staticmethod(monkey_patching_new_from_text)
+    SyntaxTree.new_many_from_texts = staticmethod(monkey_patching_new_many_from_texts)
+    SyntaxTree.new_from_text_async = staticmethod(monkey_patching_new_from_text_async)
+
+
+def undo_monkey_patching():
+    SyntaxTree.new_from_text = staticmethod(new_from_text_tmp)
+    SyntaxTree.new_many_from_texts = staticmethod(new_many_from_texts_tmp)
+    SyntaxTree.new_from_text_async = staticmethod(new_from_text_async_tmp)
+
+
+class KernelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parsed_texts = []
+        self.batches = []
+        self.tricks = [repeat_trick, echo_trick, greet_trick]
+        do_monkey_patching(self.parsed_texts, self.batches)
+
+    def tearDown(self):
+        undo_monkey_patching()
+        kernel.batch_parsing = False
+        kernel.max_in_flight = 1
+        kernel.document_deadline = None
+        kernel.memoize = True
+        kernel.cross_request_memo = False
+        kernel.incremental_treat = False
+
+    def test_compiler(self):
+        artifact = kernel.compiler(SyntaxTree.new_from_text('repite hola'), 0, self.tricks)
+        self.assertTrue(artifact.status == '200' and artifact.used_tricks == [0])
+        self.assertTrue('{root}'.format_map(artifact.tree) == 'hola')
+
+    def test_compiler_2ndp_not_implemented(self):
+        artifact = kernel.compiler(SyntaxTree.new_from_text('repite hola'), 0, [{"given": {}, "then": {}}])
+        self.assertTrue(artifact.status == '501' and artifact.tree is None)
+
+    def test_linker(self):
+        artifact = kernel.linker(SyntaxTree.new_from_text('repite hola'), self.tricks)
+        self.assertTrue(artifact.status == '200')
+        self.assertTrue(self.parsed_texts == ['repite hola', 'hola', 'eco hola', 'adiós'])
+
+    def test_linker_batch_parsing(self):
+        kernel.batch_parsing = True
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), self.tricks)
+        self.assertTrue(self.batches == [['hola', 'eco hola']])
+        self.assertTrue(self.parsed_texts == ['repite hola', 'adiós'])
+
+    def test_linker_concurrent(self):
+        kernel.max_in_flight = 4
+        artifact = kernel.linker(SyntaxTree.new_from_text('repite hola'), self.tricks)
+        self.assertTrue(artifact.status == '200')
+        self.assertTrue(sorted(self.parsed_texts) == sorted(['repite hola', 'hola', 'eco hola', 'adiós']))
+
+    def test_linker_concurrent_order(self):
+        kernel.max_in_flight = 4
+        kernel.memoize = False
+        kernel._local.job = kernel.Job()
+        try:
+            rendered = kernel._render_round(SyntaxTree.new_from_text('repite hola'), [1, 0, 1], self.tricks)
+        finally:
+            kernel._local.job = None
+        self.assertTrue(['{root}'.format_map(x.tree) for x in rendered] == ['eco hola', 'hola', 'eco hola'])
+
+    def test_linker_memo(self):
+        tricks = [treat_trick, dict(treat_trick, then={"200": "dice {r[root]}"}), greet_trick]
+        hits = kernel.memo_stats['linked_hits']
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+        self.assertTrue(kernel.memo_stats['linked_hits'] > hits)
+        memoized = len(self.parsed_texts)
+        kernel.memoize = False
+        del self.parsed_texts[:]
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+        self.assertTrue(len(self.parsed_texts) > memoized)
+
+    def test_linker_cross_request_memo(self):
+        kernel.cross_request_memo = True
+        tricks = TrickDomain(self.tricks)
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+        hits = kernel.memo_stats['cross_request_hits']
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+        self.assertTrue(kernel.memo_stats['cross_request_hits'] == hits + 3)
+        tricks.append(greet_trick)  # Other tricks compilations are kept.
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+        self.assertTrue(kernel.memo_stats['cross_request_hits'] == hits + 6)
+        tricks[0] = echo_trick
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+        self.assertTrue(kernel.memo_stats['cross_request_hits'] == hits + 7)
+
+    def test_linker_cross_request_memo_error_tricks(self):
+        kernel.cross_request_memo = True
+        tricks = TrickDomain([treat_trick])
+        self.assertTrue(kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks).used_tricks == [0])
+        kernel.error_domain.append(error_trick)  # TREAT links fall back to it from now on.
+        try:
+            artifact = kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+            kernel.cross_request_memo = False
+            self.assertTrue(artifact == kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks))
+            self.assertTrue(len(artifact.used_tricks) == 2)  # The error trick ids aren't given again.
+        finally:
+            kernel.error_domain.clear()
+
+    def test_linker_incremental_treat(self):
+        tricks = [treat_trick, dict(treat_trick, then={"200": "dice {r[root]}"}), greet_trick]
+        kernel.memoize = False
+        reparsed = [kernel.compiler(SyntaxTree.new_from_text('repite hola'), i, tricks) for i in (0, 1)]
+        self.assertTrue('repite adiós' in self.parsed_texts and 'repite dice adiós' in self.parsed_texts)
+        kernel.incremental_treat = True
+        stats = dict(kernel.treat_stats)
+        del self.parsed_texts[:]
+        grafted = [kernel.compiler(SyntaxTree.new_from_text('repite hola'), i, tricks) for i in (0, 1)]
+        self.assertTrue([(x.tree, x.status) for x in grafted] == [(x.tree, x.status) for x in reparsed])
+        self.assertTrue('repite adiós' not in self.parsed_texts)
+        self.assertTrue('dice adiós' in self.parsed_texts and 'repite dice adiós' not in self.parsed_texts)
+        self.assertTrue(kernel.treat_stats['reused'] == stats['reused'] + 1)
+        self.assertTrue(kernel.treat_stats['grafted'] == stats['grafted'] + 1)
+        saved, parsed = metrics.treat_parser_calls_saved.totals(), metrics.treat_grafts_parsed.totals()
+        kernel.linker(SyntaxTree.new_from_text('repite hola'), tricks)
+        self.assertTrue(metrics.treat_parser_calls_saved.totals()[()][-1] == saved.get((), [0])[-1] + 1)
+        self.assertTrue(metrics.treat_grafts_parsed.totals()[()][-1] == parsed.get((), [0])[-1] + 1)
+
+    def test_linker_deadline(self):
+        kernel.max_in_flight = 2
+        kernel.document_deadline = 0.05
+        artifact = kernel.linker(SyntaxTree.new_from_text('repite hola'), [slow_trick, slow_trick])
+        self.assertTrue(artifact.status == '504')
+
+    def test_async_linker(self):
+        kernel.max_in_flight = 4
+        artifact = asyncio.run(kernel.async_linker(SyntaxTree.new_from_text('repite hola'), self.tricks))
+        self.assertTrue(artifact.status == '200')
+        self.assertTrue(sorted(self.parsed_texts) == sorted(['repite hola', 'hola', 'eco hola', 'adiós']))
+
+    def test_async_linker_deadline(self):
+        kernel.document_deadline = 0.05
+        artifact = asyncio.run(kernel.async_linker(SyntaxTree.new_from_text('repite hola'), [slow_trick]))
+        self.assertTrue(artifact.status == '504')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import gc
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = list(metrics.registry)
+
+    def tearDown(self):
+        metrics.registry[:] = self.registry
+
+    def test_counter_shards(self):
+        counter = metrics.Counter('test_total', 'Test.', ['route'])
+
+        def hit(_):
+            for _ in range(1000):
+                counter.inc('/a')
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(hit, range(8)))
+        counter.inc('/b', amount=2)
+        self.assertTrue(counter.value('/a') == 8000 and counter.totals() == {('/a', ): 8000, ('/b', ): 2})
+
+    def test_gauge_among_threads(self):
+        gauge = metrics.Gauge('test_in_flight', 'Test.')
+        gauge.inc()
+        with ThreadPoolExecutor(1) as pool:
+            pool.submit(gauge.dec).result()
+        self.assertTrue(gauge.value() == 0)
+
+    def test_finished_threads(self):
+        counter = metrics.Counter('test_total', 'Test.')
+        histogram = metrics.Histogram('test_seconds', 'Test.', buckets=(1, ))
+        for _ in range(200):  # A thread per request.
+            thread = threading.Thread(target=lambda: (counter.inc(), histogram.observe(0.5)))
+            thread.start()
+            thread.join()
+        gc.collect()
+        self.assertTrue(len(counter._shards) < 10 and len(histogram._shards) < 10)
+        self.assertTrue(counter.value() == 200 and histogram.totals() == {(): [200, 0, 100.0]})
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ['route'], buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, '/a')
+        with histogram.time('/b'):
+            pass
+        samples = {suffix + labels: value for suffix, labels, value in histogram.samples()}
+        self.assertTrue(samples['_bucket{route="/a",le="0.1"}'] == 2 and samples['_bucket{route="/a",le="1"}'] == 3)
+        self.assertTrue(samples['_bucket{route="/a",le="+Inf"}'] == 4 and samples['_count{route="/a"}'] == 4)
+        self.assertTrue(samples['_sum{route="/a"}'] == 3.65 and histogram.count('/b') == 1)
+
+    def test_exposition(self):
+        metrics.registry[:] = []
+        counter = metrics.Counter('test_total', 'Test "calls".', ['route'])
+        counter.inc('/v1/"x"')
+        metrics.CallbackMetric('test_ratio', 'Test.', lambda: 0.5)
+        metrics.CallbackMetric('test_missing', 'Test.', lambda: None)
+        with self.assertRaises(KeyError):
+            with metrics._Call(counter, counter, metrics.Histogram('test_seconds', 'Test.'), ('/e', )):
+                raise KeyError('e')
+        text = metrics.exposition()
+        self.assertTrue('# TYPE test_total counter\ntest_total{route="/e"} 2\ntest_total{route="/v1/\\"x\\""} 1\n'
+                        in text)
+        self.assertTrue('test_ratio 0.5\n' in text and 'test_seconds_count 1\n' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
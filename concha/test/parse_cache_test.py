@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import time
+import tempfile
+import unittest
+from parse_cache import ParseCache
+from syntax_tree import SyntaxTree
+
+a_tree_txt = '\
+1	mi	_	det	_	Number=Sing|Person=1|Poss=Yes|PronType=Prs|fPOS=det++	2	det	_	_\n\
+2	mamá	_	noun	_	Gender=Fem|Number=Sing|fPOS=noun++	4	nsubj	_	_\n\
+3	me	_	pron	_	Case=Acc,Dat|Number=Sing|Person=1|PrepCase=Npr|PronType=Prs|Reflex=Yes|fPOS=pron++	4	iobj	_	_\n\
+4	mima	_	verb	_	Mood=Ind|Number=Sing|Person=1|Tense=Past|VerbForm=Fin|fPOS=verb++	0	root	_	_\n\
+\n\
+'
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = SyntaxTree().parse_connl(a_tree_txt)
+
+    def test_hit_and_miss(self):
+        cache = ParseCache()
+        key = cache.key('mi mamá  me mima ', 'es', 'localhost:7000')
+        self.assertTrue(cache.get(key) is None)
+        cache.put(key, self.tree)
+        self.assertTrue(cache.get(cache.key('mi mamá me mima', 'es', 'localhost:7000')) == self.tree)
+        self.assertTrue(cache.get(cache.key('mi mamá me mima', 'en', 'localhost:7000')) is None)
+        self.assertTrue(cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2)
+
+    def test_copies(self):
+        cache = ParseCache()
+        key = cache.key('mi mamá me mima', 'es', 'localhost:7000')
+        cache.put(key, self.tree)
+        cached = cache.get(key)
+        cached['root']['form'] = 'mina'
+        cached['root']['feats']['Tense'] = 'Pres'
+        self.assertTrue(cache.get(key)['root']['form'] == 'mima')
+        self.assertTrue(cache.get(key)['root']['feats']['Tense'] == 'Past')
+
+    def test_lru_eviction(self):
+        cache = ParseCache(max_entries=2)
+        for text in ('uno', 'dos', 'uno', 'tres'):
+            cache.put(cache.key(text, 'es', ''), self.tree)
+            cache.get(cache.key('uno', 'es', ''))
+        self.assertTrue(cache.get(cache.key('dos', 'es', '')) is None)
+        self.assertTrue(cache.get(cache.key('uno', 'es', '')) is not None)
+        self.assertTrue(cache.stats()['evictions'] == 1)
+
+    def test_bytes_bound(self):
+        cache = ParseCache(max_bytes=1)
+        cache.put(cache.key('uno', 'es', ''), self.tree)
+        self.assertTrue(cache.stats()['entries'] == 0)
+
+    def test_ttl(self):
+        cache = ParseCache(ttl=0.01)
+        cache.put(cache.key('uno', 'es', ''), self.tree)
+        time.sleep(0.02)
+        self.assertTrue(cache.get(cache.key('uno', 'es', '')) is None)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            ParseCache(directory=directory).put(ParseCache.key('uno', 'es', ''), self.tree)
+            warm = ParseCache(directory=directory)
+            cached = warm.get(ParseCache.key('uno', 'es', ''))
+            self.assertTrue(isinstance(cached['root']['nsubj'], SyntaxTree))
+            self.assertTrue('{root}'.format_map(cached) == 'mi mamá me mima')
+            self.assertTrue(warm.stats()['disk_hits'] == 1)
+
+    def test_disk_tier_bounds(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ParseCache(max_entries=1, directory=directory, max_disk_entries=2)
+            for text in ('uno', 'dos', 'tres'):
+                cache.put(ParseCache.key(text, 'es', ''), self.tree)
+                cache.get(ParseCache.key('uno', 'es', ''))
+            self.assertTrue(len(os.listdir(directory)) == 2 and cache.stats()['disk_evictions'] == 1)
+            warm = ParseCache(max_entries=1, directory=directory, max_disk_bytes=cache.stats()['disk_bytes'] - 1)
+            self.assertTrue(warm.stats()['disk_entries'] == 1 and warm.get(ParseCache.key('dos', 'es', '')) is None)
+            self.assertTrue(warm.get(ParseCache.key('tres', 'es', '')) is not None)
+
+
+if __name__ == '__main__':
+    unittest.main()
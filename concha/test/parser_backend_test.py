@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import tempfile
+import time
+import unittest
+import kernel
+from concurrent.futures import ThreadPoolExecutor
+from parse_cache import ParseCache
+from trick import TrickDomain
+from parser_backend import WorkerPool, stub_command, model_directory
+from syntax_tree import SyntaxTree
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(stub_command(load_seconds=0.3), size=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_parse(self):
+        connl = self.pool.parse('repite\nhola  mundo')
+        tree = SyntaxTree().parse_connl(connl)
+        self.assertTrue(tree['root']['form'] == 'repite' and tree['root']['obj']['obj']['form'] == 'mundo')
+        with self.assertRaises(ValueError):
+            self.pool.parse(' ')
+
+    def test_model_loaded_once(self):
+        self.pool.parse('hola')
+        start = time.monotonic()
+        for _ in range(20):
+            self.pool.parse('hola')
+        self.assertTrue(time.monotonic() - start < 0.3 and self.pool.stats()['workers'] == 1)
+
+    def test_concurrent_workers(self):
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(self.pool.parse, ['uno dos'] * 8))
+        self.assertTrue(all(result.count('\n') == 2 for result in results))
+        self.assertTrue(self.pool.stats()['workers'] <= 2 and self.pool.stats()['parsings'] == 8)
+
+    def test_worker_restart(self):
+        self.pool.parse('hola')
+        worker = self.pool._idle.get_nowait()
+        worker.process.kill()
+        worker.process.wait()
+        self.pool._idle.put(worker)
+        self.assertTrue('hola' in self.pool.parse('hola') and self.pool.stats()['failures'] == 1)
+
+    def test_parse_timeout(self):
+        pool = WorkerPool(stub_command(load_seconds=30), size=1, parse_timeout=0.5)
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            pool.parse('hola')
+        self.assertTrue(time.monotonic() - start < 5 and pool.stats()['workers'] == 0)
+        self.assertTrue(pool.stats()['failures'] == 1)
+
+    def test_syntax_tree_backend(self):
+        SyntaxTree.backend = self.pool
+        try:
+            tree = SyntaxTree.new_from_text('repite hola.')
+            self.assertTrue(tree['root']['obj']['obj']['form'] == '.')  # Tokenized punctuation.
+            self.assertTrue(len(SyntaxTree.new_many_from_texts(['uno', 'dos'])) == 2)
+        finally:
+            SyntaxTree.backend = None
+
+    def test_deep_tree(self):
+        text = 'repite ' + ' '.join('x{}'.format(i) for i in range(3000))  # The stub parses a 3001 node chain.
+        SyntaxTree.backend = self.pool
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                SyntaxTree.cache = ParseCache(directory=directory)
+                tree = SyntaxTree.new_from_text(text)
+                self.assertTrue(SyntaxTree.new_from_text(text) == tree and SyntaxTree.cache.stats()['hits'] == 1)
+                key = ParseCache.key(text, SyntaxTree.language, SyntaxTree.locator)
+                self.assertTrue(ParseCache(directory=directory).get(key) == tree)  # Read back from the disk tier.
+                tricks = TrickDomain()
+                tricks.append({"given": {"root": {"form": "repite", "obj": {"form": "*algo"}}}, "then": {"200": "eco"}})
+                artifact = kernel.linker(tree, tricks)
+                self.assertTrue(artifact.status == '200' and '{root}'.format_map(artifact.tree) == 'eco')
+                self.assertTrue(kernel.linker(tree.deepcopy(), tricks).used_tricks == artifact.used_tricks)
+        finally:
+            SyntaxTree.backend = None
+            SyntaxTree.cache = None
+
+    def test_model_directory(self):
+        self.assertTrue(model_directory('es').endswith('lang_models/Spanish'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import json
+import tempfile
+import unittest
+import multiprocessing
+import concha
+import trick
+from shared_domain import SharedDomain
+from trick import TrickDomain
+
+a_trick = {"given": {"root": {"form": "repite", "obj": {"form": "*algo"}}}, "then": {"200": "{d[root][obj]}"}}
+other_trick = {"given": {"root": {"form": "hola"}}, "then": {"200": "adiós"}}
+error_trick = {"given": {"root": {"form": "*algo"}}, "when": {"method": "ERROR", "uri": ""},
+               "then": {"200": "no"}}
+
+
+def publish_other_trick(directory):
+    shared = SharedDomain(directory)
+    with shared.lock():
+        _, tricks, error_tricks = shared.load()
+        tricks = tricks.thaw()
+        tricks.append(other_trick)
+        shared.publish(tricks, error_tricks)
+
+
+class SharedDomainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        concha.reset()
+        trick.error_domain.clear()
+
+    def tearDown(self):
+        concha.reset()
+        trick.error_domain.clear()
+        self.directory.cleanup()
+
+    def test_publish(self):
+        writer, reader = SharedDomain(self.directory.name), SharedDomain(self.directory.name)
+        self.assertTrue(reader.version() == 0)
+        with writer.lock():
+            writer.publish(TrickDomain([a_trick, other_trick]), TrickDomain([error_trick]))
+        version, tricks, error_tricks = reader.load()
+        self.assertTrue(version == 1 and tricks == {0: a_trick, 1: other_trick} and tricks.next_id == 2)
+        self.assertTrue(error_tricks == {0: error_trick})
+        tricks = tricks.thaw()
+        del tricks[0]
+        with writer.lock():
+            writer.publish(tricks, error_tricks)
+            writer.publish(tricks, error_tricks)
+        self.assertTrue(reader.version() == 3 and reader.load()[1].next_id == 2)
+        self.assertTrue(sorted(os.listdir(self.directory.name)) ==
+                        ['domain-2.cnd', 'domain-3.cnd', 'lock', 'version'])  # Older ones are collected.
+
+    def test_other_process(self):
+        shared = SharedDomain(self.directory.name)
+        with shared.lock():
+            shared.publish(TrickDomain([a_trick]), TrickDomain())
+        process = multiprocessing.get_context('fork').Process(target=publish_other_trick,
+                                                              args=(self.directory.name, ))
+        process.start()
+        process.join()
+        self.assertTrue(shared.version() == 2 and shared.load()[1] == {0: a_trick, 1: other_trick})
+
+    def test_hot_swap(self):
+        concha.tricks.append(a_trick)
+        concha.share(SharedDomain(self.directory.name))
+        former_tricks = concha.tricks
+        other_worker = SharedDomain(self.directory.name)
+        with other_worker.lock():
+            _, tricks, error_tricks = other_worker.load()
+            self.assertTrue(tricks == {0: a_trick})
+            tricks = tricks.thaw()
+            tricks[0] = other_trick
+            other_worker.publish(tricks, error_tricks)
+        self.assertTrue(concha.tricks is former_tricks)
+        client = concha.app.test_client()
+        response = client.get('/v1/tricks/0')
+        self.assertTrue(json.loads(response.data) == other_trick)
+        self.assertTrue(former_tricks == {0: a_trick})  # Untouched, for the requests still using it.
+        response = client.post('/v1/tricks', data=json.dumps(error_trick), content_type='application/json')
+        self.assertTrue(response.status_code == 201)
+        _, tricks, error_tricks = other_worker.load()
+        self.assertTrue(other_worker.version() == 3 and tricks == {0: other_trick})
+        self.assertTrue(list(error_tricks.values()) == [error_trick])  # Error ids depend on former tests.
+        self.assertTrue(concha.shared_version == 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import json
+import tempfile
+import unittest
+import concha
+from storage import LogStorage, SQLiteStorage, new_storage
+from trick import TrickDomain
+
+a_trick = {"given": {"root": {"form": "repite", "obj": {"form": "*algo"}}}, "then": {"200": "{d[root][obj]}"}}
+other_trick = {"given": {"root": {"form": "hola"}}, "then": {"200": "adiós"}}
+
+
+class StorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def changes(self, storage):
+        storage.log('append', 0, a_trick)
+        storage.log('append', 1, other_trick)
+        storage.log('set', 0, other_trick)
+        storage.log('delete', 1)
+        storage.log('document', {'date': '2018-01-01 00:00:00', 'text': 'hola'})
+
+    def check(self, storage):
+        state = storage.load()
+        self.assertTrue(state['tricks'] == {0: other_trick} and state['next_ids']['tricks'] == 2)
+        self.assertTrue(state['documents'][0]['text'] == 'hola')
+
+    def test_log_replay(self):
+        storage = LogStorage(self.directory.name)
+        self.changes(storage)
+        storage.close()
+        storage = LogStorage(self.directory.name)
+        self.check(storage)
+        self.assertTrue(storage.stats()['startup']['replayed_changes'] == 5)
+
+    def test_log_snapshot(self):
+        storage = LogStorage(self.directory.name, snapshot_every=2)
+        storage.log('append', 0, a_trick)
+        self.assertTrue(storage.log('append', 1, a_trick))
+        storage.snapshot({
+            'tricks': {1: other_trick},
+            'error_tricks': {},
+            'next_ids': {'tricks': 2, 'error_tricks': 0},
+            'documents': []
+        })
+        storage.log('append', 2, a_trick)
+        with open(os.path.join(self.directory.name, 'changes.jsonl'), 'a') as log:
+            log.write('["append", {"giv')  # Torn write of a crash.
+        storage.close()
+        storage = LogStorage(self.directory.name)
+        self.assertTrue(storage.load()['tricks'] == {1: other_trick, 2: a_trick})
+        storage.log('append', 3, a_trick)  # Not appended to the torn line.
+        storage.close()
+        state = LogStorage(self.directory.name).load()
+        self.assertTrue(state['tricks'] == {1: other_trick, 2: a_trick, 3: a_trick})
+
+    def test_log_snapshot_crash(self):
+        storage = LogStorage(self.directory.name)
+        self.changes(storage)
+        storage._new_log = lambda generation: None  # Crash once the snapshot is replaced, keeping the log.
+        storage.snapshot(storage.load())
+        storage.close()
+        storage = LogStorage(self.directory.name)
+        self.check(storage)
+        self.assertTrue(len(storage.load()['documents']) == 1 and storage.stats()['startup']['replayed_changes'] == 0)
+        storage.log('append', 2, a_trick)
+        storage.close()
+        self.assertTrue(LogStorage(self.directory.name).load()['tricks'] == {0: other_trick, 2: a_trick})
+
+    def test_sqlite(self):
+        path = os.path.join(self.directory.name, 'concha.db')
+        storage = new_storage(path)
+        self.assertTrue(isinstance(storage, SQLiteStorage))
+        self.changes(storage)
+        storage.snapshot(storage.load())
+        storage.log('append', 2, a_trick)
+        storage.close()
+        state = SQLiteStorage(path).load()
+        self.assertTrue(state['tricks'] == {0: other_trick, 2: a_trick})
+
+    def test_restore(self):
+        storage = LogStorage(self.directory.name)
+        self.changes(storage)
+        concha.restore(storage)
+        try:
+            self.assertTrue(isinstance(concha.tricks, TrickDomain) and concha.tricks == {0: other_trick})
+            with concha.app.test_client() as client:
+                rv = client.post('/v1/tricks', data=json.dumps(a_trick), content_type='application/json')
+            self.assertTrue(json.loads(rv.data)['id'] == 2)  # Deleted ids aren't given again.
+            self.assertTrue(LogStorage(self.directory.name).load()['tricks'] == {0: other_trick, 2: a_trick})
+        finally:
+            storage.close()
+            concha.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@
 __author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
 __version__ = '1.0'
 
+import json
 import unittest
 import syntax_tree
 
@@ -158,6 +159,21 @@ class SyntaxTreeGcnlTest(unittest.TestCase):
         self.assertTrue(self.tree['root']['nsubj']['form'] == 'mamá')
         self.assertTrue(self.tree['root']['nsubj']['det']['form'] == 'mi')
 
+    def test_parse_keeps_json(self):
+        gcnl_json = json.loads(json.dumps(a_gcnl_tree))
+        syntax_tree.SyntaxTree().parse_gcnl(gcnl_json)
+        self.assertTrue(gcnl_json == json.loads(json.dumps(a_gcnl_tree)))
+
+    def test_parse_deep(self):
+        tokens = [{
+            'text': {'content': 'x{}'.format(i)},
+            'partOfSpeech': {'tag': 'x'},
+            'dependencyEdge': {'headTokenIndex': max(0, i - 1), 'label': 'root' if i == 0 else 'obj'},
+            'lemma': ''
+        } for i in range(5000)]
+        tree = syntax_tree.SyntaxTree().parse_gcnl({'tokens': tokens})
+        self.assertTrue(tree['root']['obj']['obj']['form'] == 'x2')
+
     def test_parse_fail(self):
         with self.assertRaises(syntax_tree.SyntaxTree.SyntaxError):
             bad_tree = syntax_tree.SyntaxTree()
@@ -195,15 +211,65 @@ class SyntaxTreeMatchingTest(unittest.TestCase):
             self.tree.matches({'root': {'form': 'mima', 'iobj': {'form': '~cosa'}}})
         )
 
+    def test_flatten(self):
+        flat_tree = self.tree.flatten()
+        self.assertTrue(sorted(flat_tree) == [('root', ), ('root', 'iobj'), ('root', 'nsubj'), ('root', 'nsubj', 'det')])
+        self.assertTrue(flat_tree[('root', 'nsubj', 'det')]['form'] == 'mi')
+
+    def test_hash(self):
+        copy = self.tree.deepcopy()
+        self.assertTrue(hash(copy) == hash(self.tree) and copy == self.tree)
+        self.assertTrue(len({self.tree: 1, copy: 2}) == 1)
+        copy['root']['iobj']['form'] = 'te'
+        self.assertTrue(hash(copy) != hash(self.tree) and copy != self.tree)
+        copy = self.tree.deepcopy()  # Copied with the cached hashes of the hashed tree.
+        copy['root']['iobj']['form'] = 'te'
+        self.assertTrue(hash(copy) != hash(self.tree) and copy == copy.deepcopy())
+        copy['root']['iobj']['form'] = 'me'
+        self.assertTrue(hash(copy) == hash(self.tree) and copy == self.tree)
+
+    def test_intern(self):
+        interned = syntax_tree.SyntaxTree.intern(self.tree)
+        self.assertTrue(interned == self.tree)
+        self.assertTrue(syntax_tree.SyntaxTree.intern(self.tree.deepcopy())['root'] is interned['root'])
+        self.assertTrue(interned.deepcopy()['root']['iobj'] is interned['root']['iobj'])
+        with self.assertRaises(TypeError):
+            interned['root']['form'] = 'mina'
+
     def test_to_string_replacing(self):
         context = {'d': self.tree}
         pointed = syntax_tree.SyntaxTree.point_to_content(context, 'd[root][iobj]')
         self.assertTrue(self.tree.to_string_replacing(pointed, 'te') == 'mi mamá te mima')
 
+    def test_to_string_replacing_non_projective(self):
+        tree = syntax_tree.SyntaxTree().parse_connl('\n'.join('\t'.join([str(i), form, '_', 'X', '_', '_', head, label,
+                                                                      '_', '_']) for i, form, head, label in [
+            (1, 'a', '3', 'nsubj'), (2, 'b', '0', 'root'), (3, 'c', '2', 'obj'), (4, 'd', '1', 'det')]))
+        self.assertTrue(format(tree['root']) == 'a b c d')
+        self.assertTrue(tree.to_string_replacing(tree['root']['obj']['nsubj'], 'x') == 'x b c')
+        self.assertTrue(tree.to_string_replacing(tree['root']['obj'], 'x') == 'b x')
+
+    def test_grafting(self):
+        replacement = syntax_tree.SyntaxTree().parse_connl(
+            '1	la	_	det	_	_	2	det	_	_\n2	tía	_	noun	_	_	0	root	_	_\n3	buena	_	adj	_	_	2	amod	_	_')
+        grafted = self.tree.grafting(self.tree['root']['nsubj'], replacement)
+        self.assertTrue(format(grafted['root']) == 'la tía buena me mima')
+        self.assertTrue([node['id'] for node in (grafted['root'], grafted['root']['iobj'])] == [4, 3])
+        self.assertTrue(grafted['root']['nsubj']['amod']['id'] == 2 and self.tree['root']['nsubj']['form'] == 'mamá')
+        self.assertTrue(self.tree.grafting(self.tree['root']['iobj'], replacement) is None)  # 'pron' is not a 'noun'.
+
     def test_format(self):
         txt = '{root[nsubj]} es muy mimosa'.format_map(self.tree)
         self.assertTrue(txt == 'mi mamá es muy mimosa')
 
+    def test_format_cached(self):
+        tokens = self.tree['root'].tokens()
+        self.assertTrue([form for _, form in tokens] == ['mi', 'mamá', 'me', 'mima'])
+        self.assertTrue(self.tree['root'].tokens() is tokens and format(self.tree['root']) == 'mi mamá me mima')
+        self.tree['root']['nsubj']['det']['form'] = 'tu'
+        self.assertTrue(format(self.tree['root']) == 'tu mamá me mima')
+        self.assertTrue(format(self.tree['root']['nsubj']) == 'tu mamá')
+
     def test_format_2ndp_not_found(self):
         with self.assertRaises(KeyError):
             '{root[wrong]} es muy mimosa'.format_map(self.tree)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import os
+import json
+import tempfile
+import unittest
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+
+
+class TracingTest(unittest.TestCase):
+
+    def test_untraced(self):
+        with tracing.span('linker') as span:
+            tracing.annotate(status='200')
+        self.assertTrue(span is tracing.span('other') and tracing.nesting('linker') == 0)
+
+    def test_nested_spans(self):
+        with tracing.traced('document', id=7) as trace:
+            with tracing.span('linker', level=tracing.nesting('linker')):
+                with tracing.span('linker', level=tracing.nesting('linker')):
+                    tracing.annotate(status='200')
+        spans = {(name, attributes.get('level')): attributes for name, _, _, _, attributes in trace.spans}
+        self.assertTrue(spans[('linker', 1)]['status'] == '200' and ('linker', 0) in spans)
+        self.assertTrue(spans[('document', None)] == {'id': 7})
+        self.assertTrue(trace.breakdown()['linker']['count'] == 2)
+
+    def test_threads_inheriting_context(self):
+        with tracing.traced() as trace:
+            with tracing.span('linker'):
+                with ThreadPoolExecutor(2) as pool:
+                    level = pool.submit(contextvars.copy_context().run, tracing.nesting, 'linker').result()
+                    pool.submit(contextvars.copy_context().run, lambda: tracing.span('compiler').__enter__()
+                                .__exit__(None, None, None)).result()
+        self.assertTrue(level == 1 and 'compiler' in trace.breakdown())
+
+    def test_chrome_export(self):
+        with tracing.traced() as trace:
+            with self.assertRaises(KeyError):
+                with tracing.span('compiler', trick=0):
+                    raise KeyError('r')
+        chrome = trace.to_chrome()
+        self.assertTrue([event['name'] for event in chrome['traceEvents']] == ['document', 'compiler'])
+        self.assertTrue(all(event['ph'] == 'X' and event['dur'] >= 0 for event in chrome['traceEvents']))
+        self.assertTrue(chrome['traceEvents'][1]['args'] == {'trick': 0, 'error': 'KeyError'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = tracing.save(trace, 3, directory)
+            self.assertTrue(os.path.basename(path) == 'document-3.json')
+            with open(path) as trace_file:
+                self.assertTrue(json.load(trace_file) == json.loads(json.dumps(chrome)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import asyncio
+import threading
+import unittest
+from flask import Flask, request, jsonify
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Local keep-alive server failing the first call to /flaky."""
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+
+    def do_GET(self):
+        if self.path == '/flaky' and Handler.failures == 0:
+            Handler.failures += 1
+            self.reply(503, b'{}')
+        else:
+            self.reply(200, b'{"ok": true}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.reply(503 if self.path == '/flaky' else 200, b'{}')
+
+    def reply(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        Handler.failures = 0
+        transport.configure(backoff=0)
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        transport.reset()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertTrue(transport.get(self.url + '/').status_code == 200)
+        transport.post(self.url + '/', json={})
+        pool = transport.stats()['pools']['http://127.0.0.1:{}'.format(self.server.server_port)]
+        self.assertTrue(pool['connections_opened'] == 1)
+        self.assertTrue(pool['requests'] == 4)
+        self.assertTrue(transport.stats()['requests'] == 4)
+
+    def test_idempotent_retry(self):
+        self.assertTrue(transport.get(self.url + '/flaky').status_code == 200)
+        self.assertTrue(transport.post(self.url + '/flaky', json={}).status_code == 503)
+
+    def test_mount(self):
+        app = Flask(__name__)
+
+        @app.route('/echo', methods=['POST'])
+        def echo():
+            return jsonify({'echo': request.json, 'query': request.args.get('q')})
+
+        transport.mount('http://in-process/', app)
+        try:
+            response = transport.post('http://in-process/echo?q=1', json={'a': 'ñ'})
+            self.assertTrue(response.status_code == 200 and response.json() == {'echo': {'a': 'ñ'}, 'query': '1'})
+            self.assertTrue(transport.get('http://in-process/missing').status_code == 404)
+            response = asyncio.run(transport.async_request('POST', 'http://in-process/echo', json=[1]))
+            self.assertTrue(response.status_code == 200 and '"echo":[1]' in response.text.replace(' ', ''))
+            self.assertTrue(transport.get(self.url + '/').status_code == 200)  # Other hosts are still remote.
+        finally:
+            transport.unmount()
+
+    def test_unknown_setting(self):
+        with self.assertRaises(TypeError):
+            transport.configure(pool_sice=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
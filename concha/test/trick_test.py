@@ -61,6 +61,34 @@ b_trick = {
     }
 }
 
+c_trick = {
+    "given": {
+        "root": {
+            "form": "*algo",
+            "nsubj": {
+                "form": "~mamá"
+            }
+        }
+    },
+    "then": {
+        "200": "{d[root][nsubj]}"
+    }
+}
+
+d_trick = {
+    "given": {
+        "root": {
+            "form": "*algo",
+            "dobj": {
+                "form": "*alguien"
+            }
+        }
+    },
+    "then": {
+        "200": "{d[root][dobj]}"
+    }
+}
+
 
 class TrickTest(unittest.TestCase):
 
@@ -85,6 +113,86 @@ class TrickTest(unittest.TestCase):
         self.assertTrue(len(matched_tricks) == 1)
         self.assertTrue(self.domain[0]['given']['root']['iobj']['form'] == '*alguien')
 
+    def test_match_tricks_indexed(self):
+        domain = trick.TrickDomain([b_trick, a_trick, c_trick, d_trick])
+        tree = SyntaxTree()
+        tree.parse_connl(a_tree_txt)
+        self.assertTrue(domain.candidates(tree) == [1, 2])
+        self.assertTrue(trick.match_tricks(tree, domain) == trick.match_tricks(tree, list(domain.values())) == [1, 2])
+
+    def test_trick_domain_mutations(self):
+        domain = trick.TrickDomain()
+        trick.append_trick(a_trick, domain)
+        trick.append_trick(b_trick, domain)
+        tree = SyntaxTree()
+        tree.parse_connl(a_tree_txt)
+        del domain[0]
+        self.assertTrue(trick.match_tricks(tree, domain) == [])
+        self.assertTrue(trick.append_trick(a_trick, domain) == 2)  # Ids are never given again.
+        self.assertTrue(trick.match_tricks(tree, domain) == [2])
+        domain[1] = a_trick
+        self.assertTrue(trick.match_tricks(tree, domain) == [1, 2])
+        domain.clear()
+        self.assertTrue(trick.match_tricks(tree, domain) == [])
+
+    def test_tricks_errors(self):
+        tricks = [a_trick, {"then": {}}, 'not a trick'] * 3
+        expected = [trick.syntactic_trick_errors(x) if isinstance(x, dict) else None for x in tricks]
+        trick.validation_workers, trick.validation_chunk = 2, 2
+        try:
+            errors = trick.tricks_errors(tricks)
+        finally:
+            trick.validation_workers, trick.validation_chunk = 1, 256
+        self.assertTrue(errors[:2] == expected[:2] and errors[3:5] == expected[3:5])
+        self.assertTrue(errors[2] == ['Wrong trick construct: a JSON object is expected'])
+
+    def test_compiled_pattern(self):
+        tree = SyntaxTree()
+        tree.parse_connl(a_tree_txt)
+        flat_tree = tree.flatten()
+        for given in [
+                {'root': {'form': 'mima', 'iobj': {'form': 'me'}}},
+                {'root': {'form': 'mima', 'iobj': {'form': '~me'}}},
+                {'root': {'form': '*algo', 'nsubj': {'det': {'form': '*cosa'}}}},
+                {'root': {'form': 'mima', 'dobj': {'form': 'cosa'}}},
+                {'root': {'form': 'mima', 'iobj': {'form': 'cosa'}}},
+                {'root': {'form': 'mima', 'iobj': {'form': '~cosa'}}},
+                {'root': {'form': '*algo', 'nsubj': {'obj': {'form': '*cosa'}}}}]:
+            self.assertTrue(trick.CompiledPattern(given).matches(flat_tree) == tree.matches(given))
+
+    def test_compiled_pattern_checks(self):
+        pattern = trick.CompiledPattern({'root': {'form': '*algo', 'nsubj': {'form': 'mamá', 'det': {'form': '*'}}}})
+        self.assertTrue(pattern.literals == [(('root', 'nsubj'), 'mamá')])
+        self.assertTrue(pattern.paths == [('root', 'nsubj', 'det')])
+
+    def test_compiled_template(self):
+        tree = SyntaxTree()
+        tree.parse_connl(a_tree_txt)
+        context = {'d': tree, 'r': {'body': {'items': ['uno', 'dos']}}}
+        for template in ['{d[root][nsubj]} y {{d}}', 'http://x/{d[root][iobj][form]!r:>6}?q={r[body][items][1]}',
+                         '{d[root][dobj]}', '{d.x}', '{d[root]:{w}}', '{}', 'mal}', '{d!z}', 'sin campos']:
+            try:
+                expected = template.format_map(context)
+            except Exception as exception:
+                expected = repr(exception)
+            try:
+                rendered = trick.compile_template(template).render(context, {})
+            except Exception as exception:
+                rendered = repr(exception)
+            self.assertTrue(rendered == expected)
+        self.assertTrue(trick.compile_template('{d[root]}') is trick.compile_template('{d[root]}'))
+        self.assertTrue(trick.compile_template('{d[root]:{w}}').chunks is None)
+        texts = {}
+        trick.compile_template('{d[root][nsubj]}').render(context, texts)
+        self.assertTrue(list(texts.values()) == [(tree['root']['nsubj'], 'mi mamá')])
+
+    def test_document_errors(self):
+        given = {'root': {'form': 'mima', 'iobj': {'form': '*alguien'}}}
+        errors = trick.compile_template('{d[root][iobj]} {d[root][obj]} {r[root]} {dd}').document_errors(given)
+        self.assertTrue([repr(error) for error in errors] == ["KeyError('obj')", "KeyError('dd')"])
+        errors = trick.syntactic_trick_errors({'given': given, 'then': {'200': '{d[root][x]:{y}}'}})
+        self.assertTrue(errors == ['Wrong construct in "then" part coded "200": "unmatched \'{\' in format spec"'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'Trace', 'traced', 'span', 'annotate', 'nesting', 'save'
+]
+
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+trace_dir = None  # Directory every document trace is saved to as a Chrome trace file, if any.
+
+_trace = contextvars.ContextVar('trace', default=None)
+_current = contextvars.ContextVar('span', default=None)  # Innermost open span of the context.
+
+
+class Trace(object):
+    """Spans recorded while processing a document, by any thread or task inheriting the context."""
+
+    def __init__(self):
+        self.spans = []  # (name, start, end, thread id, attributes), in seconds since the trace origin.
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, attributes):
+        with self._lock:
+            self.spans.append((name, start - self._origin, end - self._origin, threading.get_ident(), attributes))
+
+    def to_chrome(self):
+        """Return the spans in the Chrome trace event format (chrome://tracing, Perfetto, speedscope)."""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'traceEvents': [{
+                'name': name,
+                'cat': 'concha',
+                'ph': 'X',  # Complete events, with their duration.
+                'ts': round(start * 1e6, 1),
+                'dur': round((end - start) * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': thread,
+                'args': attributes
+            } for name, start, end, thread, attributes in sorted(spans, key=lambda x: x[1])],
+            'displayTimeUnit': 'ms'
+        }
+
+    def breakdown(self):
+        """Return the count and seconds of the spans by name. Seconds of nested spans are inclusive."""
+        result = {}
+        with self._lock:
+            for name, start, end, _, _ in self.spans:
+                entry = result.setdefault(name, {'count': 0, 'seconds': 0.0})
+                entry['count'] += 1
+                entry['seconds'] += end - start
+        return result
+
+
+class _Span(object):
+    __slots__ = ('trace', 'name', 'attributes', 'parent', 'start', 'token')
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.parent = _current.get()
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        _current.reset(self.token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.trace.add(self.name, self.start, end, self.attributes)
+        return False
+
+
+class _NoSpan(object):
+    """Span of the untraced documents, doing nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **attributes):
+    """Return a context manager recording a span of the current trace, if the document is being traced."""
+    trace = _trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, attributes)
+
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def nesting(name):
+    """Return how many spans of the given name enclose the current point, i.e. the linker recursion level."""
+    level = 0
+    current = _current.get()
+    while current is not None:
+        level += current.name == name
+        current = current.parent
+    return level
+
+
+@contextmanager
+def traced(name='document', **attributes):
+    """Trace the enclosed processing, in a root span of the given name, yielding the Trace."""
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        with span(name, **attributes):
+            yield trace
+    finally:
+        _trace.reset(token)
+
+
+def save(trace, id_, directory=None):
+    """Write the trace as the document-<id>.json Chrome trace file of the directory (trace_dir by default)."""
+    directory = directory or trace_dir
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'document-{}.json'.format(id_))
+    with open(path, 'w', encoding='utf-8') as trace_file:
+        json.dump(trace.to_chrome(), trace_file, ensure_ascii=False)
+    return path
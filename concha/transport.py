@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+__all__ = [
+    'configure', 'request', 'post', 'get', 'put', 'delete', 'stats', 'reset', 'async_request', 'async_reset',
+    'mount', 'unmount', 'WSGIAdapter'
+]
+
+import asyncio
+import threading
+import aiohttp
+import requests
+from collections import namedtuple
+from urllib.parse import urlsplit
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util.retry import Retry
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+pool_hosts = 16  # Number of per-host pools kept alive.
+pool_size = 10  # Keep-alive connections per host.
+connect_timeout = 3.05
+read_timeout = 30
+retries = 2  # Only idempotent methods are retried after a request was sent.
+backoff = 0.2  # Seconds, doubled on every retry.
+
+_session = None
+_async_sessions = {}  # Event loop -> aiohttp session, as sessions can't be shared among loops.
+_lock = threading.Lock()
+_counters = {'requests': 0, 'errors': 0}
+_mounts = {}  # URL prefix -> WSGIAdapter serving it in-process.
+
+
+def configure(**kwargs):
+    """Change the transport settings (pool_hosts, pool_size, connect_timeout, read_timeout, retries, backoff)."""
+    for key, value in kwargs.items():
+        if key not in ('pool_hosts', 'pool_size', 'connect_timeout', 'read_timeout', 'retries', 'backoff'):
+            raise TypeError('Unknown transport setting "{}"'.format(key))
+        globals()[key] = value
+    reset()
+
+
+AsyncResponse = namedtuple('AsyncResponse', ['status_code', 'headers', 'text'])  # The used part of a Response.
+
+
+def reset():
+    """Close every pooled connection. A new session will be created on next request."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _counters.update({'requests': 0, 'errors': 0})
+
+
+def session():
+    """Return the shared keep-alive session, creating it if needed."""
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                backoff_factor=backoff,
+                allowed_methods=IDEMPOTENT_METHODS,
+                status_forcelist=RETRY_STATUSES,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            for prefix, wsgi_adapter in _mounts.items():
+                _session.mount(prefix, wsgi_adapter)
+        return _session
+
+
+class WSGIAdapter(BaseAdapter):
+    """Requests adapter calling a WSGI application (i.e. a Flask one) in-process, without any socket."""
+
+    def __init__(self, app):
+        super(WSGIAdapter, self).__init__()
+        self.app = app
+
+    def send(self, request_, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        from werkzeug.test import Client  # A Flask dependency, only needed by in-process services.
+        url = urlsplit(request_.url)
+        body = request_.body.encode('utf-8') if isinstance(request_.body, str) else request_.body
+        wsgi_response = Client(self.app).open(url.path, method=request_.method, query_string=url.query,
+                                              data=body, headers=dict(request_.headers))
+        response = requests.Response()
+        response.status_code = wsgi_response.status_code
+        response.reason = wsgi_response.status.partition(' ')[2]
+        response.headers = CaseInsensitiveDict(wsgi_response.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = wsgi_response.get_data()
+        response.url = request_.url
+        response.request = request_
+        return response
+
+    def close(self):
+        pass
+
+
+def mount(prefix, app):
+    """Serve the URLs starting with the prefix (i.e. 'http://localhost:7000/') by a WSGI application in-process.
+
+    Meant for tests and benchmarks. Asynchronous requests are served in the default executor.
+    """
+    _mounts[prefix] = WSGIAdapter(app)
+    reset()
+
+
+def unmount(prefix=None):
+    """Stop serving the prefix, or every one, in-process."""
+    if prefix is None:
+        _mounts.clear()
+    else:
+        _mounts.pop(prefix, None)
+    reset()
+
+
+def request(method, url, **kwargs):
+    """Send a request through the pooled session with the configured timeouts."""
+    kwargs.setdefault('timeout', (connect_timeout, read_timeout))
+    _count('requests')
+    try:
+        return session().request(method, url, **kwargs)
+    except requests.RequestException:
+        _count('errors')
+        raise
+
+
+def _count(counter):
+    with _lock:
+        _counters[counter] += 1
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+
+def stats():
+    """Return the request counters and the state of every per-host connection pool."""
+    with _lock:
+        result = dict(_counters)
+        adapters = set(_session.adapters.values()) if _session is not None else set()
+    result['pools'] = {}
+    for adapter in adapters:
+        if not isinstance(adapter, HTTPAdapter):
+            continue
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            result['pools']['{}://{}:{}'.format(pool.scheme, pool.host, pool.port)] = {
+                'size': pool.pool.maxsize if pool.pool else 0,
+                'idle': pool.pool.qsize() if pool.pool else 0,
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests
+            }
+    return result
+
+
+async def async_request(method, url, json=None):
+    """Send a request through the pooled aiohttp session of the running event loop.
+
+    Idempotent methods are retried with backoff on connection errors and RETRY_STATUSES, as in request().
+    """
+    if any(url.startswith(prefix) for prefix in _mounts):
+        response = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: request(method, url, **({'json': json} if json is not None else {})))
+        return AsyncResponse(response.status_code, response.headers, response.text)
+    attempts = retries + 1 if method in IDEMPOTENT_METHODS else 1
+    for attempt in range(attempts):
+        if attempt > 0:
+            await asyncio.sleep(backoff * (2 ** (attempt - 1)))
+        _count('requests')
+        try:
+            async with _async_session().request(method, url, json=json) as response:
+                result = AsyncResponse(response.status, response.headers, await response.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            _count('errors')
+            if attempt + 1 == attempts:
+                raise
+            continue
+        if result.status_code not in RETRY_STATUSES:
+            break
+    return result
+
+
+async def async_reset():
+    """Close the aiohttp session of the running event loop."""
+    session_ = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session_ is not None:
+        await session_.close()
+
+
+def _async_session():
+    loop = asyncio.get_running_loop()
+    session_ = _async_sessions.get(loop)
+    if session_ is None or session_.closed:
+        session_ = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_hosts * pool_size, limit_per_host=pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        )
+        _async_sessions[loop] = session_
+    return session_
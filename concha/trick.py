@@ -16,11 +16,32 @@
 __author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
 __version__ = '1.0'
 __all__ = [
-    'TrickError', 'append_trick', 'match_tricks', 'default_domain', 'error_domain', 'syntactic_trick_errors'
+    'TrickError', 'CompiledPattern', 'CompiledTemplate', 'TrickTemplates', 'compile_template', 'trick_templates',
+    'TrickIndex', 'IndexedTricks', 'TrickDomain', 'trick_ids', 'append_trick', 'match_tricks', 'default_domain', 'error_domain', 'syntactic_trick_errors',
+    'tricks_errors'
 ]
 
 from syntax_tree import SyntaxTree
+from concurrent.futures import ProcessPoolExecutor
 import re
+import _string
+import itertools
+import threading
+import tracing
+from string import Formatter
+from functools import lru_cache
+from collections import namedtuple
+from collections.abc import Mapping
+
+EXPRESSION = re.compile(r'\{d.*?\}')  # Document usages ({d[...]}) in 'when' and 'then' templates.
+CONVERSIONS = {'r': repr, 's': str, 'a': ascii}
+
+TrickTemplates = namedtuple('TrickTemplates', ['uri', 'then'])  # 'when' uri CompiledTemplate, 'then' ones by status.
+
+validation_workers = 1  # Processes validating big batches of tricks, 1 means in the calling thread.
+validation_chunk = 256  # Tricks validated per worker task.
+_validation_executor = None
+_validation_lock = threading.Lock()
 
 
 class TrickError(Exception):
@@ -36,54 +57,425 @@ class TrickError(Exception):
         self.message = message
 
 
-default_domain = []
-error_domain = []
+class CompiledPattern(object):
+    """A 'given' pattern compiled into a flat list of path checks, to be run on a SyntaxTree.flatten() dict.
+
+    Literal form checks go first, similar (~) forms are kept apart and wildcard (*) forms need no check
+    at all but the existence of their node, which is only verified when no deeper check implies it.
+    """
+    __slots__ = ('literals', 'similar', 'values', 'paths')
+
+    def __init__(self, given):
+        self.literals = []  # (path, form)
+        self.similar = []  # (path, form without '~')
+        self.values = []  # (path, key, value) for any other node attribute.
+        nodes = []
+        pending = [((label, ), node) for label, node in given.items()]
+        while pending:
+            path, node = pending.pop()
+            nodes.append(path)
+            for key, value in node.items():
+                if key == 'form':
+                    if value[:1] == '~':  # TODO: search for embeddings
+                        self.similar.append((path, value[1:]))
+                    elif value[:1] != '*':
+                        self.literals.append((path, value))
+                elif isinstance(value, dict):
+                    pending.append((path + (key, ), value))
+                else:
+                    self.values.append((path, key, value))
+        checked = {path for path, _ in self.literals + self.similar} | {path for path, _, _ in self.values}
+        implied = {path[:i] for path in nodes for i in range(1, len(path))}
+        self.paths = [path for path in nodes if path not in checked and path not in implied]
+        self.literals.sort(key=lambda check: len(check[0]))  # Shallow nodes discard faster.
+
+    def matches(self, flat_tree):
+        """Return if the flattened tree is equal or similar to the pattern."""
+        for path, form in self.literals:
+            node = flat_tree.get(path)
+            if node is None or node.get('form') != form:
+                return False
+        for path, form in self.similar:
+            node = flat_tree.get(path)
+            if node is None or node.get('form') != form:
+                return False
+        for path, key, value in self.values:
+            node = flat_tree.get(path)
+            if node is None or node.get(key) != value:
+                return False
+        for path in self.paths:
+            if path not in flat_tree:
+                return False
+        return True
+
+
+class CompiledTemplate(object):
+    """A 'when' uri or 'then' template compiled once into literal chunks and fields, rendered like format_map.
+
+    Fields are (name, accessors, conversion, format spec) tuples, their accessors being the (is attribute,
+    key) steps of paths like d[root][obj], so rendering neither parses the template nor its field names
+    again. Templates format_map can't render that way (i.e. with positional or nested fields, or wrong ones)
+    are rendered with format_map, raising the same errors.
+    """
+    __slots__ = ('template', 'chunks')
+
+    def __init__(self, template):
+        self.template = template
+        self.chunks = None  # None means rendering with format_map.
+        chunks = []
+        try:
+            for literal, field_name, format_spec, conversion in Formatter().parse(template):
+                if literal:
+                    chunks.append(literal)
+                if field_name is None:
+                    continue
+                name, accessors = _string.formatter_field_name_split(field_name)
+                if not isinstance(name, str) or not name or '{' in format_spec or \
+                        (conversion is not None and conversion not in CONVERSIONS):
+                    return
+                chunks.append((name, tuple(accessors), CONVERSIONS.get(conversion), format_spec))
+        except (ValueError, TypeError):
+            return
+        self.chunks = chunks
+
+    def render(self, context, texts=None):
+        """Return the template formatted with the context, memoizing the text of its subtrees in texts if given.
+
+        texts is a dict id(subtree) -> (subtree, text), keeping the subtrees so their ids are not reused.
+        """
+        if self.chunks is None:
+            return self.template.format_map(context)
+        parts = []
+        for chunk in self.chunks:
+            parts.append(chunk if isinstance(chunk, str) else CompiledTemplate._field_text(chunk, context, texts))
+        return ''.join(parts)
+
+    @staticmethod
+    def _field_text(field, context, texts=None):
+        name, accessors, conversion, format_spec = field
+        value = context[name]
+        for is_attribute, key in accessors:
+            value = getattr(value, key) if is_attribute else value[key]
+        if conversion is not None:
+            value = conversion(value)
+        if texts is None or format_spec or not isinstance(value, SyntaxTree):
+            return format(value, format_spec)
+        known = texts.get(id(value))
+        if known is None or known[0] is not value:
+            known = texts[id(value)] = (value, format(value, ''))
+        return known[1]
+
+    def document_errors(self, given):
+        """Return the exception raised by every document usage ({d[...]}) formatted with the given pattern."""
+        d = {'d': given}
+        if self.chunks is None:  # As format_map would render them one by one.
+            expressions = [(lambda e=e: e.format_map(d)) for e in EXPRESSION.findall(self.template)]
+        else:
+            expressions = [(lambda field=chunk: CompiledTemplate._field_text(field, d)) for chunk in self.chunks
+                           if not isinstance(chunk, str) and chunk[0].startswith('d')]
+        errors = []
+        for expression in expressions:
+            try:
+                expression()
+            except Exception as exception:
+                errors.append(exception)
+        return errors
+
+
+@lru_cache(maxsize=4096)
+def _cached_template(template):
+    return CompiledTemplate(template)
+
+
+def compile_template(template):
+    """Return the CompiledTemplate of a template, shared by every trick and validation using the same one."""
+    return _cached_template(template) if isinstance(template, str) else CompiledTemplate(template)
+
+
+def trick_templates(trick):
+    """Return the TrickTemplates of a trick, its uri one being None if it has no 'when' uri."""
+    when = trick.get('when')
+    uri = when.get('uri') if isinstance(when, dict) else None
+    then = trick.get('then')
+    return TrickTemplates(uri=None if uri is None else compile_template(uri),
+                          then={status: compile_template(template) for status, template in then.items()}
+                          if isinstance(then, dict) else {})
+
+
+class TrickIndex(object):
+    """Buckets of trick ids by the root 'form' of their 'given' pattern, to only verify a few candidates.
+
+    Literal forms are hashed, while wildcard (*) and similar (~) forms are kept in their own buckets. Every
+    bucket entry also keeps the top labels and the keys required in the root node of the pattern, so most
+    of the non matching tricks are discarded before running their CompiledPattern.
+    """
+
+    def __init__(self):
+        self.literals = {}  # (label, form) -> {trick id: (top labels, required keys)}
+        self.similar = {}  # trick id -> (top labels, required keys)
+        self.wildcards = {}  # trick id -> (top labels, required keys)
+        self.patterns = {}  # trick id -> CompiledPattern
+        self.templates = {}  # trick id -> TrickTemplates
+
+    def clear(self):
+        self.literals.clear()
+        self.similar.clear()
+        self.wildcards.clear()
+        self.patterns.clear()
+        self.templates.clear()
+
+    def rebuild(self, tricks):
+        self.clear()
+        for i, trick in tricks.items() if isinstance(tricks, dict) else enumerate(tricks):
+            self.add(i, trick)
+
+    def add(self, i, trick):
+        bucket, signature = self._bucket(trick, create=True)
+        bucket[i] = signature
+        self.patterns[i] = CompiledPattern(trick.get('given', {}))
+        self.templates[i] = trick_templates(trick)
+
+    def remove(self, i, trick):
+        bucket, signature = self._bucket(trick, create=False)
+        bucket.pop(i, None)
+        self.patterns.pop(i, None)
+        self.templates.pop(i, None)
+
+    def match(self, tree):
+        """Return the sorted ids of the tricks matching the tree, flattening it only once."""
+        flat_tree = tree.flatten()
+        return [i for i in self.candidates(tree) if self.patterns[i].matches(flat_tree)]
+
+    def candidates(self, tree):
+        """Return the sorted ids of the tricks which may match the tree."""
+        result = []
+        labels = tree.keys()
+        for label, node in tree.items():
+            keys = node.keys() if isinstance(node, dict) else ()
+            buckets = [self.similar, self.wildcards]
+            if 'form' in keys:
+                buckets.append(self.literals.get((label, node['form']), {}))
+            for bucket in buckets:
+                for i, (top_labels, required_keys) in bucket.items():
+                    if top_labels <= labels and (not top_labels or label in top_labels) and required_keys <= keys:
+                        result.append(i)
+        return sorted(set(result))
+
+    def _bucket(self, trick, create):
+        """Return the bucket and signature of a trick according to its 'given' pattern."""
+        given = trick.get('given', {})
+        top_labels = frozenset(given)
+        label = 'root' if 'root' in given else next(iter(given), None)
+        node = given[label] if label is not None and isinstance(given[label], dict) else {}
+        signature = top_labels, frozenset(node)
+        form = node.get('form', '*')
+        if form[:1] == '*':
+            return self.wildcards, signature
+        elif form[:1] == '~':
+            return self.similar, signature
+        elif create:
+            return self.literals.setdefault((label, form), {}), signature
+        else:
+            return self.literals.get((label, form), {}), signature
+
+
+_domain_uids = itertools.count()
+
+
+class IndexedTricks(Mapping):
+    """Trick domains by id with an index to match trees, and a version and revisions to invalidate results.
+
+    Besides the Mapping methods they have candidates(tree), match(tree), templates(id), next_id, version,
+    revisions (trick id -> version of its last change), http_tricks (tricks doing HTTP calls) and uid (never
+    reused by other domains). TrickDomain is the changeable one, while domain_snapshot.MappedDomain is read in
+    place from a snapshot.
+    """
+
+
+class TrickDomain(dict):
+    """Tricks by stable id, keeping its TrickIndex up to date on every change.
+
+    Ids are given in increasing order and never reused, so they keep referring to the same trick (i.e. in
+    used_tricks) whatever other tricks are deleted. Lookups, changes and deletions are O(1).
+    """
+
+    def __init__(self, tricks=(), next_id=0):
+        super(TrickDomain, self).__init__(tricks.items() if isinstance(tricks, dict) else enumerate(tricks))
+        self.next_id = max(next_id, max(self, default=-1) + 1)
+        self.index = TrickIndex()
+        self.index.rebuild(self)
+        self.version = 0  # Increased on every change, so derived results can be invalidated.
+        self.uid = TrickDomain.new_uid()
+        self.revisions = dict.fromkeys(self, 0)  # Trick id -> version of its last change.
+        self.http_tricks = sum(1 for trick in self.values() if _calls_http(trick))
+
+    @staticmethod
+    def new_uid():
+        """Return a domain uid. Unlike id(), it is never reused by a later domain (i.e. a hot swapped one)."""
+        return next(_domain_uids)
+
+    def append(self, trick):
+        """Add a trick returning its new id."""
+        id_ = self.next_id
+        self[id_] = trick
+        return id_
+
+    def extend(self, tricks):
+        for trick in tricks:
+            self.append(trick)
+
+    def __setitem__(self, id_, trick):
+        if id_ in self:
+            self._forget(id_, self[id_])
+        elif id_ >= self.next_id:
+            self.next_id = id_ + 1
+        super(TrickDomain, self).__setitem__(id_, trick)
+        self.index.add(id_, trick)
+        self.http_tricks += _calls_http(trick)
+        self.version += 1
+        self.revisions[id_] = self.version
+
+    def __delitem__(self, id_):
+        trick = self[id_]
+        super(TrickDomain, self).__delitem__(id_)
+        self._forget(id_, trick)
+        del self.revisions[id_]
+        self.version += 1
+
+    def _forget(self, id_, trick):
+        self.index.remove(id_, trick)
+        self.http_tricks -= _calls_http(trick)
+
+    def pop(self, id_, *default):
+        if id_ not in self and default:
+            return default[0]
+        trick = self[id_]
+        del self[id_]
+        return trick
+
+    def popitem(self):
+        id_ = next(reversed(self))
+        return id_, self.pop(id_)
+
+    def setdefault(self, id_, trick=None):
+        if id_ not in self:
+            self[id_] = trick
+        return self[id_]
+
+    def update(self, *args, **kwargs):
+        for id_, trick in dict(*args, **kwargs).items():
+            self[id_] = trick
+
+    def clear(self):
+        super(TrickDomain, self).clear()
+        self.index.clear()
+        self.revisions.clear()
+        self.http_tricks = 0
+        self.version += 1
+
+    def __reduce__(self):
+        return self.__class__, (dict(self), self.next_id)
+
+    def candidates(self, tree):
+        """Return the ids of the tricks which may match the tree, to be verified with SyntaxTree.matches."""
+        return self.index.candidates(tree)
+
+    def match(self, tree):
+        """Return the ids of the tricks matching the tree according to their compiled patterns."""
+        return self.index.match(tree)
+
+    def templates(self, id_):
+        """Return the TrickTemplates of a trick, compiled when it was added."""
+        return self.index.templates[id_]
+
+
+IndexedTricks.register(TrickDomain)
+
+
+def _calls_http(trick):
+    return 'when' in trick and trick['when'].get('method') in ('POST', 'PUT', 'GET', 'DELETE')
+
+
+def trick_ids(trick_domain):
+    """Return the trick ids of a TrickDomain, or the positions of a plain list of tricks."""
+    return list(trick_domain) if isinstance(trick_domain, Mapping) else list(range(len(trick_domain)))
+
+
+default_domain = TrickDomain()
+error_domain = TrickDomain()
 
 
 def reset():
     global default_domain
     global error_domain
-    default_domain = []
-    error_domain = []
+    default_domain = TrickDomain()
+    error_domain = TrickDomain()
 
 
 def append_trick(trick, trick_domain=default_domain):
-    """Adds a new trick in a given domain or to the error domain if it is a error handling trick."""
+    """Adds a new trick in a given domain or to the error domain if it is a error handling trick. Return its id."""
     if 'when' in trick:
         if 'method' in trick['when']:
             if trick['when']['method'] == 'ERROR':
                 trick_domain = error_domain
+    if isinstance(trick_domain, TrickDomain):
+        return trick_domain.append(trick)
     trick_domain.append(trick)
+    return len(trick_domain) - 1
 
 
 def match_tricks(tree: SyntaxTree, trick_domain=default_domain):
     """Identify the indexes of which tricks matches with provided CoNNL tree document."""
-    candidates = []
-    for i, trick in enumerate(trick_domain):
-        if tree.matches(trick['given']):
-            candidates.append(i)
-    return candidates
+    with tracing.span('match_tricks'):
+        if isinstance(trick_domain, IndexedTricks):
+            candidates = trick_domain.match(tree)
+        else:
+            candidates = []
+            for i, trick in enumerate(trick_domain):
+                if tree.matches(trick['given']):
+                    candidates.append(i)
+        tracing.annotate(candidates=len(candidates))
+        return candidates
 
 
 def syntactic_trick_errors(trick):
     """Verify trick structure and if 'when' and 'then' parts match in the document usage ({d[...]})"""
     result = []
     if 'given' in trick and 'then' in trick:
-        d = {'d': trick['given']}
         for k, v in trick['then'].items():
-            expressions = re.findall('\{d.*?\}',v)
-            for e in expressions:
-                try:
-                    x = e.format_map(d)
-                except Exception as exception:
-                    result.append('Wrong construct in "then" part coded "{}": "{}"'.format(k, exception))
+            for exception in compile_template(v).document_errors(trick['given']):
+                result.append('Wrong construct in "then" part coded "{}": "{}"'.format(k, exception))
         if 'when' in trick:
-            expressions = re.findall('\{d.*?\}',trick['when']['uri'])
-            for e in expressions:
-                try:
-                    x = e.format_map(d)
-                except Exception as exception:
-                    result.append('Wrong construct in "when" part: "{}"'.format(exception))
+            for exception in compile_template(trick['when']['uri']).document_errors(trick['given']):
+                result.append('Wrong construct in "when" part: "{}"'.format(exception))
     else:
         result.append('Wrong trick construct: missing "given" or "then" part')
     return result
+
+
+def tricks_errors(tricks):
+    """Return the syntactic_trick_errors of every trick, validating chunks of tricks in parallel processes.
+
+    Tricks which are not JSON objects or whose validation fails get an error instead of raising.
+    """
+    if validation_workers <= 1 or len(tricks) <= validation_chunk:
+        return _chunk_errors(tricks)
+    global _validation_executor
+    with _validation_lock:
+        if _validation_executor is None:
+            _validation_executor = ProcessPoolExecutor(max_workers=validation_workers)
+    chunks = [tricks[i:i + validation_chunk] for i in range(0, len(tricks), validation_chunk)]
+    return [errors for chunk_errors in _validation_executor.map(_chunk_errors, chunks) for errors in chunk_errors]
+
+
+def _chunk_errors(tricks):
+    result = []
+    for trick in tricks:
+        if not isinstance(trick, dict):
+            result.append(['Wrong trick construct: a JSON object is expected'])
+            continue
+        try:
+            result.append(syntactic_trick_errors(trick))
+        except Exception as exception:
+            result.append(['Wrong trick construct: "{}"'.format(exception)])
+    return result
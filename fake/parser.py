@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Deterministic fake of the analyzeSyntax parsing service, answering GCNL shaped tokens without any model.
+
+Words are split by blanks. The first one is the root and every other one hangs from a previous one: with a
+branching of 1 each word is the 'obj' of the former one ('repite hola' is {root: repite, obj: hola}), with
+a bigger branching every word has up to that many children labeled after LABELS, so trees get shallower.
+"""
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+from flask import Flask
+from flask import request, jsonify, abort
+import argparse
+
+LABELS = ['obj', 'nsubj', 'iobj', 'obl', 'advmod', 'amod', 'det', 'nmod']
+
+app = Flask(__name__)
+branching = 1  # Children of every word, up to len(LABELS).
+
+
+def analyze(text, branching_=None):
+    """Return the analyzeSyntax response of a text, the same for the same text and branching."""
+    branching_ = branching_ or branching
+    tokens = []
+    offset = 0
+    for i, word in enumerate(text.split()):
+        offset = text.index(word, offset)
+        head = 0 if i == 0 else (i - 1) // branching_
+        tokens.append({
+            'text': {'content': word, 'beginOffset': offset},
+            'partOfSpeech': {'tag': 'VERB' if i == 0 else 'NOUN', 'fPOS': 'VERB++' if i == 0 else 'NOUN++',
+                             'number': 'SINGULAR'},
+            'dependencyEdge': {'headTokenIndex': head, 'label': 'root' if i == 0 else LABELS[(i - 1) % branching_]},
+            'lemma': word.lower()
+        })
+        offset += len(word)
+    return {'sentences': [{'text': {'content': text, 'beginOffset': 0}}] if tokens else [], 'tokens': tokens,
+            'language': 'es'}
+
+
+def analyze_request(body):
+    """Return the analyzeSyntax response of an analyzeSyntax request body, or None if it is wrong."""
+    try:
+        return analyze(body['document']['content'])
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+@app.route('/v1/documents:analyzeSyntax', methods=['POST'])
+def analyze_syntax():
+    result = analyze_request(request.json) if request.json else None
+    if result is None:
+        abort(400)
+    return jsonify(result)
+
+
+@app.route('/v1/documents:batchAnalyzeSyntax', methods=['POST'])
+def batch_analyze_syntax():
+    if not request.json or not isinstance(request.json.get('requests'), list):
+        abort(400)
+    responses = [analyze_request(body) for body in request.json['requests']]
+    if None in responses:
+        abort(400)
+    return jsonify({'responses': responses})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Exposes a HTTP fake deterministic parsing service.')
+    parser.add_argument('-i', '--ip', type=str, default='0.0.0.0',
+                        help='listen to the IP address')
+    parser.add_argument('-p', '--port', type=int, default=7000,
+                        help='listen to the port number')
+    parser.add_argument('-b', '--branching', type=int, default=1,
+                        help='children of every word, 1 chains every word as the object of the former one')
+    parser.add_argument('-X', '--debug', action="store_true",
+                        help='debug mode')
+    args = parser.parse_args()
+    branching = min(args.branching, len(LABELS))
+    app.run(host=args.ip, port=args.port, debug=args.debug)
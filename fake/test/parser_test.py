@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Pascual de Juan All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+__author__ = 'Pascual de Juan <pascual.dejuan@gmail.com>'
+__version__ = '1.0'
+
+import json
+import unittest
+import fake.parser as parser
+
+
+class ParserTestCase(unittest.TestCase):
+    def setUp(self):
+        parser.app.testing = True
+        self.app = parser.app.test_client()
+
+    def tearDown(self):
+        parser.branching = 1
+
+    def test_chain(self):
+        tokens = parser.analyze('repite  hola mundo')['tokens']
+        self.assertTrue([x['dependencyEdge']['headTokenIndex'] for x in tokens] == [0, 0, 1])
+        self.assertTrue([x['dependencyEdge']['label'] for x in tokens] == ['root', 'obj', 'obj'])
+        self.assertTrue([x['text']['beginOffset'] for x in tokens] == [0, 8, 13])
+
+    def test_branching(self):
+        parser.branching = 2
+        tokens = parser.analyze('a b c d e')['tokens']
+        self.assertTrue([x['dependencyEdge']['headTokenIndex'] for x in tokens] == [0, 0, 0, 1, 1])
+        self.assertTrue([x['dependencyEdge']['label'] for x in tokens] == ['root', 'obj', 'nsubj', 'obj', 'nsubj'])
+        self.assertTrue(parser.analyze('a b c d e') == parser.analyze('a b c d e'))
+
+    def test_analyze_syntax(self):
+        rv = self.app.post('/v1/documents:analyzeSyntax', data=json.dumps({'document': {'content': 'hola'}}),
+                           mimetype='application/json')
+        self.assertTrue(rv.status_code == 200 and json.loads(rv.data)['tokens'][0]['lemma'] == 'hola')
+        rv = self.app.post('/v1/documents:analyzeSyntax', data='{"text": "hola"}', mimetype='application/json')
+        self.assertTrue(rv.status_code == 400)
+
+    def test_batch_analyze_syntax(self):
+        body = {'requests': [{'document': {'content': text}} for text in ('uno', 'dos tres')]}
+        rv = self.app.post('/v1/documents:batchAnalyzeSyntax', data=json.dumps(body), mimetype='application/json')
+        responses = json.loads(rv.data)['responses']
+        self.assertTrue(rv.status_code == 200 and [len(x['tokens']) for x in responses] == [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()